@@ -0,0 +1,126 @@
+"""
+Cost- and latency-aware model cascade.
+
+Every item is first sent to a fast, cheap model; only results that are
+unparseable, low-confidence or borderline are escalated to the next, larger
+model. Per task and tier, the number of calls, escalations and total latency
+are recorded so the share of the corpus served by the fast model is visible.
+"""
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llm_concurrency import MalformedResponseError
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class CascadeConfig:
+    """
+    Models and escalation thresholds.
+
+    min_confidence: agreement scores with a lower self-reported confidence escalate.
+    borderline: agreement scores whose magnitude falls in this (low, high) band, between
+    "unrelated" and "agrees/disagrees", escalate; None disables the check.
+    min_narrative_words: shorter cluster narratives escalate.
+    """
+
+    def __init__(self, summary_models: Sequence[str] = ("gpt-4o-mini", "gpt-4"),
+                 narrative_models: Sequence[str] = ("gpt-4o-mini", "gpt-4"),
+                 scoring_models: Sequence[str] = ("gpt-4o-mini", "gpt-4o"),
+                 min_confidence: float = 0.7, borderline: Optional[Tuple[float, float]] = (0.1, 0.3),
+                 min_narrative_words: int = 200):
+        self.summary_models = list(summary_models)
+        self.narrative_models = list(narrative_models)
+        self.scoring_models = list(scoring_models)
+        self.min_confidence = min_confidence
+        self.borderline = borderline
+        self.min_narrative_words = min_narrative_words
+
+    def accept_summary(self, dimensions: Sequence[str]) -> Callable[[Dict[str, Any]], bool]:
+        """A summary is accepted when every dimension is present and filled in."""
+        def accept(summary: Dict[str, Any]) -> bool:
+            return all(summary.get(dimension) not in (None, "", [], {}) for dimension in dimensions)
+        return accept
+
+    def accept_narrative(self, narrative: str) -> bool:
+        return len(narrative.split()) >= self.min_narrative_words
+
+    def accept_score(self, result: Dict[str, float]) -> bool:
+        if result["confidence"] < self.min_confidence:
+            return False
+        if self.borderline is not None:
+            low, high = self.borderline
+            if low <= abs(result["score"]) <= high:
+                return False
+        return True
+
+
+class CascadeStats:
+    """Thread-safe per-task, per-model call counts, escalations and latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, task: str, model: str, latency: float, escalated: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault((task, model), {"calls": 0, "escalated": 0, "latency_seconds": 0.0})
+            stats["calls"] += 1
+            stats["escalated"] += int(escalated)
+            stats["latency_seconds"] += latency
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Stats by task and model, with the average latency per call."""
+        with self._lock:
+            result = {}
+            for (task, model), stats in self._stats.items():
+                entry = dict(stats)
+                entry["avg_latency_seconds"] = stats["latency_seconds"] / stats["calls"]
+                result.setdefault(task, {})[model] = entry
+            return result
+
+    def log_summary(self) -> None:
+        for task, models in self.summary().items():
+            for model, stats in models.items():
+                logger.info(f"Cascade {task} {model}: {stats['calls']} calls, {stats['escalated']} escalated, "
+                            f"{stats['avg_latency_seconds']:.2f}s/call")
+
+
+# Shared across all cascades in the process
+cascade_stats = CascadeStats()
+
+
+def run_cascade(task: str, models: List[str], call: Callable[[str], Any],
+                accept: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+    """
+    Call `call(model)` for each model in turn until a result is accepted.
+    Unparseable results (MalformedResponseError, JSONDecodeError) and results rejected by
+    `accept` move on to the next model; the last model's errors propagate.
+    Returns (result, accepted); the last model's result is returned even when rejected,
+    with accepted False, so callers can use it without caching it.
+    """
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        start = time.perf_counter()
+        try:
+            result = call(model)
+        except (MalformedResponseError, json.JSONDecodeError) as e:
+            cascade_stats.record(task, model, time.perf_counter() - start, escalated=not last)
+            if last:
+                raise
+            logger.debug(f"{task}: escalating from {model} after unparseable response: {e}")
+            continue
+        accepted = accept is None or accept(result)
+        cascade_stats.record(task, model, time.perf_counter() - start, escalated=not accepted and not last)
+        if accepted:
+            return result, True
+        if last:
+            logger.warning(f"{task}: result of the last model {model} was not accepted")
+            return result, False
+        logger.debug(f"{task}: escalating from {model}")
+    raise ValueError("run_cascade needs at least one model")
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Command line entry point for the narrative scripts.
+
+Each subcommand imports only what it needs, so light operations such as
+`combine` do not pay for torch, sklearn or the OpenAI client at startup.
+
+    python cli.py units --csv articles2.csv
+    python cli.py narratives --csv webset-articles_cut_sea_cables.csv
+    python cli.py topics --config topics.json --cache results.db
+    python cli.py map --scorer nli
+    python cli.py combine --timeline narrative_timeline
+    python cli.py archive-fetch --csv webset-articles_cut_sea_cables.csv && python cli.py archive-replay
+    python cli.py timeline --narrative 2 --start 2023-01-01 --end 2023-06-30
+    python cli.py dedup --csv webset-articles_cut_sea_cables.csv
+    python cli.py pipeline --articles webset-articles_cut_sea_cables.csv
+    python cli.py shard-init --db scoring.db && python cli.py shard-worker --db scoring.db
+    python cli.py shard-merge --db scoring.db
+    python cli.py --profile profiles units --csv articles2.csv
+"""
+import argparse
+import sys
+
+
+def add_cascade_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--cascade", action="store_true",
+                        help="Try a fast model first and escalate only inadequate results to a larger one")
+    parser.add_argument("--min-confidence", type=float, default=0.7,
+                        help="Cascade: escalate agreement scores with lower confidence")
+    parser.add_argument("--borderline", type=float, nargs=2, metavar=("LOW", "HIGH"), default=(0.1, 0.3),
+                        help="Cascade: escalate agreement scores whose magnitude falls in this band")
+    parser.add_argument("--min-narrative-words", type=int, default=200,
+                        help="Cascade: escalate shorter cluster narratives")
+
+
+def cascade_from_args(args: argparse.Namespace):
+    """CascadeConfig from the --cascade options, or None when the cascade is off."""
+    if not args.cascade:
+        return None
+    from cascade import CascadeConfig
+    return CascadeConfig(min_confidence=args.min_confidence, borderline=tuple(args.borderline),
+                         min_narrative_words=args.min_narrative_words)
+
+
+def log_cascade_summary(args: argparse.Namespace) -> None:
+    if args.cascade:
+        from cascade import cascade_stats
+        cascade_stats.log_summary()
+
+
+def run_units(args: argparse.Namespace) -> int:
+    from gen_narratives import NewsArticleProcessor
+    from prompts import prompt_stats
+
+    processor = NewsArticleProcessor(embedding_store_path=args.embedding_store)
+    results = processor.process_articles_from_csv(
+        args.csv, max_articles=args.max_articles,
+        boilerplate_min_articles=None if args.keep_boilerplate else args.boilerplate_min_articles,
+        collapse_boilerplate=not args.drop_boilerplate)
+    if "error" in results:
+        print(f"Error: {results['error']}")
+        return 1
+    if results['boilerplate']:
+        report = results['boilerplate']
+        print(f"Boilerplate removed: {report['removed_units']} units, {report['removed_tokens']} tokens")
+    print(f"Total text units: {results['total_units']}")
+    print(f"Number of clusters: {results['num_clusters']}")
+    processor.save_narratives_to_csv(results['narratives'], args.output)
+    prompt_stats.log_summary()
+    return 0
+
+
+def run_narratives(args: argparse.Namespace) -> int:
+    from gen_narratives2 import NarrativeGenerator
+    from prompts import prompt_stats
+
+    generator = NarrativeGenerator(max_concurrency=args.concurrency, embedding_store_path=args.embedding_store,
+                                   cascade=cascade_from_args(args))
+    results = generator.process_articles(args.csv, max_articles=args.max_articles, n_clusters=args.n_clusters)
+    if "error" in results:
+        print(f"Error: {results['error']}")
+        return 1
+    print(f"Total articles: {results['total_articles']}")
+    print(f"Number of clusters: {results['num_clusters']}")
+    if results['failed_articles']:
+        print(f"Failed to summarize: {sorted(results['failed_articles'])}")
+    generator.save_narratives_to_csv(results['narratives'], args.output)
+    prompt_stats.log_summary()
+    log_cascade_summary(args)
+    return 0
+
+
+def run_narratives_online(args: argparse.Namespace) -> int:
+    from gen_narratives2 import NarrativeGenerator
+    from prompts import prompt_stats
+
+    generator = NarrativeGenerator(max_concurrency=args.concurrency, embedding_store_path=args.embedding_store,
+                                   cascade=cascade_from_args(args))
+    results = generator.process_articles_online(args.csv, args.state, max_articles=args.max_articles,
+                                                novelty_threshold=args.novelty_threshold,
+                                                drift_threshold=args.drift_threshold)
+    if "error" in results:
+        print(f"Error: {results['error']}")
+        return 1
+    print(f"New articles: {results['new_articles']} (total {results['total_articles']})")
+    print(f"Number of clusters: {results['num_clusters']}")
+    print(f"Regenerated narratives: {results['regenerated_clusters']}")
+    if results['pending_clusters']:
+        print(f"Narratives to retry on the next run: {results['pending_clusters']}")
+    generator.save_narratives_to_csv(results['narratives'], args.output)
+    prompt_stats.log_summary()
+    log_cascade_summary(args)
+    return 0
+
+
+def run_topics(args: argparse.Namespace) -> int:
+    from topics import load_topics, run_topics as run_all_topics
+
+    topics = load_topics(args.config)
+    if args.only:
+        topics = [topic for topic in topics if topic.name in args.only]
+    results = run_all_topics(topics, max_workers=args.workers, embedding_store_path=args.embedding_store,
+                             cache_path=args.cache, cascade=cascade_from_args(args))
+    log_cascade_summary(args)
+    failed = 0
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name}: Error: {result['error']}")
+            failed += 1
+        else:
+            print(f"{name}: {result['total_articles']} articles, {result['num_clusters']} clusters")
+    return 1 if failed else 0
+
+
+def run_map(args: argparse.Namespace) -> int:
+    from map_narratives import NarrativeMapper
+    from prompts import prompt_stats
+
+    mapper = NarrativeMapper(scorer=args.scorer, cascade=cascade_from_args(args))
+    narratives = mapper.load_narratives(args.narratives)
+    articles = mapper.load_articles(args.articles)
+    if not narratives or not articles:
+        print("Error: failed to load narratives or articles")
+        return 1
+    mapper.calibrate_local_scorer(narratives, articles)
+    results = mapper.map_narratives_to_articles(narratives, articles)
+    mapper.save_results(results, args.output)
+    print(f"Completed mapping {len(narratives)} narratives to {len(articles)} articles.")
+    prompt_stats.log_summary()
+    log_cascade_summary(args)
+    return 0
+
+
+def run_combine(args: argparse.Namespace) -> int:
+    from combine import combine_data
+
+    return 0 if combine_data(args.mapping, args.articles, args.output, args.timeline) is not None else 1
+
+
+def run_timeline(args: argparse.Namespace) -> int:
+    from timeline_index import TimelineIndex
+
+    index = TimelineIndex(args.index)
+    if args.monthly:
+        if args.narrative is None:
+            print("Error: --monthly needs --narrative")
+            return 1
+        print(index.monthly_summary(args.narrative, args.start, args.end, args.location).to_string(index=False))
+    else:
+        print(index.query(args.narrative, args.start, args.end, args.location).to_string(index=False))
+    return 0
+
+
+def run_scores(args: argparse.Namespace) -> int:
+    import pandas as pd
+    from combine import normalize_media_location
+    from score_matrix import ScoreMatrix
+
+    matrix = ScoreMatrix.load(args.matrix)
+    print(f"Score matrix: {matrix.shape[0]} narratives x {matrix.shape[1]} articles")
+    print(pd.DataFrame(matrix.narrative_summary()).to_string(index=False))
+    if args.articles:
+        locations = pd.read_csv(args.articles)['Media Location'].apply(normalize_media_location)
+        groups = {i: loc for i, loc in locations.items() if isinstance(loc, str)}
+        print(pd.DataFrame(matrix.group_summary(groups)).to_string(index=False))
+    return 0
+
+
+def run_archive_fetch(args: argparse.Namespace) -> int:
+    from concurrent.futures import ThreadPoolExecutor
+    import pandas as pd
+    from gen_narratives import NewsArticleProcessor
+
+    urls = [url for url in pd.read_csv(args.csv)[args.url_column].dropna().unique() if isinstance(url, str)]
+    processor = NewsArticleProcessor(html_archive_path=args.archive)
+
+    def fetch(url: str) -> bool:
+        try:
+            processor.fetch_html(url)
+            return True
+        except Exception as e:
+            print(f"Failed to fetch {url}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        fetched = sum(executor.map(fetch, urls))
+    print(f"Archived {fetched} of {len(urls)} pages in {args.archive} ({len(processor.html_archive)} records)")
+    processor.html_archive.close()
+    return 0
+
+
+def run_archive_replay(args: argparse.Namespace) -> int:
+    import pandas as pd
+    from gen_narratives import extract_main_text
+    from html_archive import replay_extraction
+
+    try:
+        results = replay_extraction(args.archive, extract_main_text, workers=args.workers,
+                                    latest_only=not args.all_fetches)
+    except FileNotFoundError as e:
+        print(e)
+        return 1
+    pd.DataFrame(results, columns=['URL', 'fetched_at', 'Full Text of Article']).to_csv(args.output, index=False)
+    print(f"Extracted {len(results)} pages to {args.output}")
+    return 0
+
+
+def run_dedup(args: argparse.Namespace) -> int:
+    import pandas as pd
+    from dedup import NearDuplicateDetector, dedup_report
+
+    df = pd.read_csv(args.csv)
+    texts = {i: t for i, t in df['Full Text of Article'].items() if isinstance(t, str) and t}
+    report = dedup_report(NearDuplicateDetector(threshold=args.threshold).group(texts))
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+def run_embeddings(args: argparse.Namespace) -> int:
+    from embedding_store import EmbeddingStore
+
+    store = EmbeddingStore(args.store, args.dim)
+    if args.compact:
+        store.compact()
+    print(f"{len(store)} embeddings, {store.matrix().shape[0]} rows on disk")
+    store.close()
+    return 0
+
+
+def run_pipeline(args: argparse.Namespace) -> int:
+    from pipeline import build_pipeline, iter_articles
+
+    pipeline = build_pipeline(args.articles, n_clusters=args.n_clusters, llm_workers=args.llm_workers,
+                              local_mode=args.local_mode, queue_size=args.queue_size, timeline_dir=args.timeline)
+    pipeline.run(iter_articles(args.articles, args.max_articles))
+    return 0
+
+
+def run_shard_init(args: argparse.Namespace) -> int:
+    from shard_queue import init_queue
+
+    try:
+        shards = init_queue(args.db, args.narratives, args.articles, args.articles_per_shard, reset=args.reset,
+                            scorer=args.scorer)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Created {shards} shards in {args.db}")
+    return 0
+
+
+def run_shard_worker(args: argparse.Namespace) -> int:
+    from shard_queue import run_local, run_worker
+
+    try:
+        if args.processes > 1:
+            run_local(args.db, args.narratives, args.articles, workers=args.processes, scorer=args.scorer,
+                      lease_seconds=args.lease_seconds)
+        else:
+            run_worker(args.db, args.narratives, args.articles, scorer=args.scorer, lease_seconds=args.lease_seconds)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+def run_shard_merge(args: argparse.Namespace) -> int:
+    from shard_queue import merge_results
+
+    rows = merge_results(args.db, args.output)
+    print(f"Merged {rows} scores into {args.output}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Narrative analysis of news articles.")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="Profile the local compute stages and write cProfile, collapsed-stack and memory output to DIR")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    units = subparsers.add_parser("units", help="Cluster paragraphs of articles into sub-narratives")
+    units.add_argument("--csv", default="articles2.csv")
+    units.add_argument("--max-articles", type=int, default=10)
+    units.add_argument("--output", default="narratives.csv")
+    units.add_argument("--embedding-store", help="Memory-mapped embedding store to reuse embeddings across runs")
+    units.add_argument("--boilerplate-min-articles", type=int, default=3,
+                       help="Keep only one copy of units that occur in at least this many articles")
+    units.add_argument("--drop-boilerplate", action="store_true",
+                       help="Remove every copy of boilerplate units instead of keeping the first")
+    units.add_argument("--keep-boilerplate", action="store_true", help="Disable boilerplate removal")
+    units.set_defaults(func=run_units)
+
+    narratives = subparsers.add_parser("narratives", help="Summarize and cluster articles into narratives")
+    narratives.add_argument("--csv", default="webset-articles_cut_sea_cables.csv")
+    narratives.add_argument("--max-articles", type=int, default=10)
+    narratives.add_argument("--n-clusters", type=int, help="Fixed number of clusters (selected automatically if omitted)")
+    narratives.add_argument("--concurrency", type=int, default=8)
+    narratives.add_argument("--output", default="narratives.csv")
+    narratives.add_argument("--embedding-store", help="Memory-mapped embedding store to reuse embeddings across runs")
+    add_cascade_arguments(narratives)
+    narratives.set_defaults(func=run_narratives)
+
+    online = subparsers.add_parser("narratives-online", help="Incrementally cluster newly arrived articles")
+    online.add_argument("--csv", default="webset-articles_cut_sea_cables.csv")
+    online.add_argument("--state", default="narrative_state", help="Prefix of the .npz/.json clustering state")
+    online.add_argument("--max-articles", type=int)
+    online.add_argument("--novelty-threshold", type=float, default=0.8,
+                        help="Minimum cosine similarity to join an existing cluster")
+    online.add_argument("--drift-threshold", type=float, default=0.05,
+                        help="Centroid drift (cosine distance) that triggers narrative regeneration")
+    online.add_argument("--concurrency", type=int, default=8)
+    online.add_argument("--embedding-store")
+    online.add_argument("--output", default="narratives.csv")
+    add_cascade_arguments(online)
+    online.set_defaults(func=run_narratives_online)
+
+    topics = subparsers.add_parser("topics", help="Generate narratives for several topics concurrently")
+    topics.add_argument("--config", default="topics.json", help="JSON file with the topic configurations")
+    topics.add_argument("--only", action="append", help="Run only this topic (repeatable)")
+    topics.add_argument("--workers", type=int, default=16, help="LLM workers shared by all topics")
+    topics.add_argument("--embedding-store", help="Memory-mapped embedding store shared by all topics")
+    topics.add_argument("--cache", help="SQLite result cache shared by all topics and runs")
+    add_cascade_arguments(topics)
+    topics.set_defaults(func=run_topics)
+
+    mapping = subparsers.add_parser("map", help="Score agreement between narratives and articles")
+    mapping.add_argument("--articles", default="articles2.csv")
+    mapping.add_argument("--narratives", default="narratives.csv")
+    mapping.add_argument("--scorer", choices=["chat", "nli"], default="chat")
+    mapping.add_argument("--output", default="narrative_article_mapping.csv")
+    add_cascade_arguments(mapping)
+    mapping.set_defaults(func=run_map)
+
+    combine = subparsers.add_parser("combine", help="Join agreement scores with article metadata")
+    combine.add_argument("--mapping", default="narrative_article_mapping.csv")
+    combine.add_argument("--articles", default="articles2.csv")
+    combine.add_argument("--output", default="combined_narrative_articles.csv")
+    combine.add_argument("--timeline", help="Also write a narrative timeline index to this directory")
+    combine.set_defaults(func=run_combine)
+
+    timeline = subparsers.add_parser("timeline", help="Query a narrative timeline index")
+    timeline.add_argument("--index", default="narrative_timeline")
+    timeline.add_argument("--narrative", type=int)
+    timeline.add_argument("--start", help="First publication date to include (YYYY-MM-DD)")
+    timeline.add_argument("--end", help="Last publication date to include (YYYY-MM-DD)")
+    timeline.add_argument("--location", action="append", help="Media location to include (repeatable)")
+    timeline.add_argument("--monthly", action="store_true", help="Monthly count and mean score per location")
+    timeline.set_defaults(func=run_timeline)
+
+    scores = subparsers.add_parser("scores", help="Summarize a saved score matrix per narrative and location")
+    scores.add_argument("--matrix", default="narrative_article_mapping.npz")
+    scores.add_argument("--articles", help="Articles CSV for per-location statistics")
+    scores.set_defaults(func=run_scores)
+
+    archive_fetch = subparsers.add_parser("archive-fetch", help="Download article pages into the HTML archive")
+    archive_fetch.add_argument("--csv", default="webset-articles_cut_sea_cables.csv")
+    archive_fetch.add_argument("--url-column", default="URL")
+    archive_fetch.add_argument("--archive", default="html_archive.dat")
+    archive_fetch.add_argument("--workers", type=int, default=8)
+    archive_fetch.set_defaults(func=run_archive_fetch)
+
+    archive_replay = subparsers.add_parser("archive-replay", help="Re-run article extraction over the HTML archive")
+    archive_replay.add_argument("--archive", default="html_archive.dat")
+    archive_replay.add_argument("--output", default="extracted_articles.csv")
+    archive_replay.add_argument("--workers", type=int, help="Extraction processes (default: all CPUs)")
+    archive_replay.add_argument("--all-fetches", action="store_true", help="Extract every fetch, not only the newest per URL")
+    archive_replay.set_defaults(func=run_archive_replay)
+
+    dedup = subparsers.add_parser("dedup", help="Report near-duplicate articles")
+    dedup.add_argument("--csv", default="webset-articles_cut_sea_cables.csv")
+    dedup.add_argument("--threshold", type=float, default=0.8)
+    dedup.set_defaults(func=run_dedup)
+
+    embeddings = subparsers.add_parser("embeddings", help="Inspect or compact an embedding store")
+    embeddings.add_argument("store")
+    embeddings.add_argument("--dim", type=int, default=1536)
+    embeddings.add_argument("--compact", action="store_true")
+    embeddings.set_defaults(func=run_embeddings)
+
+    pipeline = subparsers.add_parser("pipeline", help="Run all stages as a streaming pipeline")
+    pipeline.add_argument("--articles", default="webset-articles_cut_sea_cables.csv")
+    pipeline.add_argument("--max-articles", type=int, default=10)
+    pipeline.add_argument("--n-clusters", type=int, help="Fixed number of clusters (selected automatically if omitted)")
+    pipeline.add_argument("--llm-workers", type=int, default=8)
+    pipeline.add_argument("--queue-size", type=int, default=32)
+    pipeline.add_argument("--local-mode", choices=["thread", "process"], default="thread")
+    pipeline.add_argument("--timeline", help="Also write a narrative timeline index to this directory")
+    pipeline.set_defaults(func=run_pipeline)
+
+    shard_init = subparsers.add_parser("shard-init", help="Partition the scoring pair space into a shard queue")
+    shard_init.add_argument("--db", default="scoring_shards.db")
+    shard_init.add_argument("--articles", default="articles2.csv")
+    shard_init.add_argument("--narratives", default="narratives.csv")
+    shard_init.add_argument("--articles-per-shard", type=int, default=50)
+    shard_init.add_argument("--reset", action="store_true", help="Replace the shards and results of an existing queue")
+    shard_init.add_argument("--scorer", choices=["chat", "nli"], default="chat",
+                            help="Scorer the workers will use; nli calibrates the local scorer once for all workers")
+    shard_init.set_defaults(func=run_shard_init)
+
+    shard_worker = subparsers.add_parser("shard-worker", help="Claim and score shards from the queue")
+    shard_worker.add_argument("--db", default="scoring_shards.db")
+    shard_worker.add_argument("--articles", default="articles2.csv")
+    shard_worker.add_argument("--narratives", default="narratives.csv")
+    shard_worker.add_argument("--scorer", choices=["chat", "nli"], default="chat")
+    shard_worker.add_argument("--processes", type=int, default=1, help="Worker processes to run on this host")
+    shard_worker.add_argument("--lease-seconds", type=float, default=600.0)
+    shard_worker.set_defaults(func=run_shard_worker)
+
+    shard_merge = subparsers.add_parser("shard-merge", help="Merge shard results into the mapping CSV")
+    shard_merge.add_argument("--db", default="scoring_shards.db")
+    shard_merge.add_argument("--output", default="narrative_article_mapping.csv")
+    shard_merge.set_defaults(func=run_shard_merge)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        from profiling import profiler
+        profiler.enable(args.profile)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
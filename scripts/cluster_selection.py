@@ -0,0 +1,166 @@
+"""
+Automatic selection of the number of clusters.
+
+The cosine distance matrix of (a sample of) the embeddings is computed once
+and shared by every candidate k; candidates are fitted in parallel in a
+pool of single-threaded worker processes and scored with a vectorized
+silhouette over that matrix, so a sweep over thousands of articles stays
+well under a second or two once the pool has started.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from profiling import profiled
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Candidates are fitted in worker processes shared by every sweep in the process (e.g. several topics
+# at once). Each worker limits its own BLAS/OpenMP pools to one thread, so fitting candidates in parallel
+# does not oversubscribe the CPU, while the parent process and other topics keep their thread pools.
+_pool_lock = threading.Lock()
+_pool = None
+_worker_limits = None
+
+
+def _limit_worker_threads() -> None:
+    """Worker initializer: load sklearn's OpenMP runtime, then limit every pool to one thread."""
+    global _worker_limits
+    import sklearn.cluster  # noqa: F401
+    from threadpoolctl import threadpool_limits
+
+    _worker_limits = threadpool_limits(limits=1)
+
+
+def _kmeans_pool() -> ProcessPoolExecutor:
+    """The shared KMeans worker pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process whose OpenMP runtime has started threads can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_limit_worker_threads)
+        return _pool
+
+
+def _fit_labels(projected: np.ndarray, k: int, random_state: int) -> np.ndarray:
+    from sklearn.cluster import KMeans
+    return KMeans(n_clusters=k, random_state=random_state, n_init=3).fit_predict(projected)
+
+
+def _fit_in_threads(projected: np.ndarray, candidates: List[int], max_workers: int,
+                    random_state: int) -> Dict[int, np.ndarray]:
+    """
+    KMeans labels per candidate k, fitted in threads of a daemon process (e.g. a pipeline process
+    stage), which may not start worker processes. The process runs nothing else, so its own pools
+    are limited to one thread meanwhile.
+    """
+    from threadpoolctl import threadpool_limits
+
+    with threadpool_limits(limits=1), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(candidates, executor.map(lambda k: _fit_labels(projected, k, random_state), candidates)))
+
+
+def _fit_in_workers(projected: np.ndarray, candidates: List[int], max_workers: int,
+                    random_state: int) -> Dict[int, np.ndarray]:
+    """KMeans labels per candidate k, fitted in the worker pool with at most max_workers in flight."""
+    pool = _kmeans_pool()
+    remaining = iter(candidates)
+    pending = {pool.submit(_fit_labels, projected, k, random_state): k
+               for k in itertools.islice(remaining, max_workers)}
+    labels = {}
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            labels[pending.pop(future)] = future.result()
+            for k in itertools.islice(remaining, 1):
+                pending[pool.submit(_fit_labels, projected, k, random_state)] = k
+    return labels
+
+
+def cosine_distance_matrix(embeddings: np.ndarray) -> np.ndarray:
+    """Pairwise cosine distances as float32."""
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    distances = 1.0 - normalized @ normalized.T
+    np.fill_diagonal(distances, 0.0)
+    return np.clip(distances, 0.0, 2.0, out=distances)
+
+
+def silhouette_from_distances(distances: np.ndarray, labels: np.ndarray) -> float:
+    """
+    Mean silhouette coefficient for a precomputed distance matrix.
+    Points in singleton clusters score 0, as in sklearn.
+    """
+    clusters, labels = np.unique(labels, return_inverse=True)
+    if len(clusters) < 2:
+        return -1.0
+    one_hot = np.zeros((len(labels), len(clusters)), dtype=distances.dtype)
+    one_hot[np.arange(len(labels)), labels] = 1.0
+    sizes = one_hot.sum(axis=0)
+    # Sum of distances from every point to every cluster, O(n^2 k) in one matrix product
+    totals = distances @ one_hot
+    own_size = sizes[labels] - 1
+    a = np.divide(totals[np.arange(len(labels)), labels], own_size, out=np.zeros(len(labels)), where=own_size > 0)
+    mean_to_others = totals / sizes
+    mean_to_others[np.arange(len(labels)), labels] = np.inf
+    b = mean_to_others.min(axis=1)
+    scores = np.where(own_size > 0, (b - a) / np.maximum(np.maximum(a, b), 1e-12), 0.0)
+    return float(scores.mean())
+
+
+@profiled("select_n_clusters")
+def select_n_clusters(embeddings: np.ndarray, k_min: int = 2, k_max: int = 10, sample_size: int = 2000,
+                      n_components: int = 64, max_workers: Optional[int] = None,
+                      random_state: int = 42) -> Tuple[List[int], int, Dict[int, float]]:
+    """
+    Pick the number of clusters with the best silhouette score.
+    Embeddings are normalized and projected once onto n_components principal components,
+    KMeans is fitted on the projection for every candidate k, up to max_workers at a time in the
+    shared worker processes, and silhouettes are computed on a random sample of at most
+    sample_size points from one shared distance matrix of the original embeddings.
+    Returns (labels, k, silhouette score per candidate k).
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    n = len(embeddings)
+    if n <= k_min:
+        return [0] * n, 1 if n else 0, {}
+    candidates = list(range(k_min, min(k_max, n - 1) + 1))
+
+    rng = np.random.RandomState(random_state)
+    sample = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+    distances = cosine_distance_matrix(embeddings[sample])
+
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    if normalized.shape[1] > n_components and n > n_components:
+        projected = PCA(n_components=n_components, svd_solver='randomized',
+                        random_state=random_state).fit_transform(normalized)
+    else:
+        projected = normalized
+
+    max_workers = max_workers or min(len(candidates), os.cpu_count() or 1)
+    if max_workers > 1 and multiprocessing.current_process().daemon:
+        labels = _fit_in_threads(projected, candidates, max_workers, random_state)
+    elif max_workers > 1:
+        labels = _fit_in_workers(projected, candidates, max_workers, random_state)
+    else:
+        labels = {k: KMeans(n_clusters=k, random_state=random_state, n_init=3).fit_predict(projected)
+                  for k in candidates}
+    results = [(k, labels[k], silhouette_from_distances(distances, labels[k][sample])) for k in candidates]
+
+    scores = {k: score for k, _, score in results}
+    best_k, best_labels, best_score = max(results, key=lambda result: result[2])
+    logger.info(f"Selected {best_k} clusters (silhouette {best_score:.3f}) from candidates {candidates}")
+    return best_labels.tolist(), best_k, scores
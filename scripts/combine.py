@@ -1,23 +1,48 @@
-import pandas as pd
 import logging
+import os
+from profiling import profiled
+from score_matrix import ScoreMatrix
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def combine_data():
+def normalize_media_location(location):
+    """Keep only the last part of a Media Location after the last comma (usually the country)."""
+    return location.split(',')[-1].strip().rstrip('.') if isinstance(location, str) else location
+
+def load_mapping(mapping_file: str) -> "pd.DataFrame":
+    """
+    Load the narrative/article scores, preferring the binary score matrix saved next to
+    the CSV (same name, .npz extension) when it is at least as new as the CSV.
+    """
+    import pandas as pd
+    matrix_file = os.path.splitext(mapping_file)[0] + ".npz"
+    if os.path.exists(matrix_file) and (not os.path.exists(mapping_file)
+                                        or os.path.getmtime(matrix_file) >= os.path.getmtime(mapping_file)):
+        logger.info(f"Loading {matrix_file}")
+        return pd.DataFrame(ScoreMatrix.load(matrix_file).to_long())
+    logger.info(f"Loading {mapping_file}")
+    return pd.read_csv(mapping_file)
+
+@profiled("combine_data")
+def combine_data(mapping_file: str = "narrative_article_mapping.csv",
+                 articles_file: str = "articles2.csv",
+                 output_file: str = "combined_narrative_articles.csv",
+                 timeline_dir: str = None):
     """
     Combine narrative_article_mapping.csv with articles2.csv and create a new CSV file
     with selected columns: narrative_id, article_id, agreement_score, Title, Media Location, Published Date
+    If timeline_dir is given, the combined table is also written there as a timeline index.
     """
+    import pandas as pd
     try:
         # Load the mapping data
-        logger.info("Loading narrative_article_mapping.csv")
-        mapping_df = pd.read_csv("narrative_article_mapping.csv")
+        mapping_df = load_mapping(mapping_file)
         
         # Load the articles data
-        logger.info("Loading articles2.csv")
-        articles_df = pd.read_csv("articles2.csv")
+        logger.info(f"Loading {articles_file}")
+        articles_df = pd.read_csv(articles_file)
         
         # Check if 'article_id' already exists in articles_df
         if 'article_id' in articles_df.columns:
@@ -28,28 +53,26 @@ def combine_data():
         articles_df = articles_df.reset_index().rename(columns={"index": "article_id"})
         
         # Process Media Location to get only the last part after the last comma
-        articles_df['Media Location'] = articles_df['Media Location'].apply(
-            lambda x: x.split(',')[-1].strip().rstrip('.') if isinstance(x, str) else x
-        )
+        articles_df['Media Location'] = articles_df['Media Location'].apply(normalize_media_location)
         
-        # Merge the dataframes on article_id
-        logger.info("Merging dataframes")
-        combined_df = pd.merge(
-            mapping_df,
-            articles_df[["article_id", "Title", "Media Location", "Published Date"]],
-            on="article_id",
-            how="left"
+        # Join article metadata by looking up each article_id (an index take rather than a hash merge)
+        logger.info("Joining article metadata")
+        metadata = articles_df.set_index("article_id")[["Title", "Media Location", "Published Date"]]
+        joined = metadata.reindex(mapping_df["article_id"].to_numpy())
+        result_df = pd.concat(
+            [mapping_df[["narrative_id", "article_id", "agreement_score"]].reset_index(drop=True),
+             joined.reset_index(drop=True)],
+            axis=1
         )
         
-        # Select only the required columns
-        result_df = combined_df[["narrative_id", "article_id", "agreement_score", "Title", "Media Location", "Published Date"]]
-        
         # Save the combined data to a new CSV file
-        output_file = "combined_narrative_articles.csv"
         logger.info(f"Saving combined data to {output_file}")
         result_df.to_csv(output_file, index=False)
         
         logger.info(f"Successfully combined data and saved to {output_file}")
+        if timeline_dir:
+            from timeline_index import build_timeline_index
+            build_timeline_index(result_df, timeline_dir)
         print(f"Combined data saved to {output_file}")
         
         return result_df
@@ -0,0 +1,228 @@
+"""
+Near-duplicate article detection with MinHash and locality-sensitive hashing.
+
+Syndicated wire stories appear many times in the webset CSV. Grouping
+near-identical article texts lets the pipeline summarize and score a single
+representative per group and fan its results back out to the other members.
+
+Within articles, scraped pages repeat boilerplate text units (cookie notices,
+subscription prompts, bylines, related-links blocks). BoilerplateFilter counts
+in how many articles each normalized unit occurs and keeps only the first copy
+of those that occur in many, before they are embedded and clustered.
+"""
+import hashlib
+import itertools
+import logging
+import math
+import re
+from typing import Any, Dict, Hashable, List, Tuple
+
+import numpy as np
+
+from profiling import profiled
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Mersenne prime used for the universal hash family
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _mul_mod_prime(a: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    (a * x) mod _PRIME elementwise for a < 2**61 and x < 2**32 without overflowing uint64:
+    a is split into 29 high and 32 low bits, and the high product is reduced with 2**61 = 1 (mod p).
+    """
+    a_high, a_low = a >> np.uint64(32), a & np.uint64(_MAX_HASH)
+    high = a_high * x                                          # < 2**61
+    high = (high >> np.uint64(29)) + ((high & np.uint64((1 << 29) - 1)) << np.uint64(32))  # high * 2**32 mod p
+    return (high + (a_low * x) % np.uint64(_PRIME)) % np.uint64(_PRIME)
+
+
+class NearDuplicateDetector:
+    """Groups texts whose word-shingle Jaccard similarity is estimated above a threshold."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: int = 32,
+                 shingle_size: int = 5, seed: int = 42):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a and b span the full field: with a < 2**32, a * x + b rarely wraps around the prime, so the
+        # permutations of small a are nearly monotone in x and their minima are strongly correlated
+        self._a = rng.randint(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """Hash the normalized word shingles of a text to 32-bit integers."""
+        words = re.findall(r'\w+', text.lower())
+        if len(words) < self.shingle_size:
+            grams = [" ".join(words)] if words else []
+        else:
+            grams = {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        hashes = [int.from_bytes(hashlib.blake2b(g.encode('utf-8'), digest_size=4).digest(), 'little') for g in grams]
+        return np.unique(np.array(hashes, dtype=np.uint64))
+
+    def signature(self, text: str) -> np.ndarray:
+        """Compute the MinHash signature of a text."""
+        shingles = self.shingles(text)
+        if shingles.size == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        # (num_perm, num_shingles) table of ((a * x + b) mod p) truncated to 32 bits, min over shingles
+        products = _mul_mod_prime(self._a[:, None], shingles[None, :])
+        hashed = ((products + self._b[:, None]) % np.uint64(_PRIME)) & np.uint64(_MAX_HASH)
+        return hashed.min(axis=1)
+
+    @profiled("near_duplicates")
+    def group(self, texts: Dict[Hashable, str]) -> Dict[Hashable, List[Hashable]]:
+        """
+        Group near-duplicate texts.
+        Returns a dictionary mapping each representative ID (the first ID of its
+        group in input order) to the list of all member IDs, representative first.
+        """
+        ids = list(texts.keys())
+        signatures = np.array([self.signature(texts[i]) for i in ids]).reshape(len(ids), self.num_perm)
+
+        # Each group's representative is its first member; members lists every group by representative index
+        representative = list(range(len(ids)))
+        members = {i: [i] for i in range(len(ids))}
+
+        def similarity(i: int, j: int) -> float:
+            return float(np.mean(signatures[i] == signatures[j]))
+
+        candidate_pairs = set()
+        for band in range(self.bands):
+            buckets = {}
+            band_rows = signatures[:, band * self.rows:(band + 1) * self.rows]
+            for i, row in enumerate(band_rows):
+                buckets.setdefault(row.tobytes(), []).append(i)
+            # Every pair in a bucket is a candidate: two members may both be far from the first one
+            for candidates in buckets.values():
+                candidate_pairs.update(itertools.combinations(candidates, 2))
+
+        # Pairs are merged in input order, so the result does not depend on the order of the bands
+        for first, other in sorted(candidate_pairs):
+            root_a, root_b = representative[first], representative[other]
+            if root_a == root_b:
+                continue
+            keep, merged = min(root_a, root_b), max(root_a, root_b)
+            # LSH candidates are confirmed against the representative of the merged group, for every
+            # member, so that chains of near-duplicates (A~B, B~C, A!~C) are not merged transitively
+            if all(similarity(keep, member) >= self.threshold for member in members[merged]):
+                for member in members[merged]:
+                    representative[member] = keep
+                members[keep].extend(members.pop(merged))
+
+        groups = {}
+        for i in range(len(ids)):
+            groups.setdefault(ids[representative[i]], []).append(ids[i])
+        return groups
+
+
+def dedup_report(groups: Dict[Hashable, List[Hashable]]) -> Dict[str, float]:
+    """Summarize the savings from a grouping."""
+    total = sum(len(members) for members in groups.values())
+    unique = len(groups)
+    return {
+        "total": total,
+        "unique": unique,
+        "duplicates": total - unique,
+        "dedup_ratio": (total - unique) / total if total else 0.0,
+        "largest_group": max((len(members) for members in groups.values()), default=0),
+    }
+
+
+def group_near_duplicates(texts: Dict[Hashable, str], threshold: float = 0.8) -> Dict[Hashable, List[Hashable]]:
+    """Group near-duplicate texts and log the dedup ratio."""
+    groups = NearDuplicateDetector(threshold=threshold).group(texts)
+    report = dedup_report(groups)
+    logger.info(f"Deduplicated {report['total']} articles to {report['unique']} "
+                f"({report['dedup_ratio']:.1%} duplicates, largest group {report['largest_group']})")
+    return groups
+
+
+class BoilerplateFilter:
+    """
+    Removes text units that occur in many articles of a corpus.
+
+    A unit is boilerplate when its normalized form occurs in at least min_articles
+    articles and in at least min_share of all articles. Boilerplate units are kept once,
+    at their first occurrence, so text shared by syndicated copies of a story is not
+    lost; with collapse=False they are dropped everywhere.
+    """
+
+    def __init__(self, min_articles: int = 3, min_share: float = 0.05, collapse: bool = True):
+        self.min_articles = min_articles
+        self.min_share = min_share
+        self.collapse = collapse
+
+    @staticmethod
+    def unit_key(unit: str) -> bytes:
+        """Hash of a unit with case, punctuation and spacing normalized away."""
+        normalized = " ".join(re.findall(r'\w+', unit.lower()))
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+
+    def article_counts(self, article_units: Dict[Hashable, List[str]]) -> Dict[bytes, int]:
+        """Number of articles each normalized unit occurs in."""
+        counts = {}
+        for units in article_units.values():
+            for key in {self.unit_key(unit) for unit in units}:
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    @profiled("boilerplate_filter")
+    def filter(self, article_units: Dict[Hashable, List[str]]) -> Tuple[Dict[Hashable, List[str]], Dict[str, Any]]:
+        """Return the units of each article without boilerplate, and a report of what was removed."""
+        from prompts import count_tokens
+
+        counts = self.article_counts(article_units)
+        min_count = max(self.min_articles, math.ceil(self.min_share * len(article_units)))
+        boilerplate = {key for key, count in counts.items() if count >= min_count}
+
+        kept_units, seen, examples = {}, set(), {}
+        total_units = total_tokens = removed_units = removed_tokens = 0
+        for article_id, units in article_units.items():
+            kept = []
+            for unit in units:
+                tokens = count_tokens(unit)
+                total_units += 1
+                total_tokens += tokens
+                key = self.unit_key(unit)
+                if key in boilerplate and (not self.collapse or key in seen):
+                    removed_units += 1
+                    removed_tokens += tokens
+                    examples.setdefault(key, unit)
+                    continue
+                seen.add(key)
+                kept.append(unit)
+            kept_units[article_id] = kept
+
+        top = sorted(examples, key=lambda key: counts[key], reverse=True)[:10]
+        report = {
+            "total_units": total_units,
+            "removed_units": removed_units,
+            "total_tokens": total_tokens,
+            "removed_tokens": removed_tokens,
+            "boilerplate_units": len(boilerplate),
+            "min_articles": min_count,
+            "top_boilerplate": [(counts[key], examples[key]) for key in top],
+        }
+        return kept_units, report
+
+
+def remove_boilerplate(article_units: Dict[Hashable, List[str]], min_articles: int = 3, min_share: float = 0.05,
+                       collapse: bool = True) -> Tuple[Dict[Hashable, List[str]], Dict[str, Any]]:
+    """Remove repeated boilerplate units and log how many units and tokens were removed."""
+    kept_units, report = BoilerplateFilter(min_articles, min_share, collapse).filter(article_units)
+    logger.info(f"Removed {report['removed_units']} of {report['total_units']} text units "
+                f"({report['removed_tokens']} of {report['total_tokens']} tokens) as boilerplate: "
+                f"{report['boilerplate_units']} distinct units found in at least {report['min_articles']} articles")
+    for count, unit in report["top_boilerplate"]:
+        logger.debug(f"Boilerplate in {count} articles: {unit[:80]}")
+    return kept_units, report
@@ -0,0 +1,226 @@
+"""
+On-disk, memory-mapped float32 embedding store.
+
+Vectors are appended to a flat float32 file of shape (rows, dim); a SQLite
+side index maps the hash of each embedded text to its row. Readers open the
+matrix with np.memmap, so several processes (clustering, pre-filtering, ANN
+workers) share the same pages of the OS cache without copying. Deleted rows
+stay in the data file until compact() rewrites it.
+
+compact() never rewrites the data file in place: it writes the live rows to a
+new generation of the file (`path.1`, `path.2`, ...) and switches the index
+to it in one transaction. Readers look up rows and the current data file in
+one index snapshot, so row numbers always match the file they read. The
+previous generation is kept until the next compaction for readers that
+looked up rows just before the switch.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DTYPE = np.float32
+
+
+def text_hash(text: str) -> str:
+    """Stable key for a text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only float32 embedding matrix with a text-hash index.
+    `path` is the first data file; the index lives next to it at `path + '.index'`.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * np.dtype(DTYPE).itemsize
+        # Worker threads share one connection; the lock serializes their use of it
+        self._lock = threading.RLock()
+        self.index = sqlite3.connect(path + ".index", timeout=60, isolation_level=None, check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.index.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        stored_dim = self.index.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        if stored_dim is None:
+            self.index.execute("INSERT INTO meta VALUES ('dim', ?)", (str(dim),))
+        elif int(stored_dim[0]) != dim:
+            raise ValueError(f"Embedding store {path} has dimension {stored_dim[0]}, not {dim}")
+        data_path = self.data_path()
+        if not os.path.exists(data_path):
+            open(data_path, 'ab').close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.index.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def _generation(self) -> int:
+        row = self.index.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _generation_path(self, generation: int) -> str:
+        return self.path if generation == 0 else f"{self.path}.{generation}"
+
+    def data_path(self) -> str:
+        """The data file the index currently points at."""
+        with self._lock:
+            return self._generation_path(self._generation())
+
+    def _file_rows(self, data_path: str) -> int:
+        return os.path.getsize(data_path) // self.row_bytes
+
+    def matrix(self, data_path: Optional[str] = None) -> np.ndarray:
+        """Read-only, zero-copy view of every row in the current data file (including deleted rows)."""
+        data_path = data_path or self.data_path()
+        rows = self._file_rows(data_path)
+        if rows == 0:
+            return np.empty((0, self.dim), dtype=DTYPE)
+        return np.memmap(data_path, dtype=DTYPE, mode='r', shape=(rows, self.dim))
+
+    def rows(self, texts: Sequence[str]) -> List[Optional[int]]:
+        """Row number of each text, or None if it has not been stored."""
+        with self._lock:
+            return self._rows(texts)
+
+    def _rows(self, texts: Sequence[str]) -> List[Optional[int]]:
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self.index.execute(f"SELECT hash, row FROM rows WHERE hash IN ({placeholders})", chunk))
+        return [found.get(h) for h in hashes]
+
+    def get_many(self, texts: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Look up embeddings for texts.
+        Returns (vectors, missing): vectors has one row per text (zeros where missing) and
+        missing lists the positions of texts that are not in the store.
+        """
+        with self._lock:
+            # One read snapshot, so that the rows belong to the data file a concurrent compact() may replace
+            self.index.execute("BEGIN")
+            try:
+                rows = self._rows(texts)
+                data_path = self._generation_path(self._generation())
+            finally:
+                self.index.execute("COMMIT")
+        vectors = np.zeros((len(texts), self.dim), dtype=DTYPE)
+        present = [i for i, row in enumerate(rows) if row is not None]
+        if present:
+            vectors[present] = self.matrix(data_path)[[rows[i] for i in present]]
+        return vectors, [i for i, row in enumerate(rows) if row is None]
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        vectors, missing = self.get_many([text])
+        return None if missing else vectors[0]
+
+    def add(self, texts: Sequence[str], vectors: np.ndarray) -> List[int]:
+        """Append embeddings for texts not yet stored. Returns the row of every text."""
+        vectors = np.asarray(vectors, dtype=DTYPE).reshape(len(texts), self.dim)
+        with self._lock:
+            self._append(texts, vectors)
+        return self.rows(texts)
+
+    def _append(self, texts: Sequence[str], vectors: np.ndarray) -> None:
+        # The write transaction doubles as a lock serializing appends across processes
+        self.index.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self._rows(texts)
+            new_positions, seen = [], set()
+            for i, (text, row) in enumerate(zip(texts, existing)):
+                key = text_hash(text)
+                if row is None and key not in seen:
+                    new_positions.append(i)
+                    seen.add(key)
+            data_path = self._generation_path(self._generation())
+            first_row = self._file_rows(data_path)
+            # Data is written before the index rows that point at it are committed
+            with open(data_path, 'r+b') as f:
+                f.seek(first_row * self.row_bytes)
+                f.write(np.ascontiguousarray(vectors[new_positions]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.index.executemany("INSERT INTO rows VALUES (?, ?)",
+                                   [(text_hash(texts[i]), first_row + n) for n, i in enumerate(new_positions)])
+            self.index.execute("COMMIT")
+        except Exception:
+            self.index.execute("ROLLBACK")
+            raise
+
+    def delete(self, texts: Sequence[str]) -> None:
+        """Drop texts from the index; their rows are reclaimed by compact()."""
+        with self._lock:
+            self.index.executemany("DELETE FROM rows WHERE hash = ?", [(text_hash(t),) for t in texts])
+
+    def compact(self) -> int:
+        """
+        Write the indexed rows to the next generation of the data file and switch the index to it.
+        Returns the number of rows removed.
+        """
+        with self._lock:
+            return self._compact()
+
+    def _compact(self) -> int:
+        new_path = None
+        self.index.execute("BEGIN IMMEDIATE")
+        try:
+            entries = self.index.execute("SELECT hash, row FROM rows ORDER BY row").fetchall()
+            generation = self._generation()
+            old_path, new_path = self._generation_path(generation), self._generation_path(generation + 1)
+            total_rows = self._file_rows(old_path)
+            matrix = self.matrix(old_path)
+            with open(new_path, 'wb') as f:
+                for start in range(0, len(entries), 4096):
+                    block = [row for _, row in entries[start:start + 4096]]
+                    f.write(np.ascontiguousarray(matrix[block]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            del matrix
+            self.index.execute("DELETE FROM rows")
+            self.index.executemany("INSERT INTO rows VALUES (?, ?)", [(h, n) for n, (h, _) in enumerate(entries)])
+            self.index.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (str(generation + 1),))
+            self.index.execute("COMMIT")
+        except Exception:
+            self.index.execute("ROLLBACK")
+            if new_path is not None and os.path.exists(new_path):
+                os.remove(new_path)
+            raise
+        # old_path stays for readers that looked up rows before the switch; the one before it is unused now
+        if generation >= 1 and os.path.exists(self._generation_path(generation - 1)):
+            os.remove(self._generation_path(generation - 1))
+        removed = total_rows - len(entries)
+        logger.info(f"Compacted {old_path} into {new_path}: removed {removed} rows, {len(entries)} remain")
+        return removed
+
+    def close(self) -> None:
+        self.index.close()
+
+
+def cached_embeddings(store: Optional[EmbeddingStore], texts: Sequence[str], embed_fn) -> np.ndarray:
+    """
+    Embed texts through the store: only texts missing from it are passed to
+    `embed_fn(list_of_texts) -> array`, and their vectors are appended.
+    """
+    if store is None:
+        return np.asarray(embed_fn(list(texts)), dtype=DTYPE)
+    vectors, missing = store.get_many(texts)
+    if missing:
+        logger.info(f"Embedding {len(missing)} of {len(texts)} texts not in {store.path}")
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        new_vectors = np.asarray(embed_fn(unique_texts), dtype=DTYPE)
+        store.add(unique_texts, new_vectors)
+        positions = {text: n for n, text in enumerate(unique_texts)}
+        vectors[missing] = new_vectors[[positions[texts[i]] for i in missing]]
+    return vectors
@@ -1,19 +1,18 @@
 #!/usr/bin/env python3
-import requests
-from bs4 import BeautifulSoup
 import re
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-import nltk
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 import csv
-import pandas as pd
+from prompts import prompt_stats
+from topics import CABLE_TOPIC, TopicConfig
+from dedup import remove_boilerplate
+from embedding_store import EmbeddingStore, cached_embeddings
+from html_archive import HtmlArchive, charset_from_content_type, decode_html
+from profiling import profiled
+from resources import ensure_nltk_data, get_openai_client
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,76 +21,120 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Download NLTK resources if not already downloaded
-try:
-    nltk.data.find('punkt_tab')
-except:
-    nltk.download('punkt_tab')
+# Containers commonly used for article content, tried in order
+CONTENT_SELECTORS = [
+    'article',
+    '.article-content',
+    '.story-content',
+    '.post-content',
+    'main',
+    '#content',
+    '.content'
+]
+
+
+def extract_main_text(html: str) -> str:
+    """
+    Extract the main text from article HTML.
+    A module-level function so that archive replays can run it in worker processes.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Remove unwanted elements
+    for element in soup.find_all(['script', 'style', 'nav', 'footer', 'header', 'aside']):
+        element.decompose()
+
+    # Look for article content in common containers
+    article_content = None
+    for selector in CONTENT_SELECTORS:
+        content = soup.select(selector)
+        if content:
+            article_content = content[0]
+            break
+
+    # If no specific container found, use the body
+    if not article_content:
+        article_content = soup.body
+
+    # Extract text and clean it
+    if article_content:
+        text = article_content.get_text(separator=' ', strip=True)
+        # Clean up whitespace
+        text = re.sub(r'\s+', ' ', text)
+        return text
+
+    return ""
 
-from nltk.tokenize import sent_tokenize, word_tokenize
 
 class NewsArticleProcessor:
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    EMBEDDING_DIM = 384
+
+    def __init__(self, embedding_store_path: Optional[str] = None, topic: Optional[TopicConfig] = None,
+                 html_archive_path: Optional[str] = None):
+        self._model = None
+        self.topic = topic or CABLE_TOPIC
+        # Fetched pages are kept here so that extraction can be replayed without the network
+        self.html_archive = HtmlArchive(html_archive_path) if html_archive_path else None
+        self.embedding_store = EmbeddingStore(embedding_store_path, self.EMBEDDING_DIM) if embedding_store_path else None
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         if not self.openai_api_key:
             logger.warning("OPENAI_API_KEY not found in environment variables")
-        else:
-            self.client = OpenAI(api_key=self.openai_api_key)
 
-    def extract_article_content(self, url: str) -> str:
-        """Extract the main content from a news article URL."""
+    @property
+    def model(self):
+        """Sentence embedding model, loaded on first use."""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer('all-MiniLM-L6-v2')
+        return self._model
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use."""
+        return get_openai_client(self.openai_api_key)
+
+    def fetch_html(self, url: str) -> str:
+        """Download a page, storing it in the HTML archive if one is configured. Raises on HTTP errors."""
+        import requests
+
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        response = requests.get(url, headers=headers, timeout=10)
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type')
+        # Only the charset the server declared: requests guesses ISO-8859-1 for text/* without one
+        encoding = charset_from_content_type(content_type)
+        if self.html_archive is not None:
+            self.html_archive.append(url, response.content, status=response.status_code,
+                                     content_type=content_type, encoding=encoding)
+        return decode_html(response.content, encoding)
+
+    def extract_content(self, html: str) -> str:
+        """Extract the main content from the HTML of a news article."""
+        return extract_main_text(html)
+
+    def extract_article_content(self, url: str, from_archive: bool = False) -> str:
+        """
+        Extract the main content from a news article URL.
+        With from_archive, the most recent archived copy is used instead of fetching when available.
+        """
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Remove unwanted elements
-            for element in soup.find_all(['script', 'style', 'nav', 'footer', 'header', 'aside']):
-                element.decompose()
-
-            # Look for article content in common containers
-            article_content = None
-
-            # Try different selectors commonly used for article content
-            selectors = [
-                'article',
-                '.article-content',
-                '.story-content',
-                '.post-content',
-                'main',
-                '#content',
-                '.content'
-            ]
-
-            for selector in selectors:
-                content = soup.select(selector)
-                if content:
-                    article_content = content[0]
-                    break
-
-            # If no specific container found, use the body
-            if not article_content:
-                article_content = soup.body
-
-            # Extract text and clean it
-            if article_content:
-                text = article_content.get_text(separator=' ', strip=True)
-                # Clean up whitespace
-                text = re.sub(r'\s+', ' ', text)
-                return text
-
-            return ""
+            archived = self.html_archive.latest(url) if from_archive and self.html_archive is not None else None
+            html = archived[1] if archived else self.fetch_html(url)
+            return self.extract_content(html)
         except Exception as e:
             logger.error(f"Error extracting content from {url}: {e}")
             return ""
 
+    @profiled("split_into_units")
     def split_into_units(self, text: str) -> List[str]:
         """Split the article content into meaningful units (paragraphs or sentences)."""
+        from nltk.tokenize import sent_tokenize
+        ensure_nltk_data('tokenizers/punkt_tab', 'punkt_tab')
+
         # First split by paragraphs
         paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
 
@@ -128,12 +171,17 @@ class NewsArticleProcessor:
 
         return units
 
+    @profiled("encode_units")
     def generate_embeddings(self, units: List[str]) -> np.ndarray:
-        """Generate embeddings for each text unit."""
-        return self.model.encode(units)
+        """Generate embeddings for each text unit, reusing stored embeddings."""
+        return cached_embeddings(self.embedding_store, units, self.model.encode)
 
+    @profiled("identify_clusters")
     def identify_clusters(self, embeddings: np.ndarray, min_clusters: int = 2, max_clusters: int = 10) -> Tuple[List[int], int]:
         """Identify optimal number of clusters and assign cluster labels."""
+        from sklearn.cluster import KMeans
+        from sklearn.metrics import silhouette_score
+
         if len(embeddings) < min_clusters:
             return [0] * len(embeddings), 1
 
@@ -181,12 +229,10 @@ class NewsArticleProcessor:
                 combined_text = " ".join(words[:50000])
 
             response = self.client.chat.completions.create(model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that identifies the main narrative or theme from a collection of news article excerpts."},
-                {"role": "user", "content": f"Based on these paragraphs, identify a narrative with these details (a) actor(s) blamed for the cause of the cable cutting event, b) actor(s) credited for saving the cable cutting event, c) the location at which the cable cutting happened, d) what the speculated cause of the cable cutting was, malicious? accidental? coordinated?\n\n{combined_text}"}
-            ],
+            messages=self.topic.unit_template.messages(paragraphs=combined_text),
             max_tokens=150,
             temperature=0.5)
+            prompt_stats.record(self.topic.unit_template, response.usage)
 
             narrative = response.choices[0].message.content.strip()
             return narrative
@@ -194,10 +240,19 @@ class NewsArticleProcessor:
             logger.error(f"Error generating narrative for cluster {cluster_id}: {e}")
             return f"Error generating narrative: {str(e)}"
 
-    def process_articles_from_csv(self, csv_file: str, max_articles: int = 10) -> Dict[str, Any]:
-        """Process articles from a CSV file and identify sub-narratives."""
+    def process_articles_from_csv(self, csv_file: str, max_articles: int = 10,
+                                  boilerplate_min_articles: Optional[int] = 3,
+                                  collapse_boilerplate: bool = True) -> Dict[str, Any]:
+        """
+        Process articles from a CSV file and identify sub-narratives.
+        Units found in at least boilerplate_min_articles articles are kept only once before embedding
+        (dropped everywhere with collapse_boilerplate=False); pass boilerplate_min_articles=None to keep them.
+        """
+        import pandas as pd
+
         all_units = []
         article_to_units_map = {}
+        boilerplate_report = None
 
         try:
             # Read the CSV file
@@ -215,12 +270,17 @@ class NewsArticleProcessor:
 
                 if article_text:
                     # Split content into units
-                    units = self.split_into_units(article_text)
-                    article_to_units_map[article_title] = units
-                    all_units.extend(units)
+                    article_to_units_map[index] = self.split_into_units(article_text)
                 else:
                     logger.warning(f"No content found for article: {article_title}")
 
+            # Drop units repeated across articles (cookie notices, bylines, ...) before they are embedded
+            if boilerplate_min_articles is not None:
+                article_to_units_map, boilerplate_report = remove_boilerplate(
+                    article_to_units_map, min_articles=boilerplate_min_articles, collapse=collapse_boilerplate)
+            for units in article_to_units_map.values():
+                all_units.extend(units)
+
             if not all_units:
                 return {"error": "No valid content extracted from any of the articles in the CSV"}
 
@@ -253,7 +313,8 @@ class NewsArticleProcessor:
             return {
                 "total_units": len(all_units),
                 "num_clusters": num_clusters,
-                "narratives": narratives
+                "narratives": narratives,
+                "boilerplate": boilerplate_report
             }
 
         except Exception as e:
@@ -306,6 +367,7 @@ def main():
 
     # Save narratives to CSV
     processor.save_narratives_to_csv(results['narratives'])
+    prompt_stats.log_summary()
 
 if __name__ == "__main__":
     main()
@@ -1,27 +1,61 @@
 import pandas as pd
 import csv
+import json
 import re
 import logging
-from typing import Dict, List, Tuple, Any
-from openai import OpenAI
+from typing import Dict, List, Optional, Tuple, Any
 import os
-from nltk.tokenize import sent_tokenize
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics.pairwise import cosine_similarity
+from llm_concurrency import FairScheduler, RetryPolicy, run_concurrently
+from dedup import group_near_duplicates
+from resources import get_openai_client
+from cluster_selection import select_n_clusters
+from online_clustering import OnlineClusterer
+from embedding_store import EmbeddingStore, cached_embeddings
+from prompts import prompt_stats
+from result_cache import ResultCache, cached_checked_result, cached_result
+from cascade import CascadeConfig, run_cascade
+from topics import CABLE_TOPIC, TopicConfig
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class NarrativeGenerator:
-    def __init__(self):
-        """Initialize the NarrativeGenerator with OpenAI client."""
+    EMBEDDING_MODEL = "text-embedding-ada-002"
+    EMBEDDING_DIM = 1536
+
+    def __init__(self, max_concurrency: int = 8, request_timeout: float = 120.0,
+                 embedding_store_path: Optional[str] = None, topic: Optional[TopicConfig] = None,
+                 scheduler: Optional[FairScheduler] = None, embedding_store: Optional[EmbeddingStore] = None,
+                 result_cache: Optional[ResultCache] = None, cascade: Optional[CascadeConfig] = None):
+        """
+        Initialize the NarrativeGenerator with OpenAI client.
+        With embedding_store_path, embeddings are kept in a memory-mapped store and only
+        texts not embedded by an earlier run are sent to the API.
+        topic selects the prompts (the undersea cable topic by default). When several topics run
+        at once, they pass a shared scheduler, embedding_store and result_cache; API calls then
+        run on the scheduler's pool in this topic's turn.
+        With cascade, summaries and narratives are first requested from a fast model and
+        escalated to a larger one only when the result is unparseable or inadequate.
+        """
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.topic = topic or CABLE_TOPIC
+        self.scheduler = scheduler
+        self.result_cache = result_cache
+        self.cascade = cascade
+        if embedding_store is None and embedding_store_path:
+            embedding_store = EmbeddingStore(embedding_store_path, self.EMBEDDING_DIM)
+        self.embedding_store = embedding_store
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
         if not self.openai_api_key:
             logger.warning("OPENAI_API_KEY not found in environment variables")
-        else:
-            self.client = OpenAI(api_key=self.openai_api_key)
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use."""
+        return get_openai_client(self.openai_api_key)
 
     def load_articles(self, articles_file: str, max_articles: int = None) -> Dict[int, Dict[str, str]]:
         """Load articles from CSV file."""
@@ -39,7 +73,8 @@ class NarrativeGenerator:
                 if article_text:
                     articles[article_id] = {
                         'title': article_title,
-                        'text': article_text
+                        'text': article_text,
+                        'url': row.get('URL')
                     }
 
             logger.info(f"Loaded {len(articles)} articles from {articles_file}")
@@ -50,86 +85,83 @@ class NarrativeGenerator:
 
     def summarize_article(self, article_text: str) -> Dict[str, str]:
         """
-        Summarize an article according to the specified dimensions.
+        Summarize an article according to the topic's dimensions.
+        Raises on failure so that callers never mistake an error for a summary.
         """
-        try:
-            prompt = f"""
-            Please analyze the following article and provide a structured summary according to these dimensions:
-
-            1. Blame Attribution:
-            - Who is blamed or suspected?
-            - Is the attribution direct, indirect, speculative, or disputed?
-
-            2. Victim Entities:
-            - Who or what is described as being attacked, damaged, or negatively impacted?
-            - Include nations, companies, or infrastructure if applicable.
-
-            3. Geographic Scope:
-            - What specific maritime locations, chokepoints, or regions are mentioned?
-            - Include countries, straits, cable landing sites, or exclusive economic zones (EEZs).
-
-            4. Plausible Causes:
-            - What causes or explanations are provided?
-            - List all plausible causes mentioned in the article (e.g., sabotage, anchor drag, espionage, accident).
-
-            5. Economic Consequences:
-            - What economic impacts are described or implied?
-            - Consider trade disruptions, telecom outages, rerouting costs, insurance, or industry effects.
-
-            6. Environmental Consequences:
-            - Are there any environmental harms mentioned?
-            - Consider seabed damage, marine life disruption, ecological risk, or pollution.
-
-            Article:
-            {article_text}
-
-            Format your response as a JSON object with the six dimensions as keys.
-            """
+        template = self.topic.summary_template
 
+        def request(model: str = "gpt-4") -> Dict[str, str]:
             response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert analyst who extracts structured information from news articles."},
-                    {"role": "user", "content": prompt}
-                ],
+                model=model,
+                messages=template.messages(article=article_text),
                 temperature=0.3,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                timeout=self.request_timeout
             )
+            prompt_stats.record(template, response.usage)
 
             summary = response.choices[0].message.content
             # Convert the JSON string to a Python dictionary
-            import json
             summary_dict = json.loads(summary)
 
             logger.info("Successfully summarized article")
             return summary_dict
 
-        except Exception as e:
-            logger.error(f"Error summarizing article: {e}")
-            return {
-                "Blame Attribution": "Error in processing",
-                "Victim Entities": "Error in processing",
-                "Geographic Scope": "Error in processing",
-                "Plausible Causes": "Error in processing",
-                "Economic Consequences": "Error in processing",
-                "Environmental Consequences": "Error in processing"
-            }
+        if self.cascade is None:
+            return cached_result(self.result_cache, template, article_text, request)
+        accept = self.cascade.accept_summary(list(self.topic.dimensions))
+        return cached_checked_result(self.result_cache, template, article_text,
+                                     lambda: run_cascade("summary", self.cascade.summary_models, request, accept),
+                                     variant="cascade")
 
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding for a text using OpenAI's embedding API."""
-        try:
-            response = self.client.embeddings.create(
-                input=text,
-                model="text-embedding-ada-002"
+    def summarize_articles(self, articles: Dict[int, Dict[str, str]]) -> Tuple[Dict[int, Dict[str, str]], Dict[int, str]]:
+        """
+        Summarize articles concurrently with bounded parallelism.
+        Transient errors (rate limits, timeouts, server errors) are retried with backoff;
+        returns (summaries, failures) where failures maps article IDs to the final error.
+        """
+        texts = {article_id: article_data['text'] for article_id, article_data in articles.items()}
+        if self.scheduler is not None:
+            summaries, failures = self.scheduler.map(self.topic.name, self.summarize_article, texts)
+        else:
+            summaries, failures = run_concurrently(
+                self.summarize_article,
+                texts,
+                max_concurrency=self.max_concurrency,
+                policy=RetryPolicy(max_attempts=4)
             )
-            return response.data[0].embedding
+        if failures:
+            logger.warning(f"Failed to summarize {len(failures)} of {len(articles)} articles: {sorted(failures)}")
+        return summaries, failures
+
+    def _request_embeddings(self, texts: List[str], batch_size: int = 100) -> np.ndarray:
+        """Embed texts with OpenAI's embedding API, several texts per request."""
+        def request(batch: List[str]):
+            return self.client.embeddings.create(input=batch, model=self.EMBEDDING_MODEL)
+
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            response = self.scheduler.call(self.topic.name, request, batch) if self.scheduler else request(batch)
+            vectors.extend(item.embedding for item in response.data)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.EMBEDDING_DIM)
+
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate a float32 embedding matrix for texts, reusing stored embeddings."""
+        return cached_embeddings(self.embedding_store, texts, self._request_embeddings)
+
+    def generate_embedding(self, text: str) -> np.ndarray:
+        """Generate embedding for a text using OpenAI's embedding API. Returns an empty array on error."""
+        try:
+            return self.generate_embeddings([text])[0]
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
-            return []
+            return np.empty(0, dtype=np.float32)
 
     def cluster_summaries(self, summaries: Dict[int, Dict[str, str]], n_clusters: int = None) -> Dict[int, List[int]]:
         """
         Cluster article summaries based on their embeddings.
+        Without n_clusters, the number of clusters is selected by silhouette score.
         Returns a dictionary mapping cluster IDs to lists of article IDs.
         """
         # Convert summaries to text for embedding
@@ -143,15 +175,15 @@ class NarrativeGenerator:
             article_ids.append(article_id)
 
         # Generate embeddings
-        embeddings = [self.generate_embedding(text) for text in texts]
+        embeddings = self.generate_embeddings(texts)
 
-        # Determine number of clusters if not specified
+        # Perform clustering, choosing the number of clusters from the data if not specified
         if n_clusters is None:
-            n_clusters = min(3, len(texts))  # Default to 3 clusters or fewer if we have fewer articles
-
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        cluster_labels = kmeans.fit_predict(embeddings)
+            cluster_labels, n_clusters, _ = select_n_clusters(embeddings)
+        else:
+            from sklearn.cluster import KMeans
+            kmeans = KMeans(n_clusters=min(n_clusters, len(texts)), random_state=42)
+            cluster_labels = kmeans.fit_predict(embeddings)
 
         # Group article IDs by cluster
         clusters = {}
@@ -162,65 +194,61 @@ class NarrativeGenerator:
 
         return clusters
 
-    def generate_narrative(self, summaries: Dict[int, Dict[str, str]], article_ids: List[int]) -> str:
+    def generate_narrative(self, summaries: Dict[Any, Dict[str, str]], article_ids: List[Any]) -> str:
         """
         Generate a narrative for a cluster of articles based on their summaries.
         """
         try:
-            # Collect summaries for the articles in this cluster
-            cluster_summaries = {article_id: summaries[article_id] for article_id in article_ids}
-
-            # Format the summaries for the prompt
-            formatted_summaries = ""
-            for article_id, summary in cluster_summaries.items():
-                formatted_summaries += f"Article {article_id}:\n"
-                for dimension, content in summary.items():
-                    formatted_summaries += f"- {dimension}: {content}\n"
-                formatted_summaries += "\n"
-
-            prompt = f"""
-            I have a set of article summaries that belong to the same narrative cluster about undersea cable incidents.
-            Each summary is structured according to six dimensions: Blame Attribution, Victim Entities, Geographic Scope,
-            Plausible Causes, Economic Consequences, and Environmental Consequences.
-
-            Here are the summaries:
-
-            {formatted_summaries}
+            return self.request_narrative(summaries, article_ids)
+        except Exception as e:
+            logger.error(f"Error generating narrative: {e}")
+            return "Error generating narrative."
 
-            Based on these summaries, generate a comprehensive narrative that captures the common themes,
-            perspectives, and information across these articles. The narrative should:
+    def request_narrative(self, summaries: Dict[Any, Dict[str, str]], article_ids: List[Any]) -> str:
+        """Generate a cluster narrative like generate_narrative, but raise on failure."""
+        # Collect summaries for the articles in this cluster
+        cluster_summaries = {article_id: summaries[article_id] for article_id in article_ids}
 
-            1. Identify the main actors, locations, and events
-            2. Highlight consensus and disagreements in blame attribution
-            3. Summarize the range of causes suggested
-            4. Describe the scope and scale of impacts
-            5. Note any unique or outlier perspectives
+        # Format the summaries for the prompt
+        formatted_summaries = ""
+        for article_id, summary in cluster_summaries.items():
+            formatted_summaries += f"Article {article_id}:\n"
+            for dimension, content in summary.items():
+                formatted_summaries += f"- {dimension}: {content}\n"
+            formatted_summaries += "\n"
 
-            Your narrative should be well-structured, approximately 300-500 words, and should accurately
-            represent the information contained in the summaries without adding speculation.
-            """
+        template = self.topic.narrative_template
 
+        def request(summaries_text: str, model: str = "gpt-4") -> str:
             response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert analyst who synthesizes information from multiple sources into coherent narratives."},
-                    {"role": "user", "content": prompt}
-                ],
+                model=model,
+                messages=template.messages(summaries=summaries_text),
                 temperature=0.5,
                 max_tokens=1000
             )
-
-            narrative = response.choices[0].message.content
-            logger.info(f"Generated narrative for cluster with {len(article_ids)} articles")
-            return narrative
-
-        except Exception as e:
-            logger.error(f"Error generating narrative: {e}")
-            return "Error generating narrative."
-
-    def process_articles(self, articles_file: str, max_articles: int = None, n_clusters: int = None) -> Dict[str, Any]:
+            prompt_stats.record(template, response.usage)
+            return response.choices[0].message.content
+
+        def generate(summaries_text: str) -> Tuple[str, bool]:
+            if self.cascade is None:
+                return request(summaries_text), True
+            return run_cascade("narrative", self.cascade.narrative_models,
+                               lambda model: request(summaries_text, model), self.cascade.accept_narrative)
+
+        narrative = cached_checked_result(
+            self.result_cache, template, formatted_summaries,
+            lambda: self.scheduler.call(self.topic.name, generate, formatted_summaries) if self.scheduler
+            else generate(formatted_summaries),
+            variant="cascade" if self.cascade else "")
+        logger.info(f"Generated narrative for cluster with {len(article_ids)} articles")
+        return narrative
+
+    def process_articles(self, articles_file: str, max_articles: int = None, n_clusters: int = None,
+                         dedup_threshold: float = 0.8) -> Dict[str, Any]:
         """
         Process articles from a CSV file, summarize them, cluster them, and generate narratives.
+        Near-duplicate articles are summarized once; their representative's cluster is shared
+        by every member of the group. Pass dedup_threshold=None to disable deduplication.
         """
         try:
             # Load articles
@@ -228,13 +256,21 @@ class NarrativeGenerator:
             if not articles:
                 return {"error": "No articles loaded"}
 
+            # Group near-duplicate articles and keep one representative per group
+            if dedup_threshold is not None:
+                duplicate_groups = group_near_duplicates(
+                    {article_id: data['text'] for article_id, data in articles.items()}, dedup_threshold)
+            else:
+                duplicate_groups = {article_id: [article_id] for article_id in articles}
+            representatives = {article_id: articles[article_id] for article_id in duplicate_groups}
+
             # Summarize articles
-            logger.info(f"Summarizing {len(articles)} articles")
-            summaries = {}
-            for article_id, article_data in articles.items():
-                logger.info(f"Summarizing article {article_id}: {article_data['title']}")
-                summary = self.summarize_article(article_data['text'])
-                summaries[article_id] = summary
+            logger.info(f"Summarizing {len(representatives)} articles")
+            summaries, failed_articles = self.summarize_articles(representatives)
+            failed_articles = {member: error for article_id, error in failed_articles.items()
+                               for member in duplicate_groups[article_id]}
+            if not summaries:
+                return {"error": "No articles could be summarized"}
 
             # Cluster summaries
             logger.info("Clustering article summaries")
@@ -245,6 +281,8 @@ class NarrativeGenerator:
             narratives = {}
             for cluster_id, article_ids in clusters.items():
                 narrative = self.generate_narrative(summaries, article_ids)
+                # Fan the cluster back out to every duplicate of its representatives
+                article_ids = [member for article_id in article_ids for member in duplicate_groups[article_id]]
                 narratives[cluster_id] = {
                     "narrative": narrative,
                     "article_ids": article_ids,
@@ -255,13 +293,119 @@ class NarrativeGenerator:
                 "total_articles": len(articles),
                 "num_clusters": len(clusters),
                 "narratives": narratives,
-                "summaries": summaries
+                "summaries": summaries,
+                "failed_articles": failed_articles,
+                "duplicate_groups": duplicate_groups
             }
 
         except Exception as e:
             logger.error(f"Error processing articles: {e}")
             return {"error": f"Error processing articles: {str(e)}"}
 
+    def process_articles_online(self, articles_file: str, state_file: str, max_articles: int = None,
+                                novelty_threshold: float = 0.8, drift_threshold: float = 0.05,
+                                narrative_sample: int = 20) -> Dict[str, Any]:
+        """
+        Incrementally cluster articles that are new since the last run.
+        Articles are identified by URL, so the CSV may be re-sorted or appended to between runs.
+        New articles are summarized, embedded and assigned to the nearest narrative cluster
+        (or start a new one); narratives are only regenerated for new clusters, clusters whose
+        centroid drifted by more than drift_threshold and clusters whose regeneration failed before.
+
+        State is kept in state_file + '.json' (summaries, members and narratives by URL) and in
+        the clusterer file it names (state_file + '.<generation>.npz'). The JSON file is replaced
+        atomically after the clusterer file is written, so a crash leaves the previous state intact.
+        """
+        try:
+            if os.path.exists(state_file + '.json'):
+                with open(state_file + '.json', encoding='utf-8') as f:
+                    state = json.load(f)
+                if "clusterer_file" not in state:
+                    raise ValueError(f"{state_file}.json predates URL-keyed state; remove it to rebuild the clusters")
+                clusterer = OnlineClusterer.load(os.path.join(os.path.dirname(state_file), state["clusterer_file"]))
+                clusterer.novelty_threshold = novelty_threshold
+            else:
+                clusterer = OnlineClusterer(self.EMBEDDING_DIM, novelty_threshold=novelty_threshold)
+                state = {"generation": 0, "summaries": {}, "members": {}, "narratives": {}, "pending": []}
+
+            articles = self.load_articles(articles_file, max_articles)
+            without_url = [a for a, data in articles.items() if not isinstance(data['url'], str)]
+            if without_url:
+                logger.warning(f"Skipping {len(without_url)} articles without a URL")
+            # Current CSV row of every article, used for the article ids of the output
+            row_ids = {data['url']: a for a, data in articles.items() if isinstance(data['url'], str)}
+            new_articles = {a: articles[a] for url, a in row_ids.items() if url not in state["summaries"]}
+            logger.info(f"{len(new_articles)} new articles out of {len(row_ids)}")
+
+            summaries, failed_articles = self.summarize_articles(new_articles)
+            article_ids = list(summaries.keys())
+            stale = set(state["pending"])
+            if article_ids:
+                texts = [" ".join([f"{k}: {v}" for k, v in summaries[a].items()]) for a in article_ids]
+                known_clusters = clusterer.n_clusters
+                labels = clusterer.partial_fit(self.generate_embeddings(texts))
+                for article_id, label in zip(article_ids, labels):
+                    url = articles[article_id]['url']
+                    state["summaries"][url] = summaries[article_id]
+                    state["members"].setdefault(str(label), []).append(url)
+                stale |= set(range(known_clusters, clusterer.n_clusters)) | set(clusterer.drifted_clusters(drift_threshold))
+
+            logger.info(f"Regenerating narratives for {len(stale)} of {clusterer.n_clusters} clusters")
+            regenerated, pending = [], []
+            for cluster_id in sorted(stale):
+                # The most recent members represent where the cluster has moved to
+                members = state["members"][str(cluster_id)][-narrative_sample:]
+                cluster_summaries = {url: state["summaries"][url] for url in members}
+                try:
+                    state["narratives"][str(cluster_id)] = self.request_narrative(cluster_summaries, members)
+                    regenerated.append(cluster_id)
+                except Exception as e:
+                    # Retried on the next run; the cluster keeps its previous narrative until then
+                    logger.error(f"Error generating narrative for cluster {cluster_id}: {e}")
+                    pending.append(cluster_id)
+            clusterer.mark_regenerated(regenerated)
+            state["pending"] = pending
+            self._save_online_state(state_file, state, clusterer)
+
+            narratives = {}
+            for cluster_id, narrative in state["narratives"].items():
+                members = [row_ids[url] for url in state["members"][cluster_id] if url in row_ids]
+                narratives[int(cluster_id)] = {
+                    "narrative": narrative,
+                    "article_ids": members,
+                    "article_count": len(members)
+                }
+            return {
+                "total_articles": len(state["summaries"]),
+                "new_articles": len(summaries),
+                "num_clusters": clusterer.n_clusters,
+                "regenerated_clusters": regenerated,
+                "pending_clusters": pending,
+                "narratives": narratives,
+                "failed_articles": failed_articles
+            }
+
+        except Exception as e:
+            logger.error(f"Error processing articles online: {e}")
+            return {"error": f"Error processing articles online: {str(e)}"}
+
+    @staticmethod
+    def _save_online_state(state_file: str, state: Dict[str, Any], clusterer: OnlineClusterer) -> None:
+        """Write the clusterer to a new file, then atomically switch the JSON state to it."""
+        previous = state.get("clusterer_file")
+        state["generation"] += 1
+        state["clusterer_file"] = f"{os.path.basename(state_file)}.{state['generation']}.npz"
+        directory = os.path.dirname(state_file)
+        clusterer.save(os.path.join(directory, state["clusterer_file"]))
+        tmp_path = state_file + '.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, state_file + '.json')
+        if previous and os.path.exists(os.path.join(directory, previous)):
+            os.remove(os.path.join(directory, previous))
+
     def save_narratives_to_csv(self, narratives: Dict[int, Dict], output_file: str = "narratives.csv") -> None:
         """Save the narratives to a CSV file."""
         try:
@@ -288,10 +432,10 @@ class NarrativeGenerator:
 
 def main():
     # Use CSV file
-    csv_file = "webset-articles_cut_sea_cables.csv"
+    csv_file = CABLE_TOPIC.articles_file
 
     generator = NarrativeGenerator()
-    results = generator.process_articles(csv_file, max_articles=10, n_clusters=3)
+    results = generator.process_articles(csv_file, max_articles=10)
 
     if "error" in results:
         print(f"Error: {results['error']}")
@@ -300,6 +444,8 @@ def main():
     print("\n=== Narrative Analysis ===")
     print(f"Total articles: {results['total_articles']}")
     print(f"Number of clusters: {results['num_clusters']}")
+    if results['failed_articles']:
+        print(f"Failed to summarize: {sorted(results['failed_articles'])}")
 
     for cluster_id, data in results['narratives'].items():
         print(f"\nCluster {cluster_id} ({data['article_count']} articles):")
@@ -308,6 +454,7 @@ def main():
 
     # Save narratives to CSV
     generator.save_narratives_to_csv(results['narratives'])
+    prompt_stats.log_summary()
 
 if __name__ == "__main__":
     main()
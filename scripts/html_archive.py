@@ -0,0 +1,252 @@
+"""
+Append-only compressed archive of fetched article HTML.
+
+Each fetch is stored as one independently compressed record, WARC-style: a
+JSON header line (URL, fetch time, HTTP status, content type, declared
+encoding) followed by the response body bytes exactly as received, so a
+replay can decode them differently than the original fetch did. Records are
+appended to a single data file and a SQLite side index maps (URL, fetch time)
+to the record's byte offset and length, so any record can be read with one
+seek. Records are compressed with zstd when the
+zstandard package is installed and with zlib otherwise; the codec is stored
+per record.
+
+Extraction can be replayed over the whole archive without any network
+access: records are split into offset-ordered batches and decoded and
+extracted in parallel processes, each reading the data file sequentially.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Archive record is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def charset_from_content_type(content_type: Optional[str]) -> Optional[str]:
+    """The charset parameter of a Content-Type header, or None if it declares none."""
+    match = re.search(r'charset=["\']?([\w.:-]+)', content_type or "", re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def decode_html(body: bytes, encoding: Optional[str] = None) -> str:
+    """
+    Decode a page with its declared encoding, else the charset of a <meta> tag, else UTF-8,
+    falling back to Windows-1252 for bytes that are not valid UTF-8.
+    """
+    if not encoding:
+        meta = re.search(rb'<meta[^>]+charset=["\']?([\w.:-]+)', body[:4096], re.IGNORECASE)
+        encoding = meta.group(1).decode('ascii') if meta else None
+    if encoding:
+        try:
+            return body.decode(encoding, errors='replace')
+        except LookupError:
+            logger.warning(f"Unknown encoding {encoding!r}, decoding as UTF-8")
+    try:
+        return body.decode('utf-8')
+    except UnicodeDecodeError:
+        return body.decode('cp1252', errors='replace')
+
+
+def read_record(data: bytes, codec: str) -> Tuple[Dict[str, Any], bytes]:
+    """Split a compressed record into its header and raw body."""
+    header, _, body = _decompress(data, codec).partition(b"\n")
+    return json.loads(header), body
+
+
+def decode_record(data: bytes, codec: str) -> Tuple[Dict[str, Any], str]:
+    """Split a compressed record into its header and decoded HTML."""
+    header, body = read_record(data, codec)
+    return header, decode_html(body, header.get("encoding"))
+
+
+class HtmlArchive:
+    """
+    Compressed page archive at `path`, with its index at `path + '.index'`.
+    Appends from several threads are serialized; readers may run in other processes.
+    With readonly, the archive must already exist and neither file is written.
+    """
+
+    def __init__(self, path: str, codec: Optional[str] = None, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self.codec = codec or ("zstd" if zstandard is not None else "zlib")
+        if self.codec == "zstd" and zstandard is None:
+            raise RuntimeError("zstd codec requested but the zstandard package is not installed")
+        self._lock = threading.Lock()
+        if readonly:
+            for required in (path, path + ".index"):
+                if not os.path.exists(required):
+                    raise FileNotFoundError(f"HTML archive file not found: {required}")
+            self.index = sqlite3.connect(f"file:{path}.index?mode=ro", uri=True, timeout=60,
+                                         isolation_level=None, check_same_thread=False)
+            self._data = None
+            return
+        self.index = sqlite3.connect(path + ".index", timeout=60, isolation_level=None, check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                status INTEGER,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            )
+        """)
+        self.index.execute("CREATE INDEX IF NOT EXISTS records_url ON records (url, fetched_at)")
+        self._data = open(path, 'ab')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.index.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def append(self, url: str, body: Union[bytes, str], status: int = 200, content_type: Optional[str] = None,
+               fetched_at: Optional[float] = None, encoding: Optional[str] = None) -> int:
+        """
+        Store a fetched page; returns the record id. body should be the response bytes as received,
+        with the encoding declared by the server (default: the Content-Type charset, if any).
+        """
+        if self.readonly:
+            raise ValueError(f"HTML archive {self.path} is open read-only")
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        if isinstance(body, str):
+            body, encoding = body.encode('utf-8'), "utf-8"
+        elif encoding is None:
+            encoding = charset_from_content_type(content_type)
+        header = {"url": url, "fetched_at": fetched_at, "status": status, "content_type": content_type,
+                  "encoding": encoding}
+        record = _compress(json.dumps(header).encode('utf-8') + b"\n" + body, self.codec)
+        with self._lock:
+            offset = self._data.seek(0, os.SEEK_END)
+            self._data.write(record)
+            # The index only points at bytes that have reached the file
+            self._data.flush()
+            cursor = self.index.execute(
+                "INSERT INTO records (url, fetched_at, status, offset, length, codec) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, fetched_at, status, offset, len(record), self.codec))
+            return cursor.lastrowid
+
+    def _read(self, offset: int, length: int, codec: str) -> Tuple[Dict[str, Any], str]:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return decode_record(f.read(length), codec)
+
+    def latest(self, url: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """(header, html) of the most recent fetch of url, or None if it was never archived."""
+        with self._lock:
+            row = self.index.execute(
+                "SELECT offset, length, codec FROM records WHERE url = ? ORDER BY fetched_at DESC, id DESC LIMIT 1",
+                (url,)).fetchone()
+        return self._read(*row) if row else None
+
+    def get(self, record_id: int) -> Tuple[Dict[str, Any], str]:
+        with self._lock:
+            row = self.index.execute("SELECT offset, length, codec FROM records WHERE id = ?", (record_id,)).fetchone()
+        if row is None:
+            raise KeyError(record_id)
+        return self._read(*row)
+
+    def entries(self, latest_only: bool = True) -> List[Tuple[int, str, float, int, int, str]]:
+        """
+        (id, url, fetched_at, offset, length, codec) index rows in file order, by default the newest per URL.
+        Fetches of a URL with the same fetch time are told apart by id, so the one appended last wins.
+        """
+        query = "SELECT id, url, fetched_at, offset, length, codec FROM records r"
+        if latest_only:
+            query += (" WHERE id = (SELECT id FROM records WHERE url = r.url"
+                      " ORDER BY fetched_at DESC, id DESC LIMIT 1)")
+        with self._lock:
+            return self.index.execute(query + " ORDER BY offset").fetchall()
+
+    def __iter__(self) -> Iterator[Tuple[Dict[str, Any], str]]:
+        """Every archived record, oldest first, read sequentially."""
+        with open(self.path, 'rb') as f:
+            for _, _, _, offset, length, codec in self.entries(latest_only=False):
+                f.seek(offset)
+                yield decode_record(f.read(length), codec)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+            self.index.close()
+
+
+def _extract_batch(path: str, batch: List[Tuple[int, str, float, int, int, str]],
+                   extract: Callable[[str], str]) -> List[Tuple[str, float, str]]:
+    """Decode and extract one offset-ordered batch of records in a worker process."""
+    results = []
+    with open(path, 'rb') as f:
+        for _, url, fetched_at, offset, length, codec in batch:
+            f.seek(offset)
+            try:
+                _, html = decode_record(f.read(length), codec)
+            except Exception as e:
+                # A corrupt record loses only its own page
+                logger.error(f"Error decoding archived record of {url} at offset {offset}: {e}")
+                results.append((url, fetched_at, ""))
+                continue
+            try:
+                text = extract(html)
+            except Exception as e:
+                logger.error(f"Error extracting content from archived {url}: {e}")
+                text = ""
+            results.append((url, fetched_at, text))
+    return results
+
+
+def replay_extraction(path: str, extract: Callable[[str], str], workers: Optional[int] = None,
+                      batch_size: int = 64, latest_only: bool = True) -> List[Tuple[str, float, str]]:
+    """
+    Re-run `extract(html)` over the archived pages in parallel processes, without network access.
+    extract must be a picklable module-level function. Returns (url, fetched_at, text) in file order.
+    Raises FileNotFoundError if the archive does not exist.
+    """
+    archive = HtmlArchive(path, readonly=True)
+    entries = archive.entries(latest_only)
+    archive.close()
+    batches = [entries[start:start + batch_size] for start in range(0, len(entries), batch_size)]
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    results = []
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for batch_results in executor.map(_extract_batch, [path] * len(batches), batches, [extract] * len(batches)):
+                results.extend(batch_results)
+    else:
+        for batch in batches:
+            results.extend(_extract_batch(path, batch, extract))
+    elapsed = time.perf_counter() - start
+    logger.info(f"Extracted {len(results)} archived pages in {elapsed:.2f}s "
+                f"({len(results) / max(elapsed, 1e-9):.0f} pages/s, {workers} workers)")
+    return results
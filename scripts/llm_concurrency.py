@@ -0,0 +1,301 @@
+"""
+Bounded, rate-limit aware concurrency for LLM calls.
+
+Runs a function over many items on a thread pool while an adaptive limiter
+backs off when the provider signals rate limiting, and a retry policy tells
+transient failures (rate limits, timeouts, connection and server errors)
+apart from permanent ones (bad requests, authentication, invalid output).
+Several independent runs (e.g. topics) can share one pool and limiter through
+a FairScheduler, which serves their queues in weighted round-robin order.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# OpenAI exception class names that are worth retrying
+TRANSIENT_ERROR_NAMES = {
+    "RateLimitError",
+    "APITimeoutError",
+    "APIConnectionError",
+    "InternalServerError",
+}
+
+
+class MalformedResponseError(ValueError):
+    """The model answered, but not in the expected format; worth another sample."""
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Return True if the error is a provider rate-limit response."""
+    return type(error).__name__ == "RateLimitError" or getattr(error, "status_code", None) == 429
+
+
+def is_transient(error: Exception) -> bool:
+    """Return True if the call that raised this error may succeed when retried."""
+    if type(error).__name__ in TRANSIENT_ERROR_NAMES or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    # Truncated or malformed model output usually parses on a second sample
+    return isinstance(error, (json.JSONDecodeError, MalformedResponseError))
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Read the Retry-After header from a provider error, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to provider rate limiting.
+
+    The limit grows by one after every `increase_every` successes and halves
+    on a rate-limit error, when new calls are also paused for the cool-down.
+    clock measures the pause (time.monotonic unless a test injects one).
+    """
+
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1, increase_every: int = 5,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase_every = increase_every
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while True:
+                wait = self.paused_until - self.clock()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.increase_every and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_rate_limit(self, cool_down: float) -> None:
+        with self._cond:
+            self.limit = max(self.min_concurrency, self.limit // 2)
+            self._successes = 0
+            self.paused_until = max(self.paused_until, self.clock() + cool_down)
+            logger.warning(f"Rate limited, concurrency lowered to {self.limit}, pausing {cool_down:.1f}s")
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter for transient failures; sleep waits between attempts."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before retrying after the given (1-based) attempt failed."""
+        suggested = retry_after(error)
+        if suggested is not None:
+            return min(self.max_delay, suggested)
+        backoff = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return backoff * random.uniform(0.5, 1.0)
+
+
+def call_with_retries(fn: Callable[[Any], Any], item: Any, limiter: AdaptiveLimiter, policy: RetryPolicy) -> Any:
+    """Call `fn(item)` under the limiter, retrying transient errors; re-raises the final error."""
+    attempt = 0
+    while True:
+        attempt += 1
+        limiter.acquire()
+        try:
+            result = fn(item)
+        except Exception as e:
+            error = e
+        else:
+            limiter.on_success()
+            return result
+        finally:
+            limiter.release()
+
+        if not is_transient(error) or attempt >= policy.max_attempts:
+            raise error
+        delay = policy.delay(attempt, error)
+        if is_rate_limit(error):
+            limiter.on_rate_limit(delay)
+        logger.warning(f"Transient error (attempt {attempt}/{policy.max_attempts}), retrying in {delay:.1f}s: {error}")
+        policy.sleep(delay)
+
+
+def run_concurrently(fn: Callable[[Any], Any], items: Dict[Hashable, Any], max_concurrency: int = 8,
+                     policy: Optional[RetryPolicy] = None, limiter: Optional[AdaptiveLimiter] = None,
+                     on_done: Optional[Callable[[Hashable], None]] = None
+                     ) -> Tuple[Dict[Hashable, Any], Dict[Hashable, str]]:
+    """
+    Run `fn` over the values of `items` with bounded parallelism.
+
+    Returns (results, failures) in the order of items: results maps keys to
+    return values, failures maps keys of items that failed permanently or
+    exhausted their retries to the error message. on_done(key) is called in
+    the calling thread as each item finishes; if it raises, items that have
+    not started are cancelled and the error propagates.
+    """
+    policy = policy or RetryPolicy()
+    limiter = limiter or AdaptiveLimiter(max_concurrency=max_concurrency)
+    results, failures = {}, {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {key: executor.submit(call_with_retries, fn, item, limiter, policy) for key, item in items.items()}
+        if on_done is not None:
+            keys = {future: key for key, future in futures.items()}
+            try:
+                for future in as_completed(keys):
+                    on_done(keys[future])
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logger.error(f"Giving up on item {key}: {e}")
+                failures[key] = str(e)
+
+    return results, failures
+
+
+class FairScheduler:
+    """
+    Worker pool shared by several tenants, e.g. concurrent topic runs.
+
+    Each tenant has its own queue; idle workers take tasks from the tenants in
+    round-robin order, up to `weight` tasks in a row per tenant, so a topic
+    with thousands of articles cannot starve a small one. Every task runs
+    through call_with_retries with the shared limiter and policy.
+    """
+
+    def __init__(self, max_workers: int = 8, policy: Optional[RetryPolicy] = None,
+                 limiter: Optional[AdaptiveLimiter] = None):
+        self.policy = policy or RetryPolicy()
+        self.limiter = limiter or AdaptiveLimiter(max_concurrency=max_workers)
+        self._queues: Dict[Hashable, deque] = {}
+        self._weights: Dict[Hashable, int] = {}
+        self._order = []
+        self._next = 0
+        self._served = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def add_tenant(self, tenant: Hashable, weight: int = 1) -> None:
+        with self._cond:
+            if tenant not in self._queues:
+                self._queues[tenant] = deque()
+                self._order.append(tenant)
+            self._weights[tenant] = max(1, weight)
+
+    def submit(self, tenant: Hashable, fn: Callable[[Any], Any], item: Any) -> Future:
+        """Queue `fn(item)` for the tenant; the future holds its result or final error."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            if tenant not in self._queues:
+                self._queues[tenant] = deque()
+                self._weights[tenant] = 1
+                self._order.append(tenant)
+            self._queues[tenant].append((fn, item, future))
+            self._cond.notify()
+        return future
+
+    def call(self, tenant: Hashable, fn: Callable[[Any], Any], item: Any) -> Any:
+        """Run `fn(item)` on the pool in the tenant's turn and wait for the result."""
+        return self.submit(tenant, fn, item).result()
+
+    def map(self, tenant: Hashable, fn: Callable[[Any], Any],
+            items: Dict[Hashable, Any]) -> Tuple[Dict[Hashable, Any], Dict[Hashable, str]]:
+        """Like run_concurrently, but on the shared pool: returns (results, failures)."""
+        futures = {key: self.submit(tenant, fn, item) for key, item in items.items()}
+        results, failures = {}, {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logger.error(f"Giving up on item {key} of {tenant}: {e}")
+                failures[key] = str(e)
+        return results, failures
+
+    def _take(self) -> Optional[Tuple[Callable, Any, Future]]:
+        """Next task in weighted round-robin order; blocks while all queues are empty. Holds no lock."""
+        with self._cond:
+            while True:
+                # One extra step so a tenant whose turn just ended is reached again after a full cycle
+                for _ in range(len(self._order) + 1 if self._order else 0):
+                    tenant = self._order[self._next % len(self._order)]
+                    queue = self._queues[tenant]
+                    if queue and self._served < self._weights[tenant]:
+                        self._served += 1
+                        return queue.popleft()
+                    # Tenant is idle or has used its turn: move on to the next one
+                    self._next = (self._next + 1) % len(self._order)
+                    self._served = 0
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _work(self) -> None:
+        while True:
+            task = self._take()
+            if task is None:
+                return
+            fn, item, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(call_with_retries(fn, item, self.limiter, self.policy))
+            except Exception as e:
+                future.set_exception(e)
+
+    def shutdown(self) -> None:
+        """Finish queued tasks, then stop the workers."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def __enter__(self) -> "FairScheduler":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
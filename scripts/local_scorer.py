@@ -0,0 +1,122 @@
+"""
+Local zero-shot agreement scoring with an NLI cross-encoder.
+
+An alternative to one chat completion per narrative/article pair: every
+narrative sentence is checked against passages of the article with a natural
+language inference model running on CPU, and entailment minus contradiction
+is mapped to an agreement score in [-1, 1]. A linear calibration fitted on a
+small sample scored by the chat model aligns the two scales.
+"""
+import logging
+import re
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from profiling import profiled
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_NLI_MODEL = "cross-encoder/nli-deberta-v3-xsmall"
+# Fewer chat-scored pairs than this give too noisy a calibration fit
+MIN_CALIBRATION_PAIRS = 5
+
+
+def split_passages(text: str, max_words: int = 200) -> List[str]:
+    """Split text into passages of at most max_words words, short enough for the cross-encoder."""
+    words = text.split()
+    return [" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words)] or [""]
+
+
+def split_claims(narrative: str) -> List[str]:
+    """Split a narrative into sentence-sized claims; '|' marks line breaks in narratives.csv."""
+    claims = [c.strip() for c in re.split(r'(?<=[.!?])\s+|\|', narrative)]
+    return [c for c in claims if len(c.split()) >= 3] or [narrative]
+
+
+class NLIAgreementScorer:
+    """Scores narrative/article agreement locally with a batched NLI cross-encoder."""
+
+    def __init__(self, model_name: str = DEFAULT_NLI_MODEL, batch_size: int = 64,
+                 num_threads: Optional[int] = None, max_passage_words: int = 200):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.max_passage_words = max_passage_words
+        # Linear calibration mapping raw scores onto the chat scorer's scale
+        self.slope = 1.0
+        self.intercept = 0.0
+
+        label2id = {label.lower(): i for i, label in self.model.model.config.id2label.items()}
+        self.entailment_index = label2id["entailment"]
+        self.contradiction_index = label2id["contradiction"]
+
+    @profiled("nli_scoring")
+    def raw_scores(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """
+        Score (article_text, narrative) pairs without calibration.
+        Each narrative claim takes its strongest entailment and contradiction over the
+        article's passages; the pair score is the mean of entailment minus contradiction.
+        """
+        premises, hypotheses = [], []
+        claim_counts = []
+        for article_text, narrative in pairs:
+            passages = split_passages(article_text, self.max_passage_words)
+            claims = split_claims(narrative)
+            claim_counts.append((len(claims), len(passages)))
+            for claim in claims:
+                for passage in passages:
+                    premises.append(passage)
+                    hypotheses.append(claim)
+
+        if not premises:
+            return np.zeros(len(pairs), dtype=np.float32)
+
+        probabilities = self.model.predict(list(zip(premises, hypotheses)), batch_size=self.batch_size,
+                                           apply_softmax=True, show_progress_bar=False)
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+
+        scores = np.empty(len(pairs), dtype=np.float32)
+        offset = 0
+        for pair_index, (n_claims, n_passages) in enumerate(claim_counts):
+            block = probabilities[offset:offset + n_claims * n_passages].reshape(n_claims, n_passages, -1)
+            offset += n_claims * n_passages
+            entailment = block[:, :, self.entailment_index].max(axis=1)
+            contradiction = block[:, :, self.contradiction_index].max(axis=1)
+            scores[pair_index] = float(np.mean(entailment - contradiction))
+        return scores
+
+    def score_pairs(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """Score (article_text, narrative) pairs on the calibrated [-1, 1] scale."""
+        return np.clip(self.slope * self.raw_scores(pairs) + self.intercept, -1.0, 1.0)
+
+    def calibrate(self, pairs: Sequence[Tuple[str, str]], reference_scores: Sequence[float],
+                  min_pairs: int = MIN_CALIBRATION_PAIRS) -> None:
+        """
+        Fit the linear calibration against reference (chat model) scores for the same pairs.
+        Samples smaller than min_pairs, without variation, or giving a non-positive slope (which
+        would invert or flatten every score) fall back to the identity calibration.
+        """
+        self.slope, self.intercept = 1.0, 0.0
+        if len(pairs) < min_pairs:
+            logger.warning(f"Only {len(pairs)} calibration pairs (need {min_pairs}), using identity calibration")
+            return
+        raw = self.raw_scores(pairs)
+        reference = np.asarray(reference_scores, dtype=np.float32)
+        if np.allclose(raw, raw[0]):
+            logger.warning("Not enough variation in the calibration sample, using identity calibration")
+            return
+        slope, intercept = (float(v) for v in np.polyfit(raw, reference, 1))
+        if slope <= 0:
+            logger.warning(f"Calibration slope {slope:.3f} is not positive, using identity calibration")
+            return
+        self.slope, self.intercept = slope, intercept
+        correlation = float(np.corrcoef(raw, reference)[0, 1])
+        logger.info(f"Calibrated local scorer on {len(raw)} pairs: slope={self.slope:.3f}, "
+                    f"intercept={self.intercept:.3f}, correlation={correlation:.3f}")
@@ -1,28 +1,52 @@
-import pandas as pd
-import csv
-import re
+import json
 import logging
-from typing import Dict, List, Tuple
-from openai import OpenAI
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import os
-from nltk.tokenize import sent_tokenize
+import random
 import numpy as np
+from dedup import group_near_duplicates
+from score_matrix import ScoreMatrix
+from resources import get_openai_client
+from cascade import CascadeConfig, run_cascade
+from llm_concurrency import AdaptiveLimiter, MalformedResponseError, RetryPolicy, call_with_retries, run_concurrently
+from prompts import AGREEMENT, AGREEMENT_SCHEMA, prompt_stats
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class NarrativeMapper:
-    def __init__(self):
-        """Initialize the NarrativeMapper with OpenAI client."""
+    def __init__(self, scorer: str = "chat", cascade: Optional[CascadeConfig] = None):
+        """
+        Initialize the NarrativeMapper with OpenAI client.
+        scorer selects the agreement backend: "chat" calls the OpenAI chat model for every
+        pair, "nli" scores all pairs locally with an NLI cross-encoder.
+        With cascade, chat scores that are unparseable, low-confidence or borderline are
+        re-scored by a larger model.
+        """
+        if scorer not in ("chat", "nli"):
+            raise ValueError(f"Unknown scorer: {scorer}")
+        self.scorer = scorer
+        self.local_scorer = None
+        self.cascade = cascade
+        # Malformed responses and transient API errors share this bounded retry budget
+        self.retry_policy = RetryPolicy(max_attempts=3)
+        self.limiter = AdaptiveLimiter(max_concurrency=8)
+        if scorer == "nli":
+            from local_scorer import NLIAgreementScorer
+            self.local_scorer = NLIAgreementScorer()
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
         if not self.openai_api_key:
             logger.warning("OPENAI_API_KEY not found in environment variables")
-        else:
-            self.client = OpenAI(api_key=self.openai_api_key)
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use."""
+        return get_openai_client(self.openai_api_key)
     
     def load_narratives(self, narratives_file: str) -> Dict[int, str]:
         """Load narratives from CSV file."""
+        import pandas as pd
         narratives = {}
         try:
             df = pd.read_csv(narratives_file)
@@ -36,6 +60,7 @@ class NarrativeMapper:
     
     def load_articles(self, articles_file: str) -> Dict[int, str]:
         """Load articles from CSV file."""
+        import pandas as pd
         articles = {}
         try:
             df = pd.read_csv(articles_file)
@@ -52,89 +77,172 @@ class NarrativeMapper:
             logger.error(f"Error loading articles: {e}")
             return {}
     
-    def evaluate_agreement(self, article_text: str, narrative: str) -> float:
+    def request_agreement(self, article_text: str, narrative: str, model: str = "gpt-4o-mini") -> Dict[str, float]:
         """
-        Evaluate the agreement between article and narrative.
-        Returns a score between -1 (complete disagreement) and 1 (complete agreement).
+        Ask the chat model for a structured agreement score with confidence.
+        Raises MalformedResponseError if the response does not match the schema.
+        """
+        # Truncate article text if too long
+        if len(article_text) > 15000:
+            article_text = article_text[:15000] + "..."
+
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=AGREEMENT.messages(narrative=narrative, article=article_text),
+            response_format=AGREEMENT_SCHEMA,
+            max_tokens=30,
+            temperature=0.2
+        )
+        prompt_stats.record(AGREEMENT, response.usage)
+
+        content = response.choices[0].message.content or ""
+        try:
+            parsed = json.loads(content)
+            score = float(parsed["score"])
+            confidence = float(parsed["confidence"])
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            raise MalformedResponseError(f"Unparseable agreement response: {content!r}") from None
+        if not (-1.0 <= score <= 1.0 and 0.0 <= confidence <= 1.0):
+            raise MalformedResponseError(f"Agreement response out of range: {content!r}")
+        return {"score": score, "confidence": confidence}
+
+    def score_pair(self, pair: Tuple[str, str]) -> Dict[str, float]:
+        """Score an (article_text, narrative) pair with the single chat model or the cascade."""
+        article_text, narrative = pair
+        if self.cascade is None:
+            return self.request_agreement(article_text, narrative)
+        # A score the last model is unsure of is still kept, with its confidence
+        result, _ = run_cascade("agreement", self.cascade.scoring_models,
+                                lambda model: self.request_agreement(article_text, narrative, model),
+                                self.cascade.accept_score)
+        return result
+
+    def evaluate_agreement_detailed(self, article_text: str, narrative: str) -> Optional[Dict[str, float]]:
+        """
+        Evaluate agreement, retrying transient API errors and malformed responses within a
+        bounded budget. Returns {"score", "confidence"}, or None if the pair stays unresolved.
         """
         if not self.openai_api_key:
             logger.warning("OpenAI API key not provided. Cannot evaluate agreement.")
-            return 0.0
-        
+            return None
+
         try:
-            # Truncate article text if too long
-            if len(article_text) > 15000:
-                article_text = article_text[:15000] + "..."
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are an objective analyst evaluating how news articles align with specific narratives."},
-                    {"role": "user", "content": f"""
-                    Evaluate how much this article agrees or disagrees with the given narrative.
-                    
-                    NARRATIVE: {narrative}
-                    
-                    ARTICLE: {article_text}
-                    
-                    Assign a score from -1 to 1 where:
-                    - Scores from 0 to 1 indicate agreement (1 being complete agreement)
-                    - Scores from 0 to -1 indicate disagreement (-1 being complete disagreement)
-                    - 0 indicates neutrality or no relation
-                    
-                    Return only the numerical score without any explanation.
-                    """}
-                ],
-                max_tokens=10,
-                temperature=0.2
-            )
-            
-            score_text = response.choices[0].message.content.strip()
-            # Extract the numerical value
-            try:
-                score = float(re.search(r'-?\d+\.?\d*', score_text).group())
-                # Ensure the score is within the range [-1, 1]
-                score = max(-1.0, min(1.0, score))
-                return score
-            except (ValueError, AttributeError):
-                logger.warning(f"Could not parse score from response: {score_text}")
-                return 0.0
-                
+            return call_with_retries(self.score_pair, (article_text, narrative), self.limiter, self.retry_policy)
         except Exception as e:
             logger.error(f"Error evaluating agreement: {e}")
-            return 0.0
+            return None
+
+    def evaluate_agreement(self, article_text: str, narrative: str) -> float:
+        """
+        Evaluate the agreement between article and narrative.
+        Returns a score between -1 (complete disagreement) and 1 (complete agreement),
+        or NaN if no valid score could be obtained.
+        """
+        result = self.evaluate_agreement_detailed(article_text, narrative)
+        return result["score"] if result is not None else float("nan")
     
-    def map_narratives_to_articles(self, narratives: Dict[int, str], articles: Dict[int, str]) -> List[Tuple[int, int, float]]:
-        """Map narratives to articles and evaluate agreement."""
-        results = []
-        total_evaluations = len(narratives) * len(articles)
-        completed = 0
-        
-        for narrative_id, narrative_text in narratives.items():
-            for article_id, article_text in articles.items():
-                logger.info(f"Evaluating narrative {narrative_id} against article {article_id} ({completed+1}/{total_evaluations})")
-                score = self.evaluate_agreement(article_text, narrative_text)
-                results.append((narrative_id, article_id, score))
-                completed += 1
-                
+    def map_narratives_to_articles(self, narratives: Dict[int, str], articles: Dict[int, str],
+                                   dedup_threshold: float = 0.8,
+                                   on_pair: Optional[Callable[[], None]] = None) -> ScoreMatrix:
+        """
+        Map narratives to articles and evaluate agreement.
+        Returns a narratives x articles score matrix (NaN for pairs that were not scored).
+        Only one representative of each group of near-duplicate articles is scored; its
+        score is copied to the other members. Pass dedup_threshold=None to score every article.
+        on_pair is called after every scored pair (after the batch with the local scorer).
+        """
+        if dedup_threshold is not None:
+            duplicate_groups = group_near_duplicates(articles, dedup_threshold)
+        else:
+            duplicate_groups = {article_id: [article_id] for article_id in articles}
+
+        results = ScoreMatrix(sorted(narratives), sorted(articles))
+        if self.local_scorer is not None:
+            self._map_locally(narratives, articles, duplicate_groups, results)
+            if on_pair is not None:
+                on_pair()
+        elif not self.openai_api_key:
+            logger.warning("OpenAI API key not provided. Cannot evaluate agreement.")
+        else:
+            self._map_concurrently(narratives, articles, duplicate_groups, results, on_pair)
+
+        results.fan_out(duplicate_groups)
+        unresolved = results.unresolved()
+        if unresolved:
+            logger.warning(f"{len(unresolved)} of {results.values.size} pairs are unresolved")
         return results
     
-    def save_results(self, results: List[Tuple[int, int, float]], output_file: str = "narrative_article_mapping.csv") -> None:
-        """Save the mapping results to a CSV file."""
+    def _map_concurrently(self, narratives: Dict[int, str], articles: Dict[int, str],
+                          duplicate_groups: Dict[int, List[int]], results: ScoreMatrix,
+                          on_pair: Optional[Callable[[], None]] = None) -> None:
+        """Score the representative pairs with the chat model, up to the limiter's concurrency."""
+        pairs = {(narrative_id, article_id): (articles[article_id], narrative_text)
+                 for narrative_id, narrative_text in narratives.items() for article_id in duplicate_groups}
+        logger.info(f"Evaluating {len(pairs)} narrative/article pairs with up to "
+                    f"{self.limiter.max_concurrency} concurrent requests")
+        completed = 0
+
+        def done(key: Tuple[int, int]) -> None:
+            nonlocal completed
+            completed += 1
+            if completed % 50 == 0 or completed == len(pairs):
+                logger.info(f"Evaluated {completed}/{len(pairs)} pairs")
+            if on_pair is not None:
+                on_pair()
+
+        scores, _ = run_concurrently(self.score_pair, pairs, max_concurrency=self.limiter.max_concurrency,
+                                     policy=self.retry_policy, limiter=self.limiter, on_done=done)
+        # Pairs that failed stay NaN and are reported as unresolved
+        results.confidence = np.full(results.shape, np.nan, dtype=np.float32)
+        for (narrative_id, article_id), result in scores.items():
+            results.set(narrative_id, article_id, result["score"])
+            results.confidence[results.row(narrative_id), results.column(article_id)] = result["confidence"]
+
+    def _map_locally(self, narratives: Dict[int, str], articles: Dict[int, str],
+                     duplicate_groups: Dict[int, List[int]], results: ScoreMatrix) -> None:
+        """Score the full narrative x article matrix in batches with the local scorer."""
+        representatives = list(duplicate_groups)
+        logger.info(f"Scoring {len(narratives) * len(representatives)} pairs with the local scorer")
+        rows = [results.row(n) for n in narratives]
+        scores = self.local_scorer.score_pairs(
+            [(articles[a], narratives[n]) for n in narratives for a in representatives])
+        results.values[np.ix_(rows, results.columns(representatives))] = scores.reshape(len(rows), len(representatives))
+
+    def calibrate_local_scorer(self, narratives: Dict[int, str], articles: Dict[int, str],
+                               sample_size: int = 30, seed: int = 42) -> None:
+        """Calibrate the local scorer against chat-model scores on a random sample of pairs."""
+        if self.local_scorer is None:
+            return
+        if not self.openai_api_key:
+            logger.warning("OpenAI API key not provided. Skipping local scorer calibration.")
+            return
+        keys = [(narrative_id, article_id) for narrative_id in narratives for article_id in articles]
+        sample = random.Random(seed).sample(keys, min(sample_size, len(keys)))
+        pairs = [(articles[a], narratives[n]) for n, a in sample]
+        reference = [self.evaluate_agreement(article_text, narrative) for article_text, narrative in pairs]
+        # Pairs the chat model could not score are left out of the calibration
+        resolved = [i for i, score in enumerate(reference) if not np.isnan(score)]
+        self.local_scorer.calibrate([pairs[i] for i in resolved], [reference[i] for i in resolved])
+
+    def save_results(self, results: Union[ScoreMatrix, List[Tuple[int, int, float]]],
+                     output_file: str = "narrative_article_mapping.csv") -> None:
+        """
+        Save the mapping results to a CSV file.
+        The score matrix is also saved next to it as a compressed .npz (same name, .npz extension),
+        and pairs without a valid score are listed in <name>_unresolved.csv.
+        """
+        import pandas as pd
         try:
-            with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['narrative_id', 'article_id', 'agreement_score']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                
-                writer.writeheader()
-                for narrative_id, article_id, score in results:
-                    writer.writerow({
-                        'narrative_id': narrative_id,
-                        'article_id': article_id,
-                        'agreement_score': score
-                    })
-                
+            if not isinstance(results, ScoreMatrix):
+                results = ScoreMatrix.from_triples(results)
+            base = os.path.splitext(output_file)[0]
+            results.save(base + ".npz")
+            pd.DataFrame(results.to_long()).to_csv(output_file, index=False)
             logger.info(f"Results saved to {output_file}")
+            unresolved = results.unresolved()
+            if unresolved:
+                pd.DataFrame(unresolved, columns=['narrative_id', 'article_id']).to_csv(base + "_unresolved.csv", index=False)
+                logger.info(f"{len(unresolved)} unresolved pairs saved to {base}_unresolved.csv")
         except Exception as e:
             logger.error(f"Error saving results to CSV: {e}")
 
@@ -143,7 +251,7 @@ def main():
     narratives_file = "narratives.csv"
     output_file = "narrative_article_mapping.csv"
     
-    mapper = NarrativeMapper()
+    mapper = NarrativeMapper(scorer=os.environ.get("AGREEMENT_SCORER", "chat"))
     
     # Load narratives and articles
     narratives = mapper.load_narratives(narratives_file)
@@ -153,6 +261,9 @@ def main():
         logger.error("Failed to load narratives or articles. Exiting.")
         return
     
+    # Align the local scorer with the chat model on a small sample
+    mapper.calibrate_local_scorer(narratives, articles)
+    
     # Map narratives to articles
     results = mapper.map_narratives_to_articles(narratives, articles)
     
@@ -161,6 +272,7 @@ def main():
     
     print(f"Completed mapping {len(narratives)} narratives to {len(articles)} articles.")
     print(f"Results saved to {output_file}")
+    prompt_stats.log_summary()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+"""
+Streaming clustering for continuously arriving articles.
+
+Instead of refitting KMeans over the whole corpus, each new embedding is
+assigned to its nearest centroid by cosine similarity (O(k*d) per article),
+centroids move with mini-batch updates, and an embedding that is not similar
+enough to any centroid starts a new cluster. Each centroid remembers where it
+was when its narrative was last generated, so narratives whose centroid has
+drifted can be flagged for regeneration.
+"""
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class OnlineClusterer:
+    """
+    Mini-batch spherical k-means with novelty-driven cluster creation.
+
+    novelty_threshold: minimum cosine similarity to the nearest centroid for an
+    embedding to join that cluster; below it a new cluster is started.
+    max_count: caps the per-centroid count used for the learning rate, so that
+    old clusters keep adapting to new articles instead of freezing.
+    """
+
+    def __init__(self, dim: int, novelty_threshold: float = 0.8, max_count: int = 500):
+        self.dim = dim
+        self.novelty_threshold = novelty_threshold
+        self.max_count = max_count
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self.counts = np.empty(0, dtype=np.int64)
+        # Centroid positions when each cluster's narrative was last (re)generated
+        self.anchors = np.empty((0, dim), dtype=np.float32)
+
+    @property
+    def n_clusters(self) -> int:
+        return len(self.centroids)
+
+    def _spawn(self, vector: np.ndarray) -> int:
+        self.centroids = np.vstack([self.centroids, vector[None, :]])
+        self.anchors = np.vstack([self.anchors, vector[None, :]])
+        self.counts = np.append(self.counts, 0)
+        return self.n_clusters - 1
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        """Nearest cluster for each embedding, without updating the model (-1 if there are no clusters)."""
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self.n_clusters == 0:
+            return np.full(len(embeddings), -1)
+        return (embeddings @ self.centroids.T).argmax(axis=1)
+
+    def partial_fit(self, embeddings: np.ndarray) -> List[int]:
+        """
+        Assign a batch of embeddings, starting new clusters for novel ones, then
+        move each touched centroid towards the mean of its new members.
+        Returns the cluster label of every embedding.
+        """
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        labels = []
+        for vector in embeddings:
+            if self.n_clusters:
+                similarities = self.centroids @ vector
+                best = int(similarities.argmax())
+                if similarities[best] >= self.novelty_threshold:
+                    labels.append(best)
+                    continue
+            labels.append(self._spawn(vector))
+
+        labels_array = np.asarray(labels)
+        for cluster_id in np.unique(labels_array):
+            members = embeddings[labels_array == cluster_id]
+            self.counts[cluster_id] += len(members)
+            rate = len(members) / min(self.counts[cluster_id], self.max_count)
+            updated = self.centroids[cluster_id] + min(rate, 1.0) * (members.mean(axis=0) - self.centroids[cluster_id])
+            self.centroids[cluster_id] = _normalize(updated)
+        return labels
+
+    def drift(self) -> np.ndarray:
+        """Cosine distance of every centroid from its anchor."""
+        return 1.0 - np.einsum('ij,ij->i', self.centroids, _normalize(self.anchors))
+
+    def drifted_clusters(self, threshold: float) -> List[int]:
+        """Clusters whose centroid moved more than threshold (cosine distance) since their narrative was generated."""
+        return [int(i) for i in np.flatnonzero(self.drift() > threshold)]
+
+    def mark_regenerated(self, cluster_ids: List[int]) -> None:
+        """Reset the anchors of clusters whose narratives were just regenerated."""
+        for cluster_id in cluster_ids:
+            self.anchors[cluster_id] = self.centroids[cluster_id]
+
+    def save(self, path: str) -> None:
+        """Write the model to path, which should end in .npz."""
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, counts=self.counts, anchors=self.anchors,
+                     novelty_threshold=self.novelty_threshold, max_count=self.max_count)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def load(cls, path: str, dim: Optional[int] = None) -> "OnlineClusterer":
+        data = np.load(path)
+        clusterer = cls(data['centroids'].shape[1] if dim is None else dim,
+                        float(data['novelty_threshold']), int(data['max_count']))
+        clusterer.centroids = data['centroids'].astype(np.float32)
+        clusterer.counts = data['counts']
+        clusterer.anchors = data['anchors'].astype(np.float32)
+        return clusterer
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Streaming orchestrator for the narrative pipeline.
+
+Links ingestion -> summarization -> embedding -> clustering -> narrative
+generation -> scoring -> combine as stages connected by bounded queues, so the
+I/O-bound LLM stages overlap with the CPU-bound local stages instead of each
+step waiting for the previous one to finish and re-reading its CSV.
+"""
+import argparse
+import functools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from profiling import profiler
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input stream
+_END = "__END_OF_STREAM__"
+
+
+class Stage:
+    """
+    A pipeline stage backed by a pool of workers.
+
+    Map stages call `fn(item)` for every input item; a return value of None
+    drops the item and, with `fan_out`, the return value is an iterable of
+    output items. Barrier stages (`barrier=True`) collect their whole input
+    and call `fn(items)` once, yielding zero or more output items.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, mode: str = "thread",
+                 fan_out: bool = False, barrier: bool = False, queue_size: int = 32):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown stage mode: {mode}")
+        self.name = name
+        self.fn = fn
+        self.workers = 1 if barrier else workers
+        self.mode = mode
+        self.fan_out = fan_out
+        self.barrier = barrier
+        # Size of this stage's input queue; a full queue blocks the upstream stage
+        self.queue_size = queue_size
+
+
+def _emit(stage: Stage, result: Any, out_queue) -> int:
+    """Put a stage result on the output queue, returns the number of items emitted."""
+    if result is None:
+        return 0
+    if not (stage.fan_out or stage.barrier):
+        out_queue.put(result)
+        return 1
+    emitted = 0
+    for item in result:
+        out_queue.put(item)
+        emitted += 1
+    return emitted
+
+
+def _stage_worker(stage: Stage, in_queue, out_queue, stats_queue) -> None:
+    """Worker loop for a stage; runs in a thread or in a separate process."""
+    processed, emitted, errors = 0, 0, 0
+    if stage.barrier:
+        items = []
+        while True:
+            item = in_queue.get()
+            if isinstance(item, str) and item == _END:
+                break
+            items.append(item)
+        processed = len(items)
+        try:
+            emitted += _emit(stage, stage.fn(items), out_queue)
+        except Exception as e:
+            logger.error(f"Error in stage {stage.name}: {e}")
+            errors += 1
+    else:
+        while True:
+            item = in_queue.get()
+            if isinstance(item, str) and item == _END:
+                break
+            processed += 1
+            try:
+                emitted += _emit(stage, stage.fn(item), out_queue)
+            except Exception as e:
+                logger.error(f"Error in stage {stage.name}: {e}")
+                errors += 1
+    stats_queue.put((stage.name, processed, emitted, errors))
+
+
+def _process_stage_worker(stage: Stage, in_queue, out_queue, stats_queue) -> None:
+    """Entry point of a stage's worker process."""
+    try:
+        _stage_worker(stage, in_queue, out_queue, stats_queue)
+    finally:
+        # Worker processes exit without running atexit handlers
+        profiler.write()
+
+
+class Pipeline:
+    """
+    Runs a chain of stages, each stage's workers feeding the next stage's bounded queue.
+    Process-mode stages are pickled, so their functions must be module-level (or partials of them).
+    start_method selects the multiprocessing start method, the platform default if None.
+    """
+
+    def __init__(self, stages: List[Stage], start_method: Optional[str] = None, poll_seconds: float = 1.0):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.start_method = start_method
+        # How often worker processes are checked for crashes while waiting on them
+        self.poll_seconds = poll_seconds
+
+    def run(self, source: Iterable[Any]) -> Dict[str, Dict[str, float]]:
+        """
+        Feed the source through all stages and return per-stage statistics.
+        Raises RuntimeError if a worker process dies instead of blocking on its output.
+        """
+        use_processes = any(stage.mode == "process" for stage in self.stages)
+        ctx = multiprocessing.get_context(self.start_method)
+        make_queue = ctx.Queue if use_processes else queue.Queue
+
+        queues = [make_queue(maxsize=stage.queue_size) for stage in self.stages]
+        # The last stage's output is drained and discarded
+        queues.append(make_queue(maxsize=self.stages[-1].queue_size))
+        stats_queue = make_queue()
+        start = time.time()
+
+        stage_workers = []
+        for i, stage in enumerate(self.stages):
+            workers = []
+            for _ in range(stage.workers):
+                args = (stage, queues[i], queues[i + 1], stats_queue)
+                if stage.mode == "process":
+                    worker = ctx.Process(target=_process_stage_worker, args=args, daemon=True,
+                                         name=f"{stage.name}-worker")
+                else:
+                    worker = threading.Thread(target=_stage_worker, args=args, daemon=True)
+                worker.start()
+                workers.append(worker)
+            stage_workers.append(workers)
+
+        # Once every worker of a stage has finished, close the next stage's input
+        closers = []
+        for i, workers in enumerate(stage_workers):
+            downstream = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+            closer = threading.Thread(target=self._close_after, args=(workers, queues[i + 1], downstream), daemon=True)
+            closer.start()
+            closers.append(closer)
+
+        drain = threading.Thread(target=self._drain, args=(queues[-1],), daemon=True)
+        drain.start()
+
+        for item in source:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_END)
+
+        # A crashed process never sends its end-of-stream markers or statistics, so wait with a timeout
+        for closer in closers:
+            while closer.is_alive():
+                self._check_workers(stage_workers)
+                closer.join(self.poll_seconds)
+        self._check_workers(stage_workers)
+        drain.join()
+
+        stats = {stage.name: {"processed": 0, "emitted": 0, "errors": 0} for stage in self.stages}
+        for _ in range(sum(stage.workers for stage in self.stages)):
+            try:
+                name, processed, emitted, errors = stats_queue.get(timeout=max(self.poll_seconds, 5.0))
+            except queue.Empty:
+                self._check_workers(stage_workers)
+                raise RuntimeError("Pipeline workers finished without reporting their statistics") from None
+            stats[name]["processed"] += processed
+            stats[name]["emitted"] += emitted
+            stats[name]["errors"] += errors
+        logger.info(f"Pipeline finished in {time.time() - start:.1f}s")
+        for name, stage_stats in stats.items():
+            logger.info(f"Stage {name}: {stage_stats}")
+        return stats
+
+    def _check_workers(self, stage_workers: List[List[Any]]) -> None:
+        """Terminate the pipeline's processes and raise if any worker process exited abnormally."""
+        failed = [f"{stage.name} (exit code {worker.exitcode})"
+                  for stage, workers in zip(self.stages, stage_workers) for worker in workers
+                  if stage.mode == "process" and worker.exitcode not in (None, 0)]
+        if not failed:
+            return
+        for stage, workers in zip(self.stages, stage_workers):
+            for worker in workers:
+                if stage.mode == "process" and worker.is_alive():
+                    worker.terminate()
+        raise RuntimeError(f"Pipeline worker processes died: {', '.join(failed)}")
+
+    @staticmethod
+    def _close_after(workers: List[Any], out_queue, downstream_workers: int) -> None:
+        for worker in workers:
+            worker.join()
+        for _ in range(downstream_workers):
+            out_queue.put(_END)
+
+    @staticmethod
+    def _drain(in_queue) -> None:
+        while True:
+            item = in_queue.get()
+            if isinstance(item, str) and item == _END:
+                break
+
+
+# Per-process instances, created on first use inside each worker thread/process
+_generator = None
+_mapper = None
+_instance_lock = threading.Lock()
+
+
+def _get_generator():
+    global _generator
+    with _instance_lock:
+        if _generator is None:
+            from gen_narratives2 import NarrativeGenerator
+            _generator = NarrativeGenerator()
+    return _generator
+
+
+def _get_mapper():
+    global _mapper
+    with _instance_lock:
+        if _mapper is None:
+            from map_narratives import NarrativeMapper
+            _mapper = NarrativeMapper()
+    return _mapper
+
+
+def iter_articles(articles_file: str, max_articles: Optional[int] = None, chunksize: int = 50) -> Iterable[Dict[str, Any]]:
+    """Stream articles from the CSV file in chunks instead of loading it whole."""
+    import pandas as pd
+
+    emitted = 0
+    for chunk in pd.read_csv(articles_file, chunksize=chunksize):
+        for index, row in chunk.iterrows():
+            if max_articles and emitted >= max_articles:
+                return
+            article_text = row.get('Full Text of Article', '')
+            if not isinstance(article_text, str) or not article_text:
+                continue
+            yield {
+                'article_id': index,
+                'title': row.get('Title', f"Article {index+1}"),
+                'text': article_text,
+            }
+            emitted += 1
+
+
+def summarize_stage(article: Dict[str, Any]) -> Dict[str, Any]:
+    article['summary'] = _get_generator().summarize_article(article['text'])
+    return article
+
+
+def embed_stage(article: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    summary_text = " ".join([f"{k}: {v}" for k, v in article['summary'].items()])
+    embedding = _get_generator().generate_embedding(summary_text)
+    if len(embedding) == 0:
+        logger.warning(f"Dropping article {article['article_id']}: no embedding")
+        return None
+    article['embedding'] = embedding
+    return article
+
+
+def cluster_stage(articles: List[Dict[str, Any]], n_clusters: Optional[int] = None) -> Iterable[Dict[str, Any]]:
+    import numpy as np
+
+    if not articles:
+        return
+    embeddings = np.vstack([a['embedding'] for a in articles])
+    if n_clusters is None:
+        from cluster_selection import select_n_clusters
+        labels, _, _ = select_n_clusters(embeddings)
+    else:
+        from sklearn.cluster import KMeans
+        labels = KMeans(n_clusters=min(n_clusters, len(articles)), random_state=42).fit_predict(embeddings)
+
+    # Every narrative is scored against every article, so each cluster carries the full article set
+    all_articles = {a['article_id']: a['text'] for a in articles}
+    for cluster_id in sorted(set(labels)):
+        members = [a for a, label in zip(articles, labels) if label == cluster_id]
+        yield {
+            'cluster_id': int(cluster_id),
+            'summaries': {a['article_id']: a['summary'] for a in members},
+            'articles': all_articles,
+        }
+
+
+def make_cluster_stage(n_clusters: Optional[int]) -> Callable:
+    """Cluster stage function; a partial so that it can be pickled into a worker process."""
+    return functools.partial(cluster_stage, n_clusters=n_clusters)
+
+
+def narrate_stage(cluster: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    summaries = cluster['summaries']
+    narrative = _get_generator().generate_narrative(summaries, list(summaries.keys()))
+    for article_id, article_text in cluster['articles'].items():
+        yield {
+            'narrative_id': cluster['cluster_id'],
+            'narrative': narrative,
+            'article_ids': list(summaries.keys()),
+            'article_id': article_id,
+            'article_text': article_text,
+        }
+
+
+def score_stage(pair: Dict[str, Any]) -> Dict[str, Any]:
+    result = _get_mapper().evaluate_agreement_detailed(pair['article_text'], pair['narrative'])
+    # Unresolved pairs keep NaN score and confidence and are listed as unresolved when saved
+    pair['agreement_score'] = result["score"] if result is not None else float("nan")
+    pair['confidence'] = result["confidence"] if result is not None else float("nan")
+    del pair['article_text']
+    return pair
+
+
+def combine_stage(pairs: List[Dict[str, Any]], articles_file: str, narratives_file: str, mapping_file: str,
+                  output_file: str, timeline_dir: Optional[str] = None) -> Iterable[Any]:
+    from combine import combine_data
+    from score_matrix import ScoreMatrix
+
+    narratives = {}
+    for pair in pairs:
+        narratives[pair['narrative_id']] = {
+            'narrative': pair['narrative'],
+            'article_ids': pair['article_ids'],
+            'article_count': len(pair['article_ids']),
+        }
+    _get_generator().save_narratives_to_csv(narratives, narratives_file)
+
+    results = ScoreMatrix.from_long({
+        "narrative_id": [p['narrative_id'] for p in pairs],
+        "article_id": [p['article_id'] for p in pairs],
+        "agreement_score": [p['agreement_score'] for p in pairs],
+        "confidence": [p.get('confidence', float("nan")) for p in pairs],
+    })
+    _get_mapper().save_results(results, mapping_file)
+
+    combine_data(mapping_file, articles_file, output_file, timeline_dir)
+    return []
+
+
+def make_combine_stage(articles_file: str, narratives_file: str, mapping_file: str, output_file: str,
+                       timeline_dir: Optional[str] = None) -> Callable:
+    """Combine stage function; a partial so that it can be pickled into a worker process."""
+    return functools.partial(combine_stage, articles_file=articles_file, narratives_file=narratives_file,
+                             mapping_file=mapping_file, output_file=output_file, timeline_dir=timeline_dir)
+
+
+def build_pipeline(articles_file: str, n_clusters: Optional[int] = None, llm_workers: int = 8,
+                   local_mode: str = "thread", queue_size: int = 32,
+                   narratives_file: str = "narratives.csv",
+                   mapping_file: str = "narrative_article_mapping.csv",
+                   output_file: str = "combined_narrative_articles.csv",
+                   timeline_dir: Optional[str] = None) -> Pipeline:
+    """Build the standard narrative pipeline."""
+    return Pipeline([
+        Stage("summarize", summarize_stage, workers=llm_workers, queue_size=queue_size),
+        Stage("embed", embed_stage, workers=llm_workers, queue_size=queue_size),
+        Stage("cluster", make_cluster_stage(n_clusters), barrier=True, mode=local_mode, queue_size=queue_size),
+        Stage("narrate", narrate_stage, workers=llm_workers, fan_out=True, queue_size=queue_size),
+        Stage("score", score_stage, workers=llm_workers, queue_size=queue_size),
+        Stage("combine", make_combine_stage(articles_file, narratives_file, mapping_file, output_file, timeline_dir),
+              barrier=True, mode=local_mode, queue_size=queue_size),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the narrative pipeline as a stream of stages.")
+    parser.add_argument("--articles", default="webset-articles_cut_sea_cables.csv")
+    parser.add_argument("--max-articles", type=int, default=10)
+    parser.add_argument("--n-clusters", type=int, help="Fixed number of clusters (selected automatically if omitted)")
+    parser.add_argument("--llm-workers", type=int, default=8, help="Workers per LLM-bound stage")
+    parser.add_argument("--queue-size", type=int, default=32, help="Bound of each inter-stage queue")
+    parser.add_argument("--local-mode", choices=["thread", "process"], default="thread",
+                        help="Run the CPU-bound local stages in threads or separate processes")
+    parser.add_argument("--timeline", help="Also write a narrative timeline index to this directory")
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args.articles, n_clusters=args.n_clusters, llm_workers=args.llm_workers,
+                              local_mode=args.local_mode, queue_size=args.queue_size, timeline_dir=args.timeline)
+    pipeline.run(iter_articles(args.articles, args.max_articles))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Opt-in profiling of the local compute stages.
+
+Functions decorated with `profiled(name)` (unit splitting, local embedding,
+the cluster sweep, near-duplicate detection, NLI scoring, the combine joins)
+run under cProfile, a stack sampler and tracemalloc when profiling is
+enabled, either with `cli.py --profile DIR` or by setting
+NARRATIVE_PROFILE_DIR for any script. Per stage and process, DIR receives:
+
+    <stage>.<pid>.prof        cProfile stats (snakeviz, pstats)
+    <stage>.<pid>.collapsed   sampled stacks in collapsed format (flamegraph.pl, speedscope)
+    summary.<pid>.json        calls, wall time, peak traced memory and sample count per stage
+
+Each process keeps one cProfile profile per stage, enabled around every call,
+and one sampler thread for all stages, so per-call stages such as unit
+splitting stay cheap. Only one thread at a time runs under cProfile; calls
+in other threads are timed and sampled only.
+
+tracemalloc has a single peak per process, so a stage's peak is that of the
+whole process while the stage ran. When stages overlap in threads, each
+one's peak includes the others' allocations; the summary counts such calls
+as overlapping_calls. Peaks are exact per stage only in process mode or when
+one stage runs at a time.
+
+Child processes inherit the environment variable, so they profile too, but
+multiprocessing children exit without running atexit handlers: worker
+process targets call `profiler.write()` when they finish, as the pipeline's
+process stages and the local shard workers do. When profiling is disabled
+the decorator costs one attribute check per call.
+"""
+import atexit
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR_ENV = "NARRATIVE_PROFILE_DIR"
+
+
+class StackSampler:
+    """Samples, at a fixed interval, the stacks of the threads currently inside a stage."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def add(self, thread_id: int, name: str) -> None:
+        with self._lock:
+            self._threads[thread_id] = name
+
+    def remove(self, thread_id: int) -> None:
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def collapsed(self) -> Dict[str, Counter]:
+        """Copy of the collapsed stack counts per stage."""
+        with self._lock:
+            return {name: Counter(stacks) for name, stacks in self.stacks.items()}
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if not self._threads:
+                    continue
+                current = sys._current_frames()
+                for thread_id, name in self._threads.items():
+                    stack = self._collapse(current.get(thread_id))
+                    if stack:
+                        self.stacks.setdefault(name, Counter())[stack] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            # Leave out the profiling wrappers themselves
+            if code.co_filename != __file__:
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+
+class Profiler:
+    """Collects per-stage profiles in memory and writes them to the output directory."""
+
+    def __init__(self, output_dir: Optional[str] = None, sample_interval: float = 0.005):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self._atexit_registered = False
+        self._reset()
+
+    def _reset(self) -> None:
+        """Drop the state of this process; in a forked child, what was copied from the parent."""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {}
+        # One cProfile profile per stage, reused across calls
+        self._profiles = {}
+        # Stage currently running under cProfile, if any
+        self._profiling_stage = None
+        # Memory entries of the stages running in any thread, by id
+        self._running = {}
+        self._sampler = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.output_dir is not None
+
+    def enable(self, output_dir: str) -> None:
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        # Inherited by worker processes so their stages are profiled as well
+        os.environ[PROFILE_DIR_ENV] = output_dir
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if not self._atexit_registered:
+            atexit.register(self.write)
+            self._atexit_registered = True
+
+    def _acquire_profile(self, name: str) -> Optional[cProfile.Profile]:
+        """The stage's profile if no other thread is running under cProfile, else None."""
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = StackSampler(self.sample_interval)
+                self._sampler.start()
+            if self._profiling_stage is not None:
+                return None
+            self._profiling_stage = name
+            if name not in self._profiles:
+                self._profiles[name] = cProfile.Profile()
+            return self._profiles[name]
+
+    def _release_profile(self) -> None:
+        with self._lock:
+            self._profiling_stage = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Profile the enclosed block as the named stage; nested stages only add timing and memory."""
+        if not self.enabled:
+            yield
+            return
+
+        active = getattr(self._local, "active", None)
+        if active is None:
+            active = self._local.active = []
+        outermost = not active
+        thread_id = threading.get_ident()
+        entry = {"peak": 0, "thread": thread_id, "overlapped": False}
+        with self._lock:
+            # tracemalloc keeps one process-wide peak: fold it into every running stage, in any
+            # thread, before resetting it, so that no stage loses the peak reached so far
+            peak = tracemalloc.get_traced_memory()[1]
+            for other in self._running.values():
+                other["peak"] = max(other["peak"], peak)
+                if other["thread"] != thread_id:
+                    other["overlapped"] = entry["overlapped"] = True
+            tracemalloc.reset_peak()
+            self._running[id(entry)] = entry
+        active.append(entry)
+
+        profile = self._acquire_profile(name) if outermost else None
+        if outermost:
+            self._sampler.add(thread_id, name)
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self._release_profile()
+            elapsed = time.perf_counter() - start
+            if outermost:
+                self._sampler.remove(thread_id)
+            active.pop()
+            with self._lock:
+                del self._running[id(entry)]
+                peak = tracemalloc.get_traced_memory()[1]
+                for other in self._running.values():
+                    other["peak"] = max(other["peak"], peak)
+            self._record(name, elapsed, max(entry["peak"], peak), entry["overlapped"])
+
+    def _record(self, name: str, elapsed: float, peak: int, overlapped: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "peak_memory_bytes": 0,
+                                                  "overlapping_calls": 0})
+            stats["calls"] += 1
+            stats["wall_seconds"] += elapsed
+            stats["peak_memory_bytes"] = max(stats["peak_memory_bytes"], peak)
+            stats["overlapping_calls"] += int(overlapped)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        stacks = self._sampler.collapsed() if self._sampler else {}
+        with self._lock:
+            return {name: dict(stats, samples=sum(stacks.get(name, Counter()).values()))
+                    for name, stats in self._stats.items()}
+
+    def write(self) -> None:
+        """Write the profiles, collapsed stacks and summary collected so far in this process."""
+        if not self.enabled or not self._stats:
+            return
+        pid = os.getpid()
+        stacks = self._sampler.collapsed() if self._sampler else {}
+        with self._lock:
+            for name, profile in self._profiles.items():
+                # Reading the stats of a running profile would stop it
+                if name == self._profiling_stage:
+                    continue
+                try:
+                    pstats.Stats(profile).dump_stats(os.path.join(self.output_dir, f"{name}.{pid}.prof"))
+                except TypeError:
+                    # Nothing was recorded
+                    continue
+        for name, counts in stacks.items():
+            if counts:
+                with open(os.path.join(self.output_dir, f"{name}.{pid}.collapsed"), "w") as f:
+                    for stack, count in counts.most_common():
+                        f.write(f"{stack} {count}\n")
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, f"summary.{pid}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]["wall_seconds"]):
+            logger.info(f"Profile {name}: {stats['calls']} calls, {stats['wall_seconds']:.2f}s, "
+                        f"peak {stats['peak_memory_bytes'] / 2**20:.1f} MiB, {stats['samples']} samples")
+        logger.info(f"Profiles written to {self.output_dir}")
+
+
+# Shared by all stages in the process; picks up the directory from the environment in child processes
+profiler = Profiler()
+if os.environ.get(PROFILE_DIR_ENV):
+    profiler.enable(os.environ[PROFILE_DIR_ENV])
+# A forked child starts with its own, empty profiles rather than a copy of the parent's
+os.register_at_fork(after_in_child=profiler._reset)
+
+
+def profiled(name: str) -> Callable[[Callable], Callable]:
+    """Decorator that profiles every call of the function as the named stage."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with profiler.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
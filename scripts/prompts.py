@@ -0,0 +1,266 @@
+"""
+Versioned prompt templates for the LLM calls.
+
+Every template puts its static instructions first and the variable content
+(article, summaries, narrative) last, with whitespace normalized, so that
+consecutive calls share an identical token prefix that the provider can
+cache. Templates carry a version that is part of their cache key; bump it
+whenever the static text changes. Prompt token usage is recorded per
+template.
+"""
+import hashlib
+import logging
+import re
+import textwrap
+import threading
+from typing import Any, Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def normalize_whitespace(text: str) -> str:
+    """Dedent, strip trailing spaces, collapse runs of spaces and blank lines."""
+    text = textwrap.dedent(text).strip()
+    lines = [re.sub(r'[ \t]+', ' ', line).strip() for line in text.split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when installed, otherwise estimate at ~4 characters per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+class PromptTemplate:
+    """A chat prompt with a static system message and instructions followed by variable sections."""
+
+    def __init__(self, name: str, version: int, system: str, instructions: str, sections: List[str]):
+        self.name = name
+        self.version = version
+        self.system = normalize_whitespace(system)
+        self.instructions = normalize_whitespace(instructions)
+        # Names of the variable sections, rendered in this order after the instructions
+        self.sections = sections
+        digest = hashlib.sha256(f"{self.system}\n{self.instructions}".encode('utf-8')).hexdigest()[:12]
+        self.cache_key = f"{name}@v{version}:{digest}"
+        self.static_tokens = count_tokens(self.system) + count_tokens(self.instructions)
+
+    def messages(self, **variables: str) -> List[Dict[str, str]]:
+        """Render the chat messages; section values are whitespace-normalized and appended last."""
+        missing = [section for section in self.sections if section not in variables]
+        if missing:
+            raise KeyError(f"Prompt {self.name} is missing sections: {missing}")
+        parts = [self.instructions]
+        for section in self.sections:
+            parts.append(f"{section.upper()}:\n{normalize_whitespace(str(variables[section]))}")
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": "\n\n".join(parts)},
+        ]
+
+
+class PromptStats:
+    """Thread-safe per-template prompt token accounting."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, template: PromptTemplate, usage: Optional[Any]) -> None:
+        """Record the usage object of a chat completion made with the template."""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            stats = self._stats.setdefault(template.cache_key, {
+                "calls": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "static_tokens": template.static_tokens,
+            })
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["cached_tokens"] += cached_tokens
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per-template totals plus average prompt tokens per call and cached fraction."""
+        with self._lock:
+            result = {}
+            for key, stats in self._stats.items():
+                calls = stats["calls"] or 1
+                result[key] = dict(stats)
+                result[key]["avg_prompt_tokens"] = stats["prompt_tokens"] / calls
+                result[key]["cached_fraction"] = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+            return result
+
+    def log_summary(self) -> None:
+        for key, stats in self.summary().items():
+            logger.info(f"Prompt {key}: {stats['calls']} calls, {stats['avg_prompt_tokens']:.0f} prompt tokens/call "
+                        f"({stats['static_tokens']} static), {stats['cached_fraction']:.1%} cached")
+
+
+# Shared across all templates in the process
+prompt_stats = PromptStats()
+
+
+_NUMBER_WORDS = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+
+
+def _count_words(n: int) -> str:
+    return _NUMBER_WORDS[n] if n < len(_NUMBER_WORDS) else str(n)
+
+
+def article_summary_template(dimensions: Dict[str, List[str]], name: str = "article_summary",
+                             version: int = 1) -> PromptTemplate:
+    """Structured article summary over the given dimensions, each with its guiding questions."""
+    blocks = []
+    for i, (dimension, questions) in enumerate(dimensions.items(), start=1):
+        blocks.append(f"{i}. {dimension}:\n" + "\n".join(f"- {question}" for question in questions))
+    instructions = (
+        "Please analyze the article below and provide a structured summary according to these dimensions:\n\n"
+        + "\n\n".join(blocks)
+        + f"\n\nFormat your response as a JSON object with the {_count_words(len(dimensions))} dimensions as keys."
+    )
+    return PromptTemplate(
+        name=name,
+        version=version,
+        system="You are an expert analyst who extracts structured information from news articles.",
+        instructions=instructions,
+        sections=["article"],
+    )
+
+
+def cluster_narrative_template(subject: str, dimensions: List[str], points: List[str],
+                               name: str = "cluster_narrative", version: int = 2) -> PromptTemplate:
+    """Narrative synthesis over summaries of one cluster; points are what the narrative should cover."""
+    dimension_list = ", ".join(dimensions[:-1]) + f", and {dimensions[-1]}" if len(dimensions) > 1 else dimensions[0]
+    instructions = (
+        f"I have a set of article summaries that belong to the same narrative cluster about {subject}.\n"
+        f"Each summary is structured according to {_count_words(len(dimensions))} dimensions: {dimension_list}.\n\n"
+        "Based on the summaries below, generate a comprehensive narrative that captures the common themes,\n"
+        "perspectives, and information across these articles. The narrative should:\n\n"
+        + "\n".join(f"{i}. {point}" for i, point in enumerate(points, start=1))
+        + "\n\nYour narrative should be well-structured, approximately 300-500 words, and should accurately\n"
+        "represent the information contained in the summaries without adding speculation."
+    )
+    return PromptTemplate(
+        name=name,
+        version=version,
+        system="You are an expert analyst who synthesizes information from multiple sources into coherent narratives.",
+        instructions=instructions,
+        sections=["summaries"],
+    )
+
+
+def unit_narrative_template(details: str, name: str = "unit_narrative", version: int = 1) -> PromptTemplate:
+    """Narrative of a cluster of paragraphs; details lists what the narrative should identify."""
+    return PromptTemplate(
+        name=name,
+        version=version,
+        system="You are a helpful assistant that identifies the main narrative or theme from a collection of news article excerpts.",
+        instructions=f"Based on the paragraphs below, identify a narrative with these details {normalize_whitespace(details)}",
+        sections=["paragraphs"],
+    )
+
+
+# The undersea cable incident topic the scripts were written for; other topics are configured in topics.py
+CABLE_SUBJECT = "undersea cable incidents"
+
+CABLE_DIMENSIONS = {
+    "Blame Attribution": [
+        "Who is blamed or suspected?",
+        "Is the attribution direct, indirect, speculative, or disputed?",
+    ],
+    "Victim Entities": [
+        "Who or what is described as being attacked, damaged, or negatively impacted?",
+        "Include nations, companies, or infrastructure if applicable.",
+    ],
+    "Geographic Scope": [
+        "What specific maritime locations, chokepoints, or regions are mentioned?",
+        "Include countries, straits, cable landing sites, or exclusive economic zones (EEZs).",
+    ],
+    "Plausible Causes": [
+        "What causes or explanations are provided?",
+        "List all plausible causes mentioned in the article (e.g., sabotage, anchor drag, espionage, accident).",
+    ],
+    "Economic Consequences": [
+        "What economic impacts are described or implied?",
+        "Consider trade disruptions, telecom outages, rerouting costs, insurance, or industry effects.",
+    ],
+    "Environmental Consequences": [
+        "Are there any environmental harms mentioned?",
+        "Consider seabed damage, marine life disruption, ecological risk, or pollution.",
+    ],
+}
+
+NARRATIVE_POINTS = [
+    "Identify the main actors, locations, and events",
+    "Highlight consensus and disagreements in blame attribution",
+    "Summarize the range of causes suggested",
+    "Describe the scope and scale of impacts",
+    "Note any unique or outlier perspectives",
+]
+
+CABLE_UNIT_DETAILS = """
+    (a) actor(s) blamed for the cause of
+    the cable cutting event, b) actor(s) credited for saving the cable cutting event, c) the location at which
+    the cable cutting happened, d) what the speculated cause of the cable cutting was, malicious? accidental? coordinated?
+"""
+
+ARTICLE_SUMMARY = article_summary_template(CABLE_DIMENSIONS)
+
+CLUSTER_NARRATIVE = cluster_narrative_template(CABLE_SUBJECT, list(CABLE_DIMENSIONS), NARRATIVE_POINTS)
+
+UNIT_NARRATIVE = unit_narrative_template(CABLE_UNIT_DETAILS)
+
+AGREEMENT = PromptTemplate(
+    name="agreement",
+    version=2,
+    system="You are an objective analyst evaluating how news articles align with specific narratives.",
+    instructions="""
+        Evaluate how much the article below agrees or disagrees with the given narrative.
+
+        Assign a score from -1 to 1 where:
+        - Scores from 0 to 1 indicate agreement (1 being complete agreement)
+        - Scores from 0 to -1 indicate disagreement (-1 being complete disagreement)
+        - 0 indicates neutrality or no relation
+
+        Also give your confidence in the score from 0 (guess) to 1 (certain).
+        Respond with a JSON object {"score": <number>, "confidence": <number>} and no explanation.
+    """,
+    # The narrative is shared by every article it is scored against, so it comes before the article
+    sections=["narrative", "article"],
+)
+
+# Structured output schema for AGREEMENT responses
+AGREEMENT_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "agreement_score",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "score": {"type": "number"},
+                "confidence": {"type": "number"},
+            },
+            "required": ["score", "confidence"],
+            "additionalProperties": False,
+        },
+    },
+}
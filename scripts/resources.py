@@ -0,0 +1,31 @@
+"""
+Lazily created shared resources for the pipeline scripts.
+
+Heavy dependencies (openai, nltk data) are only imported or resolved the
+first time something needs them, and then cached for the rest of the
+process, so that light operations start quickly.
+"""
+import functools
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_openai_client(api_key: str):
+    """Return a process-wide OpenAI client for the API key."""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+
+@functools.lru_cache(maxsize=None)
+def ensure_nltk_data(resource: str, package: str) -> None:
+    """Resolve an NLTK resource (e.g. 'tokenizers/punkt_tab') once, downloading it if missing."""
+    import nltk
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        logger.info(f"Downloading NLTK package {package}")
+        nltk.download(package, quiet=True)
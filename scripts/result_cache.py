@@ -0,0 +1,87 @@
+"""
+Persistent cache of LLM results keyed by prompt version and input.
+
+Keys combine a template's cache key (name, version and digest of its static
+text) with the hash of the variable input, so a result is reused only for an
+identical prompt. Values are stored as JSON in SQLite; one cache can be
+shared by every topic run in a process and across runs.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+from embedding_store import text_hash
+from prompts import PromptTemplate
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Thread-safe JSON result cache in a SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # Worker threads share one connection; the lock serializes their use of it
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @staticmethod
+    def key(template: PromptTemplate, text: str, variant: str = "") -> str:
+        """variant separates results of the same prompt produced differently, e.g. by a model cascade."""
+        prefix = f"{template.cache_key}/{variant}" if variant else template.cache_key
+        return f"{prefix}:{text_hash(text)}"
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (key, json.dumps(value)))
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.close()
+
+
+def cached_result(cache: Optional[ResultCache], template: PromptTemplate, text: str, compute: Callable[[], Any],
+                  variant: str = "") -> Any:
+    """Return the cached result of the template on text, computing and storing it on a miss."""
+    if cache is None:
+        return compute()
+    key = ResultCache.key(template, text, variant)
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    return result
+
+
+def cached_checked_result(cache: Optional[ResultCache], template: PromptTemplate, text: str,
+                          compute: Callable[[], Tuple[Any, bool]], variant: str = "") -> Any:
+    """
+    Like cached_result, for compute functions that return (result, accepted), e.g. run_cascade.
+    Results that were not accepted are returned but not stored, so the next run tries again.
+    """
+    if cache is None:
+        return compute()[0]
+    key = ResultCache.key(template, text, variant)
+    result = cache.get(key)
+    if result is None:
+        result, accepted = compute()
+        if accepted:
+            cache.put(key, result)
+    return result
@@ -0,0 +1,178 @@
+"""
+Dense narrative x article agreement score matrix.
+
+Scores are held in a float32 array with one row per narrative and one column
+per article, NaN marking pairs that were not scored. The matrix is persisted
+as a compressed .npz with its id vectors, and per-narrative summaries and
+group (e.g. media location) statistics are computed with array operations
+instead of row-by-row joins.
+"""
+import logging
+import warnings
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class ScoreMatrix:
+    """Agreement scores of narratives (rows) against articles (columns), NaN where unscored."""
+
+    def __init__(self, narrative_ids: Sequence[int], article_ids: Sequence[int], values: np.ndarray = None,
+                 confidence: Optional[np.ndarray] = None):
+        self.narrative_ids = np.asarray(narrative_ids, dtype=np.int64)
+        self.article_ids = np.asarray(article_ids, dtype=np.int64)
+        shape = (len(self.narrative_ids), len(self.article_ids))
+        if values is None:
+            values = np.full(shape, np.nan, dtype=np.float32)
+        self.values = np.asarray(values, dtype=np.float32).reshape(shape)
+        # Optional per-pair confidence reported by the scorer
+        self.confidence = None if confidence is None else np.asarray(confidence, dtype=np.float32).reshape(shape)
+        self._narrative_index = {int(n): i for i, n in enumerate(self.narrative_ids)}
+        self._article_index = {int(a): j for j, a in enumerate(self.article_ids)}
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.values.shape
+
+    def row(self, narrative_id: int) -> int:
+        return self._narrative_index[int(narrative_id)]
+
+    def column(self, article_id: int) -> int:
+        return self._article_index[int(article_id)]
+
+    def columns(self, article_ids: Iterable[int]) -> List[int]:
+        return [self._article_index[int(a)] for a in article_ids]
+
+    def set(self, narrative_id: int, article_id: int, score: float) -> None:
+        self.values[self.row(narrative_id), self.column(article_id)] = score
+
+    def fan_out(self, groups: Dict[int, List[int]]) -> None:
+        """Copy each representative article's column to the other members of its group."""
+        for representative_id, members in groups.items():
+            if len(members) > 1:
+                self.values[:, self.columns(members)] = self.values[:, [self.column(representative_id)]]
+                if self.confidence is not None:
+                    self.confidence[:, self.columns(members)] = self.confidence[:, [self.column(representative_id)]]
+
+    @classmethod
+    def from_triples(cls, results: Iterable[Tuple[int, int, float]]) -> "ScoreMatrix":
+        results = list(results)
+        narrative_ids = sorted({int(n) for n, _, _ in results})
+        article_ids = sorted({int(a) for _, a, _ in results})
+        matrix = cls(narrative_ids, article_ids)
+        if results:
+            rows = [matrix.row(n) for n, _, _ in results]
+            cols = matrix.columns(a for _, a, _ in results)
+            matrix.values[rows, cols] = [np.nan if s is None else s for _, _, s in results]
+        return matrix
+
+    def to_triples(self, include_missing: bool = False) -> List[Tuple[int, int, float]]:
+        """(narrative_id, article_id, score) tuples in row-major order, unscored pairs skipped by default."""
+        rows, cols = np.nonzero(np.ones(self.shape, dtype=bool) if include_missing else ~np.isnan(self.values))
+        return [(int(self.narrative_ids[i]), int(self.article_ids[j]), float(self.values[i, j]))
+                for i, j in zip(rows, cols)]
+
+    def to_long(self, include_missing: bool = False) -> Dict[str, np.ndarray]:
+        """
+        Long-format columns (narrative_id, article_id, agreement_score and, if present, confidence)
+        in row-major order. Unscored pairs are skipped unless include_missing, where they have NaN scores.
+        """
+        mask = np.ones(self.shape, dtype=bool) if include_missing else ~np.isnan(self.values)
+        rows, cols = np.nonzero(mask)
+        columns = {
+            "narrative_id": self.narrative_ids[rows],
+            "article_id": self.article_ids[cols],
+            "agreement_score": self.values[mask],
+        }
+        if self.confidence is not None:
+            columns["confidence"] = self.confidence[mask]
+        return columns
+
+    @classmethod
+    def from_long(cls, columns: Dict[str, Sequence], narrative_ids: Optional[Sequence[int]] = None,
+                  article_ids: Optional[Sequence[int]] = None) -> "ScoreMatrix":
+        """
+        Build a matrix from to_long() columns; None or NaN scores stay unscored.
+        narrative_ids and article_ids default to the ids present in the columns.
+        """
+        narratives = np.asarray(columns["narrative_id"], dtype=np.int64)
+        articles = np.asarray(columns["article_id"], dtype=np.int64)
+        if narrative_ids is None:
+            narrative_ids = np.unique(narratives)
+        if article_ids is None:
+            article_ids = np.unique(articles)
+        matrix = cls(narrative_ids, article_ids)
+        rows = [matrix.row(n) for n in narratives]
+        cols = matrix.columns(articles)
+        matrix.values[rows, cols] = np.asarray(columns["agreement_score"], dtype=np.float64)
+        if "confidence" in columns:
+            matrix.confidence = np.full(matrix.shape, np.nan, dtype=np.float32)
+            matrix.confidence[rows, cols] = np.asarray(columns["confidence"], dtype=np.float64)
+        return matrix
+
+    def unresolved(self) -> List[Tuple[int, int]]:
+        """(narrative_id, article_id) pairs without a score."""
+        rows, cols = np.nonzero(np.isnan(self.values))
+        return [(int(self.narrative_ids[i]), int(self.article_ids[j])) for i, j in zip(rows, cols)]
+
+    def save(self, path: str) -> None:
+        arrays = {"narrative_ids": self.narrative_ids, "article_ids": self.article_ids, "values": self.values}
+        if self.confidence is not None:
+            arrays["confidence"] = self.confidence
+        np.savez_compressed(path, **arrays)
+        logger.info(f"Score matrix {self.shape} saved to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "ScoreMatrix":
+        data = np.load(path)
+        return cls(data['narrative_ids'], data['article_ids'], data['values'],
+                   data['confidence'] if 'confidence' in data.files else None)
+
+    def narrative_summary(self, quantiles: Sequence[float] = (0.1, 0.25, 0.5, 0.75, 0.9)) -> Dict[str, np.ndarray]:
+        """Per-narrative count, mean, std and quantiles of the scored pairs, one array entry per narrative."""
+        counts = (~np.isnan(self.values)).sum(axis=1)
+        summary = {"narrative_id": self.narrative_ids, "count": counts}
+        with warnings.catch_warnings():
+            # Narratives without any scored pair yield NaN statistics
+            warnings.simplefilter("ignore", RuntimeWarning)
+            summary["mean"] = np.nanmean(self.values, axis=1)
+            summary["std"] = np.nanstd(self.values, axis=1)
+            for q, values in zip(quantiles, np.nanquantile(self.values, quantiles, axis=1)):
+                summary[f"q{int(round(q * 100))}"] = values
+        return summary
+
+    def group_summary(self, article_groups: Dict[int, Hashable]) -> Dict[str, np.ndarray]:
+        """
+        Per (narrative, group) count and mean score, e.g. grouping articles by media location.
+        Articles missing from article_groups are ignored.
+        Returns long-format arrays: narrative_id, group, count, mean.
+        """
+        labels = [article_groups.get(int(a)) for a in self.article_ids]
+        groups = sorted({g for g in labels if g is not None}, key=str)
+        group_codes = {g: code for code, g in enumerate(groups)}
+        codes = np.array([group_codes.get(g, -1) if g is not None else -1 for g in labels], dtype=np.int64)
+        keep = codes >= 0
+        values = self.values[:, keep]
+        codes = codes[keep]
+
+        scored = ~np.isnan(values)
+        # (narratives x groups) sums and counts via one-hot matrix products
+        one_hot = np.zeros((len(codes), len(groups)), dtype=np.float64)
+        one_hot[np.arange(len(codes)), codes] = 1.0
+        sums = np.where(scored, values, 0.0) @ one_hot
+        counts = scored.astype(np.float64) @ one_hot
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+
+        rows, cols = np.nonzero(counts)
+        return {
+            "narrative_id": self.narrative_ids[rows],
+            "group": np.array(groups, dtype=object)[cols],
+            "count": counts[rows, cols].astype(np.int64),
+            "mean": means[rows, cols],
+        }
+
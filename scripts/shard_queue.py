@@ -0,0 +1,403 @@
+"""
+Sharded narrative x article scoring over a SQLite work queue.
+
+The pair space is partitioned into shards (a block of narratives x a block
+of articles) recorded in a SQLite database. Worker processes, on one host or
+on several hosts sharing the database file, claim shards under a time-limited
+lease, score them and write their partial results back in the same
+transaction that completes the shard. Workers renew their lease while they
+score, and expired leases are reclaimed, so a crashed worker only loses its
+current shard. A merge step combines the partial results into
+narrative_article_mapping.csv. Shards store every pair they were given, with
+a NULL score for pairs that stayed unresolved and the scorer's confidence
+where it reports one, so the merged matrix carries the same unresolved pairs
+and confidence as a single-process run. Queues scored with the local NLI
+scorer are calibrated once when they are created, and every worker applies
+that calibration.
+
+The database uses SQLite's default rollback journal: WAL mode needs shared
+memory between the processes and does not work on network filesystems.
+Workers on several hosts need a shared filesystem with working POSIX locks.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from profiling import profiler
+from score_matrix import ScoreMatrix
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard_id INTEGER PRIMARY KEY,
+    narrative_ids TEXT NOT NULL,
+    article_ids TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker_id TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    narrative_id INTEGER NOT NULL,
+    article_id INTEGER NOT NULL,
+    agreement_score REAL,
+    shard_id INTEGER NOT NULL,
+    confidence REAL,
+    PRIMARY KEY (narrative_id, article_id)
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    article_id INTEGER PRIMARY KEY,
+    representative_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _nullable(value) -> Optional[float]:
+    """NaN as NULL for SQLite."""
+    return None if value is None or np.isnan(value) else float(value)
+
+
+class LeaseLostError(Exception):
+    """The worker's lease on a shard expired and the shard was claimed by another worker."""
+
+
+class Shard:
+    def __init__(self, shard_id: int, narrative_ids: List[int], article_ids: List[int]):
+        self.shard_id = shard_id
+        self.narrative_ids = narrative_ids
+        self.article_ids = article_ids
+
+
+class ShardQueue:
+    """A lease-based work queue of scoring shards stored in SQLite."""
+
+    def __init__(self, db_path: str, lease_seconds: float = 600.0, max_attempts: int = 3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        # Also converts databases created in WAL mode back to the rollback journal
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(SCHEMA)
+        # Queues created before confidence was recorded
+        if "confidence" not in [column[1] for column in self.conn.execute("PRAGMA table_info(results)")]:
+            self.conn.execute("ALTER TABLE results ADD COLUMN confidence REAL")
+
+    def create(self, narrative_ids: List[int], article_ids: List[int], articles_per_shard: int = 50,
+               narratives_per_shard: int = 1, duplicate_groups: Optional[Dict[int, List[int]]] = None,
+               reset: bool = False) -> int:
+        """
+        Partition the narrative x article pair space into shards.
+        With duplicate_groups, only representatives are scored and members are filled in by merge().
+        Refuses to add shards to a queue that already has some, unless reset clears the queue,
+        its results, its duplicate groups and its calibration first.
+        Returns the number of shards created.
+        """
+        if duplicate_groups:
+            article_ids = [a for a in article_ids if a in duplicate_groups]
+        shards = []
+        for n in range(0, len(narrative_ids), narratives_per_shard):
+            for a in range(0, len(article_ids), articles_per_shard):
+                shards.append((json.dumps([int(i) for i in narrative_ids[n:n + narratives_per_shard]]),
+                               json.dumps([int(i) for i in article_ids[a:a + articles_per_shard]])))
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self.conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+            if existing and not reset:
+                raise ValueError(f"{self.db_path} already holds {existing} shards; reset the queue to recreate them")
+            if existing:
+                for table in ("shards", "results", "duplicates", "meta"):
+                    self.conn.execute(f"DELETE FROM {table}")
+                logger.info(f"Cleared {existing} shards from {self.db_path}")
+            self.conn.executemany("INSERT INTO shards (narrative_ids, article_ids) VALUES (?, ?)", shards)
+            for representative_id, members in (duplicate_groups or {}).items():
+                self.conn.executemany("INSERT OR REPLACE INTO duplicates VALUES (?, ?)",
+                                      [(int(m), int(representative_id)) for m in members])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Created {len(shards)} shards in {self.db_path}")
+        return len(shards)
+
+    def claim(self, worker_id: str) -> Optional[Shard]:
+        """
+        Lease the next pending (or expired) shard, or return None when there is nothing to claim.
+        Expired shards that have used up their attempts are marked failed instead.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            exhausted = self.conn.execute(
+                "UPDATE shards SET status = 'failed', lease_expires = NULL, "
+                "error = COALESCE(error, 'lease expired on the last attempt') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).rowcount
+            if exhausted:
+                logger.warning(f"{exhausted} shards failed after their lease expired on the last attempt")
+            row = self.conn.execute(
+                "SELECT shard_id, narrative_ids, article_ids FROM shards "
+                "WHERE attempts < ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                "ORDER BY shard_id LIMIT 1",
+                (self.max_attempts, now)
+            ).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE shards SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE shard_id = ?",
+                (worker_id, now + self.lease_seconds, row[0])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return Shard(row[0], json.loads(row[1]), json.loads(row[2]))
+
+    def renew(self, shard: Shard, worker_id: str) -> None:
+        """Extend this worker's lease on a shard. Raises LeaseLostError if another worker took it over."""
+        updated = self.conn.execute(
+            "UPDATE shards SET lease_expires = ? WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, shard.shard_id, worker_id)
+        ).rowcount
+        if not updated:
+            raise LeaseLostError(f"Lease on shard {shard.shard_id} was lost")
+
+    def heartbeat(self, shard: Shard, worker_id: str) -> Callable[[], None]:
+        """A callback that renews the lease once a third of it has passed; call it between pairs."""
+        last_renewal = time.time()
+
+        def beat() -> None:
+            nonlocal last_renewal
+            if time.time() - last_renewal >= self.lease_seconds / 3:
+                self.renew(shard, worker_id)
+                last_renewal = time.time()
+        return beat
+
+    def complete(self, shard: Shard, worker_id: str, results: Dict[str, Sequence]) -> bool:
+        """
+        Store a shard's results, in ScoreMatrix.to_long(include_missing=True) form, and mark it
+        done if this worker still holds the lease. NaN scores are stored as unresolved pairs.
+        Returns False when the lease was lost to another worker, in which case nothing is written.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = self.conn.execute(
+                "UPDATE shards SET status = 'done', lease_expires = NULL, error = NULL "
+                "WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+                (shard.shard_id, worker_id)
+            ).rowcount
+            if updated:
+                confidence = results.get("confidence", [None] * len(results["narrative_id"]))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO results (narrative_id, article_id, agreement_score, confidence, shard_id) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(int(n), int(a), _nullable(score), _nullable(c), shard.shard_id)
+                     for n, a, score, c in zip(results["narrative_id"], results["article_id"],
+                                               results["agreement_score"], confidence)]
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        if not updated:
+            logger.warning(f"Lease on shard {shard.shard_id} was lost, discarding its results")
+        return bool(updated)
+
+    def fail(self, shard: Shard, worker_id: str, error: str) -> None:
+        """Release a shard after a failure so that it can be retried, up to max_attempts."""
+        self.conn.execute(
+            "UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_expires = NULL, error = ? WHERE shard_id = ? AND worker_id = ?",
+            (self.max_attempts, error, shard.shard_id, worker_id)
+        )
+
+    def set_calibration(self, slope: float, intercept: float) -> None:
+        """Record the local scorer calibration that every worker applies."""
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('nli_calibration', ?)",
+                          (json.dumps([float(slope), float(intercept)]),))
+
+    def calibration(self) -> Optional[Tuple[float, float]]:
+        """(slope, intercept) of the local scorer calibration, or None if the queue has none."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'nli_calibration'").fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def progress(self) -> Dict[str, int]:
+        """Number of shards per status."""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall())
+
+    def merge(self) -> ScoreMatrix:
+        """
+        Combine all partial results into one matrix over every narrative and article of the queue,
+        fanning representative scores out to their duplicates. Pairs that were not scored, including
+        those of unfinished shards, stay NaN.
+        """
+        narrative_ids, article_ids = set(), set()
+        for narratives, articles in self.conn.execute("SELECT narrative_ids, article_ids FROM shards"):
+            narrative_ids.update(json.loads(narratives))
+            article_ids.update(json.loads(articles))
+        article_ids.update(a for (a,) in self.conn.execute("SELECT article_id FROM duplicates"))
+        rows = self.conn.execute(
+            "SELECT r.narrative_id, COALESCE(d.article_id, r.article_id), r.agreement_score, r.confidence "
+            "FROM results r LEFT JOIN duplicates d ON d.representative_id = r.article_id "
+            "ORDER BY 1, 2"
+        ).fetchall()
+        pending = {status: count for status, count in self.progress().items() if status != 'done'}
+        if pending:
+            logger.warning(f"Merging with unfinished shards: {pending}")
+
+        columns = {
+            "narrative_id": [n for n, _, _, _ in rows],
+            "article_id": [a for _, a, _, _ in rows],
+            "agreement_score": [score for _, _, score, _ in rows],
+        }
+        # Scorers without a confidence (the local NLI scorer) leave the column empty
+        if any(c is not None for _, _, _, c in rows):
+            columns["confidence"] = [c for _, _, _, c in rows]
+        return ScoreMatrix.from_long(columns, sorted(narrative_ids), sorted(article_ids))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def init_queue(db_path: str, narratives_file: str, articles_file: str, articles_per_shard: int = 50,
+               dedup_threshold: Optional[float] = 0.8, reset: bool = False, scorer: str = "chat") -> int:
+    """
+    Create the shard queue for scoring every narrative against every article; reset replaces an
+    existing queue. With scorer="nli", the local scorer is calibrated here, once for all workers.
+    """
+    from map_narratives import NarrativeMapper
+    from dedup import group_near_duplicates
+
+    mapper = NarrativeMapper(scorer=scorer)
+    narratives = mapper.load_narratives(narratives_file)
+    articles = mapper.load_articles(articles_file)
+    duplicate_groups = group_near_duplicates(articles, dedup_threshold) if dedup_threshold is not None else None
+
+    queue = ShardQueue(db_path)
+    try:
+        shards = queue.create(sorted(narratives), sorted(articles), articles_per_shard,
+                              duplicate_groups=duplicate_groups, reset=reset)
+        if mapper.local_scorer is not None:
+            mapper.calibrate_local_scorer(narratives, articles)
+            queue.set_calibration(mapper.local_scorer.slope, mapper.local_scorer.intercept)
+        return shards
+    finally:
+        queue.close()
+
+
+def _require_calibration(queue: ShardQueue, scorer: str) -> Optional[Tuple[float, float]]:
+    """The queue's NLI calibration; raises ValueError for an NLI worker on a queue without one."""
+    if scorer != "nli":
+        return None
+    calibration = queue.calibration()
+    if calibration is None:
+        raise ValueError(f"{queue.db_path} has no NLI calibration; create the queue with the nli scorer")
+    return calibration
+
+
+def run_worker(db_path: str, narratives_file: str, articles_file: str, scorer: str = "chat",
+               worker_id: Optional[str] = None, lease_seconds: float = 600.0) -> int:
+    """
+    Claim and score shards until none are left. Returns the number of shards completed.
+    NLI workers apply the calibration stored in the queue and refuse queues without one.
+    """
+    from map_narratives import NarrativeMapper
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    queue = ShardQueue(db_path, lease_seconds=lease_seconds)
+
+    completed = 0
+    try:
+        calibration = _require_calibration(queue, scorer)
+        mapper = NarrativeMapper(scorer=scorer)
+        if calibration is not None:
+            mapper.local_scorer.slope, mapper.local_scorer.intercept = calibration
+        narratives = mapper.load_narratives(narratives_file)
+        articles = mapper.load_articles(articles_file)
+        while True:
+            shard = queue.claim(worker_id)
+            if shard is None:
+                break
+            logger.info(f"Worker {worker_id} scoring shard {shard.shard_id} "
+                        f"({len(shard.narrative_ids)} narratives x {len(shard.article_ids)} articles)")
+            try:
+                results = mapper.map_narratives_to_articles(
+                    {n: narratives[n] for n in shard.narrative_ids},
+                    {a: articles[a] for a in shard.article_ids},
+                    dedup_threshold=None, on_pair=queue.heartbeat(shard, worker_id)
+                ).to_long(include_missing=True)
+            except LeaseLostError as e:
+                logger.warning(f"Worker {worker_id} abandoning shard {shard.shard_id}: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed on shard {shard.shard_id}: {e}")
+                queue.fail(shard, worker_id, str(e))
+                continue
+            if queue.complete(shard, worker_id, results):
+                completed += 1
+    finally:
+        queue.close()
+    logger.info(f"Worker {worker_id} completed {completed} shards")
+    return completed
+
+
+def merge_results(db_path: str, output_file: str = "narrative_article_mapping.csv") -> int:
+    """
+    Write the merged shard results to the mapping CSV, with the score matrix and unresolved
+    pairs next to it as in a single-process run. Returns the number of scores written.
+    """
+    from map_narratives import NarrativeMapper
+
+    queue = ShardQueue(db_path)
+    try:
+        results = queue.merge()
+    finally:
+        queue.close()
+    NarrativeMapper().save_results(results, output_file)
+    return int((~np.isnan(results.values)).sum())
+
+
+def _run_local_worker(*args, **kwargs) -> None:
+    """Entry point of a local worker process."""
+    try:
+        run_worker(*args, **kwargs)
+    finally:
+        # Worker processes exit without running atexit handlers
+        profiler.write()
+
+
+def run_local(db_path: str, narratives_file: str, articles_file: str, workers: int = 4,
+              scorer: str = "chat", lease_seconds: float = 600.0) -> None:
+    """Run several worker processes on this host against the queue."""
+    queue = ShardQueue(db_path)
+    try:
+        _require_calibration(queue, scorer)
+    finally:
+        queue.close()
+    processes = [
+        multiprocessing.Process(target=_run_local_worker, args=(db_path, narratives_file, articles_file, scorer),
+                                kwargs={"lease_seconds": lease_seconds})
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,44 @@
+from dedup import BoilerplateFilter, remove_boilerplate
+
+COOKIE = "We use cookies to improve your experience."
+
+
+def _corpus(n_articles=4):
+    return {i: [COOKIE if i % 2 else COOKIE.upper(), f"Story {i} about sea cables.", "Subscribe now!"]
+            for i in range(n_articles)}
+
+
+def test_article_counts_ignore_case_punctuation_and_repeats_within_an_article():
+    f = BoilerplateFilter()
+    counts = f.article_counts({1: ["Subscribe now!", "subscribe  NOW"], 2: ["Subscribe now."], 3: ["Other"]})
+    assert counts[f.unit_key("subscribe now")] == 2
+    assert counts[f.unit_key("other")] == 1
+    # Numbers are part of a unit
+    assert f.unit_key("Story 1") != f.unit_key("Story 2")
+
+
+def test_collapse_keeps_first_copy_by_default():
+    kept, report = BoilerplateFilter(min_articles=3).filter(_corpus())
+    assert kept[0] == [COOKIE.upper(), "Story 0 about sea cables.", "Subscribe now!"]
+    for i in (1, 2, 3):
+        assert kept[i] == [f"Story {i} about sea cables."]
+    assert report["boilerplate_units"] == 2
+    assert report["removed_units"] == 6
+    assert report["total_units"] == 12
+    assert report["top_boilerplate"][0][0] == 4
+
+
+def test_drop_removes_every_copy():
+    kept, report = remove_boilerplate(_corpus(), min_articles=3, collapse=False)
+    assert all(kept[i] == [f"Story {i} about sea cables."] for i in range(4))
+    assert report["removed_units"] == 8
+    assert 0 < report["removed_tokens"] < report["total_tokens"]
+
+
+def test_min_share_raises_the_threshold_on_large_corpora():
+    corpus = _corpus(4)
+    corpus.update({i: [f"Unrelated story {i}."] for i in range(4, 100)})
+    _, report = BoilerplateFilter(min_articles=3, min_share=0.05).filter(corpus)
+    # 5% of 100 articles is 5, so units shared by 4 articles are kept
+    assert report["min_articles"] == 5
+    assert report["removed_units"] == 0
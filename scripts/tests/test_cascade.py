@@ -0,0 +1,75 @@
+import pytest
+
+import cascade
+from cascade import CascadeConfig, CascadeStats, run_cascade
+from llm_concurrency import MalformedResponseError
+from prompts import PromptTemplate
+from result_cache import ResultCache, cached_checked_result
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    stats = CascadeStats()
+    monkeypatch.setattr(cascade, "cascade_stats", stats)
+    return stats
+
+
+def _scorer(results):
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        result = results[model]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return call, calls
+
+
+def test_accepted_fast_model_is_not_escalated(fresh_stats):
+    config = CascadeConfig()
+    call, calls = _scorer({"small": {"score": 0.9, "confidence": 0.95}, "large": None})
+    assert run_cascade("agreement", ["small", "large"], call, config.accept_score) == \
+        ({"score": 0.9, "confidence": 0.95}, True)
+    assert calls == ["small"]
+    assert fresh_stats.summary()["agreement"]["small"]["escalated"] == 0
+
+
+@pytest.mark.parametrize("first", [
+    {"score": 0.9, "confidence": 0.3},                # low confidence
+    {"score": 0.2, "confidence": 0.95},               # borderline score
+    MalformedResponseError("not json"),               # unparseable
+])
+def test_escalates_to_the_next_model(first, fresh_stats):
+    config = CascadeConfig()
+    call, calls = _scorer({"small": first, "large": {"score": -0.8, "confidence": 0.9}})
+    assert run_cascade("agreement", ["small", "large"], call, config.accept_score) == \
+        ({"score": -0.8, "confidence": 0.9}, True)
+    assert calls == ["small", "large"]
+    stats = fresh_stats.summary()["agreement"]
+    assert (stats["small"]["escalated"], stats["large"]["escalated"]) == (1, 0)
+
+
+def test_rejected_last_result_is_flagged():
+    call, _ = _scorer({"small": "short", "large": "still short"})
+    assert run_cascade("narrative", ["small", "large"], call, lambda text: False) == ("still short", False)
+
+
+def test_last_model_errors_propagate():
+    call, _ = _scorer({"small": "short", "large": MalformedResponseError("bad")})
+    with pytest.raises(MalformedResponseError):
+        run_cascade("narrative", ["small", "large"], call, lambda text: False)
+
+
+def test_rejected_results_are_not_cached(tmp_path):
+    template = PromptTemplate("narrative", 1, "System.", "Write a narrative.", ["summaries"])
+    cache = ResultCache(str(tmp_path / "results.sqlite"))
+    answers = iter([("rejected", False), ("accepted", True), ("unused", True)])
+
+    def compute():
+        return next(answers)
+
+    assert cached_checked_result(cache, template, "summaries", compute, variant="cascade") == "rejected"
+    assert cached_checked_result(cache, template, "summaries", compute, variant="cascade") == "accepted"
+    assert cached_checked_result(cache, template, "summaries", compute, variant="cascade") == "accepted"
+    cache.close()
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "units": "run_units",
+    "narratives": "run_narratives",
+    "narratives-online": "run_narratives_online",
+    "topics": "run_topics",
+    "map": "run_map",
+    "combine": "run_combine",
+    "timeline": "run_timeline",
+    "scores": "run_scores",
+    "archive-fetch": "run_archive_fetch",
+    "archive-replay": "run_archive_replay",
+    "dedup": "run_dedup",
+    "embeddings": "run_embeddings",
+    "pipeline": "run_pipeline",
+    "shard-init": "run_shard_init",
+    "shard-worker": "run_shard_worker",
+    "shard-merge": "run_shard_merge",
+}
+
+
+def required_args(command):
+    return ["store.npy"] if command == "embeddings" else []
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replace every command function with a stub that records its arguments."""
+    recorded = []
+    for name in COMMANDS.values():
+        def stub(args, name=name):
+            recorded.append((name, args))
+            return 7
+        monkeypatch.setattr(cli, name, stub)
+    return recorded
+
+
+@pytest.mark.parametrize("command", sorted(COMMANDS))
+def test_main_dispatches_each_subcommand(calls, command):
+    assert cli.main([command] + required_args(command)) == 7
+    assert [name for name, _ in calls] == [COMMANDS[command]]
+    assert calls[0][1].command == command
+
+
+def test_subcommand_is_required():
+    with pytest.raises(SystemExit) as excinfo:
+        cli.build_parser().parse_args([])
+    assert excinfo.value.code == 2
+
+
+def test_unknown_choice_is_rejected(calls):
+    with pytest.raises(SystemExit):
+        cli.main(["map", "--scorer", "bert"])
+    assert calls == []
+
+
+def test_arguments_are_parsed_into_the_namespace(calls):
+    cli.main(["shard-worker", "--db", "q.db", "--scorer", "nli", "--processes", "3", "--lease-seconds", "5"])
+    args = calls[0][1]
+    assert (args.db, args.scorer, args.processes, args.lease_seconds) == ("q.db", "nli", 3, 5.0)
+
+    cli.main(["timeline", "--narrative", "2", "--location", "UK", "--location", "France", "--monthly"])
+    args = calls[1][1]
+    assert (args.narrative, args.location, args.monthly) == (2, ["UK", "France"], True)
+
+
+def test_cascade_options():
+    parser = cli.build_parser()
+    assert cli.cascade_from_args(parser.parse_args(["map"])) is None
+
+    config = cli.cascade_from_args(parser.parse_args(
+        ["map", "--cascade", "--min-confidence", "0.5", "--borderline", "0.2", "0.4", "--min-narrative-words", "50"]))
+    assert config.min_confidence == 0.5
+    assert config.borderline == (0.2, 0.4)
+    assert config.min_narrative_words == 50
+
+
+def test_profile_flag_enables_the_profiler(calls, monkeypatch, tmp_path):
+    from profiling import profiler
+    enabled = []
+    monkeypatch.setattr(profiler, "enable", enabled.append)
+    cli.main(["--profile", str(tmp_path), "dedup"])
+    assert enabled == [str(tmp_path)]
+    assert [name for name, _ in calls] == ["run_dedup"]
+
+
+def test_import_does_not_load_heavy_dependencies():
+    code = ("import sys, cli, combine, map_narratives; "
+            "print(sorted(m for m in ('pandas', 'torch', 'sklearn', 'openai') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
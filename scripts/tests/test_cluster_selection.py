@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+from threadpoolctl import threadpool_info, threadpool_limits
+
+import cluster_selection
+from cluster_selection import select_n_clusters
+
+
+def blas_threads():
+    return [pool["num_threads"] for pool in threadpool_info()]
+
+
+def _embeddings():
+    rng = np.random.RandomState(0)
+    return np.vstack([rng.normal(center, 0.05, size=(30, 8)) for center in np.eye(8)[:3]])
+
+
+def test_workers_are_single_threaded():
+    worker_threads = cluster_selection._kmeans_pool().submit(blas_threads).result()
+    assert worker_threads and all(n == 1 for n in worker_threads)
+
+
+def test_parallel_sweep_matches_serial_sweep():
+    serial = select_n_clusters(_embeddings(), max_workers=1)
+    parallel = select_n_clusters(_embeddings(), max_workers=3)
+    assert parallel[1] == serial[1] == 3
+    assert parallel[2] == serial[2]
+
+
+def test_concurrent_sweeps_leave_the_parent_limits_alone():
+    embeddings = _embeddings()
+    # Load sklearn's OpenMP runtime first, so that it is part of the original limits
+    select_n_clusters(embeddings, max_workers=1)
+    with threadpool_limits(limits=2):
+        original = blas_threads()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(select_n_clusters(embeddings, max_workers=3)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        # The limits of the parent stay as they were while the sweeps run
+        during = []
+        while any(thread.is_alive() for thread in threads):
+            during.append(blas_threads())
+        for thread in threads:
+            thread.join()
+        assert during and all(limits == original for limits in during)
+        assert blas_threads() == original
+    assert [k for _, k, _ in results] == [3] * 4
+
+
+def _sweep_in_daemon(queue):
+    queue.put(select_n_clusters(_embeddings(), max_workers=3)[1])
+
+
+def test_sweep_in_daemon_process_fits_in_threads():
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_sweep_in_daemon, args=(queue,), daemon=True)
+    process.start()
+    assert queue.get(timeout=60) == 3
+    process.join()
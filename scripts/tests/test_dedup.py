@@ -0,0 +1,58 @@
+import numpy as np
+
+from dedup import NearDuplicateDetector, dedup_report
+
+WORDS = [f"word{i}" for i in range(200)]
+
+
+def edited(words, positions):
+    words = list(words)
+    for position in positions:
+        words[position] = f"edit{position}"
+    return words
+
+
+def test_identical_and_distinct_texts():
+    detector = NearDuplicateDetector(threshold=0.8)
+    other = " ".join(f"other{i}" for i in range(200))
+    groups = detector.group({1: " ".join(WORDS), 2: other, 3: " ".join(WORDS)})
+    assert groups == {1: [1, 3], 2: [2]}
+    assert dedup_report(groups) == {"total": 3, "unique": 2, "duplicates": 1, "dedup_ratio": 1 / 3,
+                                    "largest_group": 2}
+
+
+def test_near_duplicate_chain_is_not_merged_transitively():
+    # Each step edits two words (Jaccard ~0.90); the ends of the chain differ in four (~0.81)
+    a = WORDS
+    b = edited(a, [40, 120])
+    c = edited(b, [80, 160])
+    detector = NearDuplicateDetector(threshold=0.86, num_perm=512, bands=64)
+    signatures = {name: detector.signature(" ".join(words)) for name, words in [("a", a), ("b", b), ("c", c)]}
+    assert np.mean(signatures["a"] == signatures["b"]) >= 0.86
+    assert np.mean(signatures["b"] == signatures["c"]) >= 0.86
+    assert np.mean(signatures["a"] == signatures["c"]) < 0.86
+
+    groups = detector.group({"a": " ".join(a), "b": " ".join(b), "c": " ".join(c)})
+    assert groups == {"a": ["a", "b"], "c": ["c"]}
+
+
+def test_empty_input():
+    assert NearDuplicateDetector().group({}) == {}
+    assert dedup_report({})["dedup_ratio"] == 0.0
+
+
+def test_signature_is_the_mod_p_universal_hash():
+    detector = NearDuplicateDetector(num_perm=16, bands=4)
+    text = " ".join(WORDS[:20])
+    shingles = [int(x) for x in detector.shingles(text)]
+    expected = [min(((int(a) * x + int(b)) % ((1 << 61) - 1)) & 0xFFFFFFFF for x in shingles)
+                for a, b in zip(detector._a, detector._b)]
+    assert [int(v) for v in detector.signature(text)] == expected
+
+
+def test_bucket_members_far_from_its_first_member_are_compared(monkeypatch):
+    # y and z share their first band with x but are only similar to each other
+    signatures = {"x": [1, 1, 9, 9], "y": [1, 1, 2, 3], "z": [1, 1, 2, 4]}
+    detector = NearDuplicateDetector(threshold=0.7, num_perm=4, bands=2)
+    monkeypatch.setattr(detector, "signature", lambda text: np.array(signatures[text], dtype=np.uint64))
+    assert detector.group({"x": "x", "y": "y", "z": "z"}) == {"x": ["x"], "y": ["y", "z"]}
@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore, cached_embeddings
+
+DIM = 4
+
+
+def vectors(n, offset=0):
+    return np.arange(offset * DIM, (offset + n) * DIM, dtype=np.float32).reshape(n, DIM)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "embeddings.dat"), DIM)
+    yield store
+    store.close()
+
+
+def test_add_and_get(store):
+    rows = store.add(["a", "b", "a"], np.vstack([vectors(2), vectors(1)]))
+    assert rows == [0, 1, 0]
+    assert len(store) == 2
+    found, missing = store.get_many(["b", "c", "a"])
+    assert missing == [1]
+    np.testing.assert_array_equal(found[[0, 2]], vectors(2)[[1, 0]])
+    np.testing.assert_array_equal(found[1], np.zeros(DIM))
+    # Stored texts are not appended again
+    store.add(["a"], vectors(1, offset=5))
+    np.testing.assert_array_equal(store.get("a"), vectors(1)[0])
+    assert store.matrix().shape == (2, DIM)
+
+
+def test_dimension_mismatch(store):
+    with pytest.raises(ValueError):
+        EmbeddingStore(store.path, DIM + 1)
+
+
+def test_compact_removes_deleted_rows(store):
+    store.add(["a", "b", "c"], vectors(3))
+    store.delete(["b"])
+    assert store.compact() == 1
+    assert store.data_path() == store.path + ".1"
+    assert store.matrix().shape == (2, DIM)
+    np.testing.assert_array_equal(store.get_many(["a", "c"])[0], vectors(3)[[0, 2]])
+    assert store.get("b") is None
+    # Appends go to the current data file
+    store.add(["d"], vectors(1, offset=3))
+    np.testing.assert_array_equal(store.get("d"), vectors(1, offset=3)[0])
+
+
+def test_reader_keeps_consistent_view_across_compaction(store):
+    store.add(["a", "b", "c"], vectors(3))
+    reader = EmbeddingStore(store.path, DIM)
+    rows, data_path = reader.rows(["c"]), reader.data_path()
+
+    store.delete(["a"])
+    store.compact()
+    # Rows looked up before the switch still match the data file they were looked up in
+    np.testing.assert_array_equal(reader.matrix(data_path)[rows], vectors(3)[[2]])
+    # New lookups see the compacted file
+    np.testing.assert_array_equal(reader.get("c"), vectors(3)[2])
+    assert reader.rows(["c"]) == [1]
+    reader.close()
+
+
+def test_previous_generation_removed_on_next_compaction(store):
+    store.add(["a", "b"], vectors(2))
+    store.delete(["a"])
+    store.compact()
+    assert os.path.exists(store.path)
+    store.compact()
+    assert not os.path.exists(store.path)
+    assert os.path.exists(store.path + ".1") and store.data_path() == store.path + ".2"
+    np.testing.assert_array_equal(store.get("b"), vectors(2)[1])
+
+
+def test_cached_embeddings_only_embeds_missing_texts(store):
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return np.vstack([np.full(DIM, len(t), dtype=np.float32) for t in texts])
+
+    first = cached_embeddings(store, ["x", "yy", "x"], embed)
+    second = cached_embeddings(store, ["yy", "zzz"], embed)
+    assert calls == [["x", "yy"], ["zzz"]]
+    np.testing.assert_array_equal(first[:, 0], [1, 2, 1])
+    np.testing.assert_array_equal(second[:, 0], [2, 3])
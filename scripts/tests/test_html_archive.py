@@ -0,0 +1,83 @@
+import pytest
+
+from html_archive import HtmlArchive, decode_html, replay_extraction
+
+
+def upper(html):
+    return html.upper()
+
+
+def test_raw_bytes_are_decoded_with_declared_or_sniffed_encoding(tmp_path):
+    path = str(tmp_path / "pages.dat")
+    archive = HtmlArchive(path, codec="zlib")
+    latin = "<p>café</p>".encode("iso-8859-1")
+    archive.append("http://a", latin, content_type="text/html; charset=ISO-8859-1")
+    archive.append("http://b", "<p>café</p>".encode("utf-8"), content_type="text/html")
+    archive.append("http://c", b'<meta charset="windows-1252"><p>caf\xe9</p>', content_type="text/html")
+    header, html = archive.latest("http://a")
+    assert header["encoding"] == "ISO-8859-1"
+    assert html == "<p>café</p>"
+    # No declared charset: UTF-8 rather than the ISO-8859-1 guess of requests
+    assert archive.latest("http://b")[1] == "<p>café</p>"
+    assert archive.latest("http://b")[0]["encoding"] is None
+    assert archive.latest("http://c")[1].endswith("<p>café</p>")
+    archive.close()
+
+
+def test_decode_html_falls_back_for_invalid_utf8():
+    assert decode_html(b"caf\xe9") == "café"
+    assert decode_html("café".encode("utf-8"), "no-such-codec") == "café"
+
+
+def test_replay_requires_an_existing_archive(tmp_path):
+    path = str(tmp_path / "missing.dat")
+    with pytest.raises(FileNotFoundError):
+        replay_extraction(path, upper)
+    assert not (tmp_path / "missing.dat").exists()
+    assert not (tmp_path / "missing.dat.index").exists()
+
+
+def test_readonly_archive_rejects_appends(tmp_path):
+    path = str(tmp_path / "pages.dat")
+    HtmlArchive(path, codec="zlib").close()
+    archive = HtmlArchive(path, readonly=True)
+    with pytest.raises(ValueError):
+        archive.append("http://a", b"<p>x</p>")
+    archive.close()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_corrupt_record_does_not_abort_replay(tmp_path, workers):
+    path = str(tmp_path / "pages.dat")
+    archive = HtmlArchive(path, codec="zlib")
+    for i in range(6):
+        archive.append(f"http://{i}", f"<p>page {i}</p>".encode("utf-8"), fetched_at=float(i))
+    _, _, _, offset, length, _ = archive.entries()[2]
+    archive.close()
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(b"\0" * length)
+
+    results = replay_extraction(path, upper, workers=workers, batch_size=2)
+    assert [url for url, _, _ in results] == [f"http://{i}" for i in range(6)]
+    assert results[2][2] == ""
+    assert results[3][2] == "<P>PAGE 3</P>"
+
+
+def test_fetches_with_the_same_time_yield_one_latest_entry(tmp_path):
+    path = str(tmp_path / "pages.dat")
+    archive = HtmlArchive(path, codec="zlib")
+    archive.append("http://a", b"<p>old</p>", fetched_at=5.0)
+    archive.append("http://a", b"<p>first</p>", fetched_at=10.0)
+    archive.append("http://a", b"<p>second</p>", fetched_at=10.0)
+    archive.append("http://b", b"<p>b</p>", fetched_at=10.0)
+
+    entries = archive.entries()
+    assert [url for _, url, _, _, _, _ in entries] == ["http://a", "http://b"]
+    assert archive.get(entries[0][0])[1] == "<p>second</p>"
+    assert archive.latest("http://a")[1] == "<p>second</p>"
+    assert len(archive.entries(latest_only=False)) == 4
+    archive.close()
+
+    results = replay_extraction(path, upper, workers=1)
+    assert [(url, text) for url, _, text in results] == [("http://a", "<P>SECOND</P>"), ("http://b", "<P>B</P>")]
@@ -0,0 +1,204 @@
+import json
+import threading
+
+import pytest
+
+from llm_concurrency import (AdaptiveLimiter, FairScheduler, MalformedResponseError, RetryPolicy,
+                             call_with_retries, is_rate_limit, is_transient, retry_after, run_concurrently)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+class RateLimitError(Exception):
+    """Same class name as the OpenAI exception."""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def flaky(errors, result="ok"):
+    """A callable that raises the given errors in turn, then returns result; records its calls."""
+    errors = list(errors)
+    calls = []
+
+    def fn(item):
+        calls.append(item)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn, calls
+
+
+def no_wait_policy(max_attempts=4, clock=None):
+    """A policy that records its delays instead of sleeping, advancing the fake clock if given."""
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if clock is not None:
+            clock.now += seconds
+    return RetryPolicy(max_attempts=max_attempts, sleep=sleep), sleeps
+
+
+def test_is_transient_classifies_errors():
+    assert is_transient(RateLimitError())
+    assert is_transient(TimeoutError()) and is_transient(ConnectionError())
+    assert is_transient(StatusError(429)) and is_transient(StatusError(503))
+    assert not is_transient(StatusError(400)) and not is_transient(StatusError(401))
+    assert is_transient(json.JSONDecodeError("bad", "", 0)) and is_transient(MalformedResponseError())
+    assert not is_transient(ValueError("bug"))
+    assert is_rate_limit(RateLimitError()) and is_rate_limit(StatusError(429))
+    assert not is_rate_limit(StatusError(500))
+
+
+def test_limiter_halves_on_rate_limit_within_bounds_and_pauses():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(max_concurrency=8, min_concurrency=2, clock=clock)
+    limiter.on_rate_limit(5.0)
+    assert limiter.limit == 4
+    assert limiter.paused_until == 105.0
+    limiter.on_rate_limit(1.0)
+    limiter.on_rate_limit(1.0)
+    assert limiter.limit == 2
+    # A shorter cool-down never shortens the pause
+    assert limiter.paused_until == 105.0
+
+
+def test_limiter_grows_by_one_per_increase_every_successes_up_to_max():
+    limiter = AdaptiveLimiter(max_concurrency=4, increase_every=3, clock=FakeClock())
+    limiter.on_rate_limit(0.0)
+    limiter.on_rate_limit(0.0)
+    assert limiter.limit == 1
+    for _ in range(2):
+        limiter.on_success()
+    assert limiter.limit == 1
+    limiter.on_success()
+    assert limiter.limit == 2
+    for _ in range(30):
+        limiter.on_success()
+    assert limiter.limit == 4
+
+
+def test_limiter_blocks_beyond_its_limit():
+    limiter = AdaptiveLimiter(max_concurrency=1)
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(2)
+    waiter.join()
+    assert limiter.in_flight == 1
+
+
+def test_transient_errors_are_retried_with_backoff():
+    fn, calls = flaky([TimeoutError(), StatusError(503)])
+    policy, sleeps = no_wait_policy()
+    limiter = AdaptiveLimiter(max_concurrency=2)
+    assert call_with_retries(fn, "item", limiter, policy) == "ok"
+    assert calls == ["item"] * 3
+    assert len(sleeps) == 2
+    assert 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0
+    assert limiter.in_flight == 0
+
+
+def test_rate_limit_uses_retry_after_and_lowers_the_limit():
+    fn, _ = flaky([StatusError(429, retry_after="7")])
+    clock = FakeClock()
+    policy, sleeps = no_wait_policy(clock=clock)
+    limiter = AdaptiveLimiter(max_concurrency=8, clock=clock)
+    assert call_with_retries(fn, "item", limiter, policy) == "ok"
+    assert sleeps == [7.0]
+    assert limiter.limit == 4
+    assert retry_after(StatusError(429, retry_after="120")) == 120.0
+    assert RetryPolicy(max_delay=30).delay(1, StatusError(429, retry_after="120")) == 30
+
+
+def test_permanent_error_is_not_retried():
+    fn, calls = flaky([StatusError(400)])
+    policy, sleeps = no_wait_policy()
+    with pytest.raises(StatusError):
+        call_with_retries(fn, "item", AdaptiveLimiter(), policy)
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_attempt_budget_is_respected():
+    fn, calls = flaky([TimeoutError()] * 5)
+    policy, sleeps = no_wait_policy(max_attempts=3)
+    with pytest.raises(TimeoutError):
+        call_with_retries(fn, "item", AdaptiveLimiter(), policy)
+    assert len(calls) == 3 and len(sleeps) == 2
+
+
+def test_run_concurrently_keeps_keys_in_order_and_reports_failures():
+    def fn(item):
+        if item == "bad":
+            raise ValueError("permanent")
+        return item * 2
+
+    policy, _ = no_wait_policy()
+    items = {key: ("bad" if key == 3 else key) for key in range(10, 0, -1)}
+    results, failures = run_concurrently(fn, items, max_concurrency=4, policy=policy)
+    assert list(results) == [key for key in items if key != 3]
+    assert all(results[key] == key * 2 for key in results)
+    assert failures == {3: "permanent"}
+
+
+def _run_order(weights, items):
+    """Order in which one worker serves tasks queued for several tenants at once."""
+    gate = threading.Event()
+    order = []
+    with FairScheduler(max_workers=1, policy=RetryPolicy(max_attempts=1)) as scheduler:
+        blocker = scheduler.submit("gate", lambda _: gate.wait(5), None)
+        for tenant, weight in weights.items():
+            scheduler.add_tenant(tenant, weight)
+        futures = [scheduler.submit(tenant, order.append, (tenant, i))
+                   for tenant, count in items.items() for i in range(count)]
+        gate.set()
+        blocker.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+    return [tenant for tenant, _ in order]
+
+
+def test_small_tenant_is_not_starved():
+    order = _run_order({"big": 1, "small": 1}, {"big": 10, "small": 2})
+    assert len(order) == 12
+    assert max(i for i, tenant in enumerate(order) if tenant == "small") < 4
+
+
+def test_weight_sets_tasks_per_turn():
+    order = _run_order({"big": 3, "small": 1}, {"big": 6, "small": 2})
+    assert order == ["big", "big", "big", "small", "big", "big", "big", "small"]
+
+
+def test_errors_reach_the_future_and_map_reports_failures():
+    def fn(item):
+        if item == "bad":
+            raise ValueError("permanent")
+        return item.upper()
+
+    with FairScheduler(max_workers=2) as scheduler:
+        results, failures = scheduler.map("topic", fn, {1: "ok", 2: "bad"})
+        with pytest.raises(ValueError):
+            scheduler.call("topic", fn, "bad")
+    assert results == {1: "OK"}
+    assert failures == {2: "permanent"}
+
+
+def test_submit_after_shutdown_raises():
+    scheduler = FairScheduler(max_workers=1)
+    scheduler.shutdown()
+    with pytest.raises(RuntimeError):
+        scheduler.submit("topic", str, 1)
@@ -0,0 +1,80 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from local_scorer import NLIAgreementScorer, split_claims, split_passages
+
+
+class StubCrossEncoder:
+    """Entails a claim found verbatim in the passage, contradicts one found with 'not' before it."""
+
+    def __init__(self, model_name, device=None):
+        config = types.SimpleNamespace(id2label={0: "CONTRADICTION", 1: "ENTAILMENT", 2: "NEUTRAL"})
+        self.model = types.SimpleNamespace(config=config)
+
+    def predict(self, pairs, batch_size=32, apply_softmax=True, show_progress_bar=False):
+        rows = []
+        for premise, hypothesis in pairs:
+            claim = hypothesis.rstrip(".")
+            if f"not {claim}" in premise:
+                rows.append([0.9, 0.05, 0.05])
+            elif claim in premise:
+                rows.append([0.05, 0.9, 0.05])
+            else:
+                rows.append([0.1, 0.1, 0.8])
+        return np.array(rows)
+
+
+@pytest.fixture
+def scorer(monkeypatch):
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_threads=lambda n: None))
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=StubCrossEncoder))
+    return NLIAgreementScorer(max_passage_words=6)
+
+
+def test_split_passages_and_claims():
+    assert split_passages("a b c d e", max_words=2) == ["a b", "c d", "e"]
+    assert split_passages("") == [""]
+    assert split_claims("Cables were cut on purpose. Ok.|Ships dragged their anchors") == \
+        ["Cables were cut on purpose.", "Ships dragged their anchors"]
+
+
+def test_score_is_entailment_minus_contradiction_over_claims(scorer):
+    article = "Officials said cables were cut deliberately. Ships did not drag anchors here."
+    pairs = [
+        (article, "cables were cut deliberately."),
+        (article, "drag anchors here."),
+        (article, "cables were cut deliberately. drag anchors here. The weather was calm."),
+    ]
+    # Each claim takes its strongest entailment and contradiction over the two passages
+    entailed, contradicted, neutral = 0.9 - 0.1, 0.1 - 0.9, 0.1 - 0.1
+    expected = [entailed, contradicted, np.mean([entailed, contradicted, neutral])]
+    np.testing.assert_allclose(scorer.raw_scores(pairs), expected, atol=1e-6)
+    scorer.slope, scorer.intercept = 2.0, 0.0
+    np.testing.assert_allclose(scorer.score_pairs(pairs), [1.0, -1.0, 0.0], atol=1e-6)
+
+
+def test_calibration_maps_raw_scores_onto_the_reference_scale(scorer, monkeypatch):
+    raw = np.array([-0.8, -0.4, 0.0, 0.4, 0.8], dtype=np.float32)
+    monkeypatch.setattr(scorer, "raw_scores", lambda pairs: raw[:len(pairs)])
+    pairs = [("article", "narrative")] * 5
+    scorer.calibrate(pairs, 0.5 * raw + 0.1)
+    assert scorer.slope == pytest.approx(0.5, abs=1e-5)
+    assert scorer.intercept == pytest.approx(0.1, abs=1e-5)
+    np.testing.assert_allclose(scorer.score_pairs(pairs), 0.5 * raw + 0.1, atol=1e-5)
+
+
+@pytest.mark.parametrize("raw, reference, n_pairs", [
+    ([-0.8, -0.4, 0.0, 0.4, 0.8], [0.8, 0.4, 0.0, -0.4, -0.8], 5),   # negative slope
+    ([-0.8, -0.4, 0.0, 0.4, 0.8], [0.2, 0.2, 0.2, 0.2, 0.2], 5),     # flat
+    ([0.3, 0.3, 0.3, 0.3, 0.3], [-0.5, 0.0, 0.5, 0.2, 0.1], 5),      # no variation
+    ([-0.8, 0.8], [-0.4, 0.4], 2),                                    # too few pairs
+])
+def test_degenerate_calibration_falls_back_to_identity(scorer, monkeypatch, raw, reference, n_pairs):
+    raw = np.array(raw, dtype=np.float32)
+    monkeypatch.setattr(scorer, "raw_scores", lambda pairs: raw[:len(pairs)])
+    scorer.slope, scorer.intercept = 2.0, 0.3
+    scorer.calibrate([("article", "narrative")] * n_pairs, reference)
+    assert (scorer.slope, scorer.intercept) == (1.0, 0.0)
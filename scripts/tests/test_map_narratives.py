@@ -0,0 +1,67 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from llm_concurrency import AdaptiveLimiter, RetryPolicy
+from map_narratives import NarrativeMapper
+
+
+class ConcurrencyProbe:
+    """Stub chat scorer that tracks how many requests are in flight at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+
+    def __call__(self, article_text, narrative, model="gpt-4o-mini"):
+        with self.lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+        if article_text == "bad":
+            raise ValueError("permanent")
+        return {"score": 0.5, "confidence": 0.9}
+
+
+@pytest.fixture
+def mapper(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    mapper = NarrativeMapper()
+    mapper.limiter = AdaptiveLimiter(max_concurrency=3)
+    mapper.retry_policy = RetryPolicy(max_attempts=1)
+    mapper.request_agreement = ConcurrencyProbe()
+    return mapper
+
+
+def test_pairs_are_scored_concurrently_within_the_limit(mapper):
+    articles = {a: f"article {a}" for a in range(8)}
+    articles[5] = "bad"
+    calls = []
+    results = mapper.map_narratives_to_articles({1: "n1", 2: "n2"}, articles, dedup_threshold=None,
+                                                on_pair=lambda: calls.append(1))
+    assert 1 < mapper.request_agreement.peak <= 3
+    assert len(calls) == 16
+    assert results.unresolved() == [(1, 5), (2, 5)]
+    assert np.nanmin(results.values) == 0.5
+    np.testing.assert_allclose(results.confidence[0, 0], 0.9)
+
+
+def test_on_pair_error_stops_scoring(mapper):
+    class Abandon(Exception):
+        pass
+
+    def on_pair():
+        raise Abandon()
+
+    with pytest.raises(Abandon):
+        mapper.map_narratives_to_articles({1: "n1"}, {a: f"article {a}" for a in range(30)},
+                                          dedup_threshold=None, on_pair=on_pair)
+    # Requests that had not started were cancelled
+    assert mapper.request_agreement.calls < 30
@@ -0,0 +1,124 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gen_narratives2 import NarrativeGenerator
+from online_clustering import OnlineClusterer
+
+
+def test_novel_embeddings_start_clusters():
+    clusterer = OnlineClusterer(dim=2, novelty_threshold=0.9)
+    labels = clusterer.partial_fit(np.array([[1, 0], [0.99, 0.1], [0, 1], [-1, 0]]))
+    assert labels == [0, 0, 1, 2]
+    assert clusterer.n_clusters == 3
+    assert list(clusterer.counts) == [2, 1, 1]
+    np.testing.assert_array_equal(clusterer.predict(np.array([[0.1, 1], [-1, 0.1]])), [1, 2])
+    np.testing.assert_allclose(np.linalg.norm(clusterer.centroids, axis=1), 1.0, rtol=1e-6)
+
+
+def test_predict_without_clusters():
+    assert list(OnlineClusterer(dim=2).predict(np.ones((2, 2)))) == [-1, -1]
+
+
+def test_drift_and_regeneration():
+    clusterer = OnlineClusterer(dim=2, novelty_threshold=0.5)
+    clusterer.partial_fit(np.array([[1, 0]]))
+    assert clusterer.drifted_clusters(0.01) == []
+    # Members at ~37 degrees pull the centroid away from the anchor
+    clusterer.partial_fit(np.array([[0.8, 0.6]] * 3))
+    assert clusterer.drift()[0] > 0.01
+    assert clusterer.drifted_clusters(0.01) == [0]
+    clusterer.mark_regenerated([0])
+    assert clusterer.drifted_clusters(0.01) == []
+
+
+def test_save_and_load(tmp_path):
+    clusterer = OnlineClusterer(dim=2, novelty_threshold=0.7, max_count=10)
+    clusterer.partial_fit(np.array([[1, 0], [0, 1]]))
+    clusterer.save(str(tmp_path / "state.npz"))
+    loaded = OnlineClusterer.load(str(tmp_path / "state.npz"))
+    assert (loaded.novelty_threshold, loaded.max_count) == (0.7, 10)
+    np.testing.assert_array_equal(loaded.centroids, clusterer.centroids)
+    np.testing.assert_array_equal(loaded.counts, clusterer.counts)
+
+
+class StubGenerator(NarrativeGenerator):
+    """Summaries, embeddings and narratives without API calls; embeddings come from the article text."""
+    EMBEDDING_DIM = 2
+
+    def __init__(self, fail_narratives=False):
+        super().__init__()
+        self.fail_narratives = fail_narratives
+        self.narrative_requests = []
+
+    def summarize_articles(self, articles):
+        return {a: {"Text": data["text"]} for a, data in articles.items()}, {}
+
+    def generate_embeddings(self, texts):
+        return np.array([[1.0, 0.0] if "cable" in text else [0.0, 1.0] for text in texts])
+
+    def request_narrative(self, summaries, article_ids):
+        self.narrative_requests.append(list(article_ids))
+        if self.fail_narratives:
+            raise RuntimeError("API down")
+        return f"narrative of {len(article_ids)}"
+
+
+def write_articles(path, rows):
+    pd.DataFrame(rows, columns=["URL", "Title", "Full Text of Article"]).to_csv(path, index=False)
+
+
+def test_online_state_is_keyed_by_url(tmp_path):
+    csv_file, state = str(tmp_path / "articles.csv"), str(tmp_path / "state")
+    write_articles(csv_file, [("u1", "A", "cable cut"), ("u2", "B", "ship seized")])
+    first = StubGenerator().process_articles_online(csv_file, state)
+    assert first["new_articles"] == 2 and first["num_clusters"] == 2
+
+    # Re-sorted and extended CSV: only u3 is new, and article ids follow the current rows
+    write_articles(csv_file, [("u3", "C", "another cable cut"), ("u2", "B", "ship seized"), ("u1", "A", "cable cut")])
+    generator = StubGenerator()
+    second = generator.process_articles_online(csv_file, state, novelty_threshold=0.5)
+    assert second["new_articles"] == 1
+    assert second["num_clusters"] == 2
+    assert sorted(second["narratives"][0]["article_ids"]) == [0, 2]
+    assert second["narratives"][1]["article_ids"] == [1]
+
+    with open(state + ".json") as f:
+        saved = json.load(f)
+    assert saved["members"] == {"0": ["u1", "u3"], "1": ["u2"]}
+    assert saved["clusterer_file"] == "state.2.npz"
+    assert not (tmp_path / "state.1.npz").exists()
+
+
+def test_novelty_threshold_applies_to_loaded_state(tmp_path):
+    csv_file, state = str(tmp_path / "articles.csv"), str(tmp_path / "state")
+    write_articles(csv_file, [("u1", "A", "cable cut")])
+    StubGenerator().process_articles_online(csv_file, state, novelty_threshold=0.5)
+    write_articles(csv_file, [("u1", "A", "cable cut"), ("u2", "B", "cable ship")])
+    # Identical embeddings (similarity 1.0) still start a new cluster above a threshold of 1.1
+    result = StubGenerator().process_articles_online(csv_file, state, novelty_threshold=1.1)
+    assert result["num_clusters"] == 2
+
+
+def test_failed_narratives_are_retried(tmp_path):
+    csv_file, state = str(tmp_path / "articles.csv"), str(tmp_path / "state")
+    write_articles(csv_file, [("u1", "A", "cable cut")])
+    failed = StubGenerator(fail_narratives=True).process_articles_online(csv_file, state)
+    assert failed["regenerated_clusters"] == [] and failed["pending_clusters"] == [0]
+    assert failed["narratives"] == {}
+
+    generator = StubGenerator()
+    retried = generator.process_articles_online(csv_file, state)
+    assert retried["new_articles"] == 0
+    assert retried["regenerated_clusters"] == [0] and retried["pending_clusters"] == []
+    assert retried["narratives"][0]["narrative"] == "narrative of 1"
+
+
+def test_legacy_state_is_rejected(tmp_path):
+    csv_file, state = str(tmp_path / "articles.csv"), str(tmp_path / "state")
+    write_articles(csv_file, [("u1", "A", "cable cut")])
+    with open(state + ".json", "w") as f:
+        json.dump({"summaries": {}, "members": {}, "narratives": {}}, f)
+    assert "predates" in StubGenerator().process_articles_online(csv_file, state)["error"]
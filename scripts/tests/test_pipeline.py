@@ -0,0 +1,77 @@
+import os
+import pickle
+
+import pytest
+
+from pipeline import Pipeline, Stage, build_pipeline
+
+
+def double(item):
+    return item * 2
+
+
+def total(items):
+    return [sum(items)]
+
+
+def crash(item):
+    os._exit(3)
+
+
+def test_standard_pipeline_stages_pickle():
+    pipeline = build_pipeline("articles.csv", n_clusters=3, local_mode="process")
+    for stage in pipeline.stages:
+        pickle.loads(pickle.dumps(stage))
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_process_stages(start_method):
+    pipeline = Pipeline([
+        Stage("double", double, workers=2, mode="process"),
+        Stage("total", total, barrier=True, mode="process"),
+    ], start_method=start_method)
+    stats = pipeline.run(range(10))
+    assert stats["double"] == {"processed": 10, "emitted": 10, "errors": 0}
+    assert stats["total"] == {"processed": 10, "emitted": 1, "errors": 0}
+
+
+def test_dead_worker_process_raises():
+    pipeline = Pipeline([Stage("crash", crash, mode="process"), Stage("double", double)], poll_seconds=0.1)
+    with pytest.raises(RuntimeError, match="crash"):
+        pipeline.run(range(3))
+
+
+class StubMapper:
+    def __init__(self):
+        self.saved = None
+
+    def evaluate_agreement_detailed(self, article_text, narrative):
+        return None if article_text == "unscorable" else {"score": 0.5, "confidence": 0.8}
+
+    def save_results(self, results, output_file):
+        self.saved = results
+
+
+class StubGenerator:
+    def save_narratives_to_csv(self, narratives, narratives_file):
+        pass
+
+
+def test_score_and_combine_keep_confidence_and_unresolved_pairs(monkeypatch):
+    import combine
+    import pipeline
+
+    mapper = StubMapper()
+    monkeypatch.setattr(pipeline, "_get_mapper", lambda: mapper)
+    monkeypatch.setattr(pipeline, "_get_generator", lambda: StubGenerator())
+    monkeypatch.setattr(combine, "combine_data", lambda *args: None)
+
+    pairs = [pipeline.score_stage({"narrative_id": 1, "narrative": "n", "article_ids": [10, 11],
+                                   "article_id": article_id, "article_text": text})
+             for article_id, text in ((10, "scorable"), (11, "unscorable"))]
+    pipeline.combine_stage(pairs, "articles.csv", "narratives.csv", "mapping.csv", "combined.csv")
+
+    matrix = mapper.saved
+    assert matrix.unresolved() == [(1, 11)]
+    assert matrix.values[0, 0] == 0.5
+    assert matrix.confidence[0, 0] == pytest.approx(0.8)
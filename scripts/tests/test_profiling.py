@@ -0,0 +1,92 @@
+import glob
+import json
+import os
+import threading
+import tracemalloc
+
+import pytest
+
+from pipeline import Pipeline, Stage
+from profiling import PROFILE_DIR_ENV, profiled, profiler
+
+
+@profiled("square")
+def square(x):
+    return sum(i * i for i in range(x * 100))
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    was_tracing = tracemalloc.is_tracing()
+    monkeypatch.setenv(PROFILE_DIR_ENV, str(tmp_path))
+    profiler.enable(str(tmp_path))
+    yield tmp_path
+    profiler.output_dir = None
+    profiler._reset()
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def test_child_process_writes_its_profile(profile_dir):
+    Pipeline([Stage("square", square, workers=2, mode="process")]).run(range(20))
+    child_summaries = [path for path in glob.glob(str(profile_dir / "summary.*.json"))
+                       if not path.endswith(f".{os.getpid()}.json")]
+    assert len(child_summaries) == 2
+    calls = 0
+    for path in child_summaries:
+        pid = path.split(".")[-2]
+        assert os.path.exists(profile_dir / f"square.{pid}.prof")
+        with open(path) as f:
+            calls += json.load(f)["square"]["calls"]
+    # Each child reports only its own calls, not state copied from the parent
+    assert calls == 20
+
+
+def test_one_profile_and_sampler_per_process(profile_dir):
+    threads_before = threading.active_count()
+    for x in range(50):
+        square(x)
+    assert threading.active_count() == threads_before + 1
+    assert list(profiler._profiles) == ["square"]
+    assert profiler.summary()["square"]["calls"] == 50
+    profiler.write()
+    assert os.path.exists(profile_dir / f"square.{os.getpid()}.prof")
+
+
+def test_concurrent_threads_share_the_stage(profile_dir):
+    threads = [threading.Thread(target=lambda: [square(50) for _ in range(20)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert profiler.summary()["square"]["calls"] == 80
+    assert profiler._profiling_stage is None
+
+
+def test_overlapping_thread_stage_keeps_its_peak(profile_dir):
+    big_freed, small_started = threading.Event(), threading.Event()
+
+    def big():
+        with profiler.stage("big"):
+            buffer = bytearray(32 * 2**20)
+            del buffer
+            big_freed.set()
+            small_started.wait(5)
+
+    def small():
+        big_freed.wait(5)
+        with profiler.stage("small"):
+            small_started.set()
+
+    threads = [threading.Thread(target=big), threading.Thread(target=small)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = profiler.summary()
+    # The second stage's reset of the process-wide peak does not hide the first one's peak
+    assert summary["big"]["peak_memory_bytes"] >= 32 * 2**20
+    assert summary["big"]["overlapping_calls"] == 1
+    assert summary["small"]["overlapping_calls"] == 1
+    assert summary["small"]["peak_memory_bytes"] < 32 * 2**20
@@ -0,0 +1,102 @@
+import json
+import threading
+import types
+
+import pytest
+
+from prompts import (AGREEMENT, AGREEMENT_SCHEMA, CABLE_DIMENSIONS, PromptStats, PromptTemplate,
+                     article_summary_template, normalize_whitespace)
+
+
+def template(version=1, system="You are an analyst.", instructions="Summarize the article.\n\nBe brief."):
+    return PromptTemplate("summary", version, system, instructions, ["title", "article"])
+
+
+def usage(prompt_tokens, cached_tokens=None):
+    details = types.SimpleNamespace(cached_tokens=cached_tokens) if cached_tokens is not None else None
+    return types.SimpleNamespace(prompt_tokens=prompt_tokens, prompt_tokens_details=details)
+
+
+def test_normalize_whitespace():
+    text = """
+        First   line\t with  spaces   
+
+
+        Second line
+    """
+    assert normalize_whitespace(text) == "First line with spaces\n\nSecond line"
+
+
+def test_cache_key_changes_with_version_and_static_text():
+    key = template().cache_key
+    assert key.startswith("summary@v1:")
+    assert template().cache_key == key
+    assert template(version=2).cache_key != key
+    assert template(instructions="Summarize the article.\n\nBe thorough.").cache_key != key
+    assert template(system="You are an editor.").cache_key != key
+
+
+def test_whitespace_only_edits_keep_the_cache_key():
+    key = template().cache_key
+    assert template(instructions="""
+        Summarize   the article.
+
+
+
+        Be brief.   
+    """).cache_key == key
+    assert template(system="  You are an  analyst. ").cache_key == key
+
+
+def test_messages_put_static_text_first_and_sections_in_order():
+    messages = template().messages(article="Body  text\n\n\n\nmore", title="  Title ")
+    assert messages[0] == {"role": "system", "content": "You are an analyst."}
+    assert messages[1]["content"] == "Summarize the article.\n\nBe brief.\n\nTITLE:\nTitle\n\nARTICLE:\nBody text\n\nmore"
+    # The static prefix is identical whatever the variable content
+    other = template().messages(article="Other", title="Other")[1]["content"]
+    assert other.startswith("Summarize the article.\n\nBe brief.\n\n")
+    with pytest.raises(KeyError):
+        template().messages(article="Body")
+
+
+def test_summary_template_lists_every_dimension():
+    summary = article_summary_template(CABLE_DIMENSIONS)
+    for dimension in CABLE_DIMENSIONS:
+        assert dimension in summary.instructions
+    assert "six dimensions" in summary.instructions
+
+
+def test_prompt_stats_totals_and_cached_fraction():
+    stats = PromptStats()
+    tpl = template()
+    stats.record(tpl, usage(100, cached_tokens=64))
+    stats.record(tpl, usage(50))
+    stats.record(tpl, None)
+    summary = stats.summary()[tpl.cache_key]
+    assert (summary["calls"], summary["prompt_tokens"], summary["cached_tokens"]) == (2, 150, 64)
+    assert summary["avg_prompt_tokens"] == 75
+    assert summary["cached_fraction"] == pytest.approx(64 / 150)
+    assert summary["static_tokens"] == tpl.static_tokens > 0
+
+
+def test_prompt_stats_is_thread_safe():
+    stats = PromptStats()
+    tpl = template()
+    threads = [threading.Thread(target=lambda: [stats.record(tpl, usage(1)) for _ in range(500)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.summary()[tpl.cache_key]["calls"] == 4000
+
+
+def test_agreement_prompt_and_schema():
+    assert AGREEMENT.sections == ["narrative", "article"]
+    content = AGREEMENT.messages(narrative="N", article="A")[1]["content"]
+    assert content.index("NARRATIVE:") < content.index("ARTICLE:")
+    schema = AGREEMENT_SCHEMA["json_schema"]
+    assert AGREEMENT_SCHEMA["type"] == "json_schema" and schema["strict"]
+    assert set(schema["schema"]["required"]) == {"score", "confidence"}
+    assert schema["schema"]["additionalProperties"] is False
+    # The schema is sent as is, so it has to be plain JSON
+    assert json.loads(json.dumps(AGREEMENT_SCHEMA)) == AGREEMENT_SCHEMA
@@ -0,0 +1,46 @@
+from prompts import PromptTemplate
+from result_cache import ResultCache, cached_result
+
+
+def _template(version=1, instructions="Summarize the article."):
+    return PromptTemplate("summary", version, "You are an analyst.", instructions, ["article"])
+
+
+def test_key_changes_with_version_static_text_variant_and_input():
+    base = ResultCache.key(_template(), "text")
+    assert ResultCache.key(_template(), "text") == base
+    # Whitespace-only edits normalize to the same prompt
+    assert ResultCache.key(_template(instructions="  Summarize   the article. "), "text") == base
+    others = {
+        ResultCache.key(_template(version=2), "text"),
+        ResultCache.key(_template(instructions="Summarize briefly."), "text"),
+        ResultCache.key(_template(), "text", variant="gpt-4o-mini"),
+        ResultCache.key(_template(), "other text"),
+    }
+    assert base not in others
+    assert len(others) == 4
+
+
+def test_cached_result_computes_once_and_persists(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"summary": "s"}
+
+    cache = ResultCache(path)
+    assert cached_result(cache, _template(), "text", compute) == {"summary": "s"}
+    assert cached_result(cache, _template(), "text", compute) == {"summary": "s"}
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    reopened = ResultCache(path)
+    assert cached_result(reopened, _template(), "text", compute) == {"summary": "s"}
+    assert cached_result(reopened, _template(version=2), "text", compute) == {"summary": "s"}
+    reopened.close()
+    assert len(calls) == 2
+
+
+def test_no_cache_always_computes():
+    assert cached_result(None, _template(), "text", lambda: 3) == 3
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from score_matrix import ScoreMatrix
+
+
+@pytest.fixture
+def matrix():
+    matrix = ScoreMatrix([1, 2], [10, 11, 12], confidence=np.zeros((2, 3)))
+    matrix.set(1, 10, 0.5)
+    matrix.set(2, 10, -0.5)
+    matrix.set(2, 12, 1.0)
+    matrix.confidence[:, 0] = [0.9, 0.8]
+    return matrix
+
+
+def test_fan_out_copies_representative_columns(matrix):
+    matrix.fan_out({10: [10, 11], 12: [12]})
+    np.testing.assert_array_equal(matrix.values[:, 1], [0.5, -0.5])
+    np.testing.assert_allclose(matrix.confidence[:, 1], [0.9, 0.8])
+    assert np.isnan(matrix.values[0, 2])
+
+
+def test_to_long_skips_unscored_pairs(matrix):
+    long = matrix.to_long()
+    assert list(long["narrative_id"]) == [1, 2, 2]
+    assert list(long["article_id"]) == [10, 10, 12]
+    np.testing.assert_array_equal(long["agreement_score"], [0.5, -0.5, 1.0])
+    np.testing.assert_allclose(long["confidence"], [0.9, 0.8, 0.0])
+    assert "confidence" not in ScoreMatrix([1], [10]).to_long()
+
+
+def test_unresolved_lists_nan_pairs(matrix):
+    assert matrix.unresolved() == [(1, 11), (1, 12), (2, 11)]
+    matrix.fan_out({10: [10, 11]})
+    assert matrix.unresolved() == [(1, 12)]
+
+
+def test_triples_round_trip(matrix):
+    triples = matrix.to_triples()
+    assert triples == [(1, 10, 0.5), (2, 10, -0.5), (2, 12, 1.0)]
+    rebuilt = ScoreMatrix.from_triples(triples + [(1, 12, None)])
+    assert rebuilt.unresolved() == [(1, 12)]
+    assert len(matrix.to_triples(include_missing=True)) == 6
+
+
+def test_save_and_load(matrix, tmp_path):
+    matrix.save(str(tmp_path / "scores.npz"))
+    loaded = ScoreMatrix.load(str(tmp_path / "scores.npz"))
+    np.testing.assert_array_equal(loaded.values, matrix.values)
+    np.testing.assert_array_equal(loaded.confidence, matrix.confidence)
+    assert loaded.column(12) == 2
+
+
+def test_group_summary(matrix):
+    summary = matrix.group_summary({10: "US", 11: "US", 12: "UK"})
+    rows = sorted(zip(summary["narrative_id"], summary["group"], summary["count"], summary["mean"]))
+    assert rows == [(1, "US", 1, 0.5), (2, "UK", 1, 1.0), (2, "US", 1, -0.5)]
+
+
+def test_long_round_trip_with_missing_pairs(matrix):
+    long = matrix.to_long(include_missing=True)
+    assert len(long["narrative_id"]) == 6
+    assert np.isnan(long["agreement_score"]).sum() == 3
+    rebuilt = ScoreMatrix.from_long(long)
+    np.testing.assert_array_equal(rebuilt.values, matrix.values)
+    np.testing.assert_array_equal(rebuilt.confidence, matrix.confidence)
+    assert rebuilt.unresolved() == matrix.unresolved()
+
+
+def test_from_long_with_explicit_ids():
+    matrix = ScoreMatrix.from_long({"narrative_id": [1], "article_id": [11], "agreement_score": [None]},
+                                   narrative_ids=[1, 2], article_ids=[10, 11])
+    assert matrix.shape == (2, 2)
+    assert len(matrix.unresolved()) == 4
+    assert matrix.confidence is None
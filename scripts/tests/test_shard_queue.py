@@ -0,0 +1,263 @@
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+import time
+import types
+
+import numpy as np
+import pytest
+
+import map_narratives
+from score_matrix import ScoreMatrix
+from shard_queue import LeaseLostError, ShardQueue, run_local, run_worker
+
+
+def long(*triples, confidence=None):
+    """Shard results in ScoreMatrix.to_long() form."""
+    columns = {
+        "narrative_id": np.array([n for n, _, _ in triples]),
+        "article_id": np.array([a for _, a, _ in triples]),
+        "agreement_score": np.array([s for _, _, s in triples], dtype=np.float32),
+    }
+    if confidence is not None:
+        columns["confidence"] = np.array(confidence, dtype=np.float32)
+    return columns
+
+
+def scored(queue):
+    return queue.merge().to_triples()
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = ShardQueue(str(tmp_path / "shards.db"), lease_seconds=60)
+    queue.create([1, 2], [10, 11, 12], articles_per_shard=2)
+    yield queue
+    queue.close()
+
+
+def expire(queue, shard):
+    queue.conn.execute("UPDATE shards SET lease_expires = ? WHERE shard_id = ?", (time.time() - 1, shard.shard_id))
+
+
+def test_create_partitions_pairs(queue):
+    assert queue.progress() == {"pending": 4}
+    shard = queue.claim("w1")
+    assert (shard.narrative_ids, shard.article_ids) == ([1], [10, 11])
+
+
+def test_create_refuses_existing_queue_unless_reset(queue):
+    with pytest.raises(ValueError):
+        queue.create([1], [10])
+    shard = queue.claim("w1")
+    queue.complete(shard, "w1", long((1, 10, 0.5)))
+    assert queue.create([1], [10], reset=True) == 1
+    assert queue.progress() == {"pending": 1}
+    assert scored(queue) == []
+
+
+def test_claimed_shard_is_not_claimed_twice(queue):
+    first, second = queue.claim("w1"), queue.claim("w2")
+    assert first.shard_id != second.shard_id
+    assert queue.complete(first, "w1", long((1, 10, 0.5), (1, 11, -0.2)))
+    assert scored(queue) == [(1, 10, 0.5), (1, 11, pytest.approx(-0.2))]
+
+
+def test_expired_lease_is_reclaimed(queue):
+    shard = queue.claim("w1")
+    expire(queue, shard)
+    reclaimed = queue.claim("w2")
+    assert reclaimed.shard_id == shard.shard_id
+    # The original worker can neither renew nor complete the shard any more
+    with pytest.raises(LeaseLostError):
+        queue.renew(shard, "w1")
+    assert not queue.complete(shard, "w1", long((1, 10, 0.5)))
+    assert queue.complete(reclaimed, "w2", long((1, 10, 0.7)))
+    assert scored(queue) == [(1, 10, pytest.approx(0.7))]
+
+
+def test_renewed_lease_is_not_reclaimed(queue):
+    shard = queue.claim("w1")
+    queue.conn.execute("UPDATE shards SET lease_expires = ? WHERE shard_id = ?", (time.time() + 0.05, shard.shard_id))
+    queue.renew(shard, "w1")
+    time.sleep(0.1)
+    assert queue.claim("w2").shard_id != shard.shard_id
+
+
+def test_heartbeat_renews_after_a_third_of_the_lease(tmp_path):
+    queue = ShardQueue(str(tmp_path / "shards.db"), lease_seconds=0.3)
+    queue.create([1], [10])
+    shard = queue.claim("w1")
+    beat = queue.heartbeat(shard, "w1")
+    for _ in range(6):
+        time.sleep(0.1)
+        beat()
+    assert queue.claim("w2") is None
+    queue.close()
+
+
+def test_expired_lease_on_last_attempt_fails_the_shard(tmp_path):
+    queue = ShardQueue(str(tmp_path / "shards.db"), lease_seconds=60, max_attempts=2)
+    queue.create([1], [10])
+    for worker in ("w1", "w2"):
+        shard = queue.claim(worker)
+        expire(queue, shard)
+    assert queue.claim("w3") is None
+    assert queue.progress() == {"failed": 1}
+    queue.close()
+
+
+def test_failed_shard_is_retried_up_to_max_attempts(tmp_path):
+    queue = ShardQueue(str(tmp_path / "shards.db"), max_attempts=2)
+    queue.create([1], [10])
+    queue.fail(queue.claim("w1"), "w1", "boom")
+    assert queue.progress() == {"pending": 1}
+    queue.fail(queue.claim("w1"), "w1", "boom")
+    assert queue.progress() == {"failed": 1}
+    assert queue.claim("w1") is None
+    queue.close()
+
+
+def test_merge_keeps_unresolved_pairs_and_confidence(tmp_path):
+    queue = ShardQueue(str(tmp_path / "shards.db"))
+    queue.create([1], [10, 11, 12, 13], articles_per_shard=2, duplicate_groups={10: [10, 12], 11: [11], 13: [13]})
+    shard = queue.claim("w1")
+    assert shard.article_ids == [10, 11]
+    queue.complete(shard, "w1", long((1, 10, 0.5), (1, 11, math.nan), confidence=[0.9, math.nan]))
+
+    matrix = queue.merge()
+    assert list(matrix.article_ids) == [10, 11, 12, 13]
+    # 12 is a duplicate of 10; 11 was unresolved and 13 belongs to a shard that never finished
+    np.testing.assert_array_equal(matrix.values[0, [0, 2]], [0.5, 0.5])
+    assert matrix.unresolved() == [(1, 11), (1, 13)]
+    np.testing.assert_allclose(matrix.confidence[0, [0, 2]], [0.9, 0.9])
+    queue.close()
+
+
+def test_merge_without_confidence(queue):
+    queue.complete(queue.claim("w1"), "w1", long((1, 10, 0.5), (1, 11, 0.1)))
+    assert queue.merge().confidence is None
+
+
+def test_old_results_table_gains_confidence_column(tmp_path):
+    path = str(tmp_path / "shards.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE results (narrative_id INTEGER NOT NULL, article_id INTEGER NOT NULL, "
+                 "agreement_score REAL, shard_id INTEGER NOT NULL, PRIMARY KEY (narrative_id, article_id))")
+    conn.close()
+    queue = ShardQueue(path)
+    queue.create([1], [10])
+    queue.complete(queue.claim("w1"), "w1", long((1, 10, 0.5), confidence=[0.8]))
+    np.testing.assert_allclose(queue.merge().confidence, [[0.8]])
+    queue.close()
+
+
+class StubMapper:
+    """NarrativeMapper stand-in that scores without a model and logs every shard it scores."""
+    log_path = None
+    # The first worker to create this file hangs on its shard, like a stuck or killed process
+    hang_path = None
+
+    def __init__(self, scorer="chat"):
+        self.local_scorer = types.SimpleNamespace(slope=1.0, intercept=0.0) if scorer == "nli" else None
+
+    def load_narratives(self, narratives_file):
+        return {1: "n1", 2: "n2"}
+
+    def load_articles(self, articles_file):
+        return {a: f"a{a}" for a in range(10, 16)}
+
+    def map_narratives_to_articles(self, narratives, articles, dedup_threshold=None, on_pair=None):
+        if self.hang_path:
+            try:
+                os.close(os.open(self.hang_path, os.O_CREAT | os.O_EXCL))
+                time.sleep(60)
+            except FileExistsError:
+                pass
+        slope, intercept = (self.local_scorer.slope, self.local_scorer.intercept) if self.local_scorer else (1, 0)
+        matrix = ScoreMatrix(sorted(narratives), sorted(articles))
+        for n in narratives:
+            for a in articles:
+                matrix.set(n, a, slope * raw_score(n, a) + intercept)
+                on_pair()
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps([os.getpid(), sorted(narratives), sorted(articles)]) + "\n")
+        return matrix
+
+
+def raw_score(narrative_id, article_id):
+    return (narrative_id * 100 + article_id) / 1000
+
+
+@pytest.fixture
+def stub_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(map_narratives, "NarrativeMapper", StubMapper)
+    monkeypatch.setattr(StubMapper, "log_path", str(tmp_path / "scored.jsonl"))
+    db = str(tmp_path / "shards.db")
+    queue = ShardQueue(db)
+    queue.create([1, 2], list(range(10, 16)), articles_per_shard=2)
+    yield db, queue
+    queue.close()
+
+
+def scored_shards(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_local_worker_processes_complete_every_shard_once(stub_queue):
+    db, queue = stub_queue
+    run_local(db, "narratives.csv", "articles.csv", workers=3, lease_seconds=30)
+
+    assert queue.progress() == {"done": 6}
+    assert queue.conn.execute("SELECT MAX(attempts) FROM shards").fetchone()[0] == 1
+    shards = [(tuple(n), tuple(a)) for _, n, a in scored_shards(StubMapper.log_path)]
+    assert len(shards) == len(set(shards)) == 6
+    matrix = queue.merge()
+    assert matrix.unresolved() == []
+    assert matrix.values[1, 5] == pytest.approx(raw_score(2, 15))
+
+
+def test_killed_worker_lease_is_reclaimed_by_another_process(stub_queue, tmp_path, monkeypatch):
+    db, queue = stub_queue
+    monkeypatch.setattr(StubMapper, "hang_path", str(tmp_path / "hung"))
+    doomed = multiprocessing.Process(target=run_worker, args=(db, "narratives.csv", "articles.csv"),
+                                     kwargs={"worker_id": "doomed", "lease_seconds": 1})
+    doomed.start()
+    deadline = time.time() + 20
+    while not os.path.exists(StubMapper.hang_path) and time.time() < deadline:
+        time.sleep(0.05)
+    doomed.kill()
+    doomed.join()
+    stuck = queue.conn.execute("SELECT shard_id FROM shards WHERE worker_id = 'doomed'").fetchone()[0]
+    time.sleep(1.1)
+
+    run_local(db, "narratives.csv", "articles.csv", workers=2, lease_seconds=1)
+    assert queue.progress() == {"done": 6}
+    worker_id, attempts = queue.conn.execute(
+        "SELECT worker_id, attempts FROM shards WHERE shard_id = ?", (stuck,)).fetchone()
+    assert worker_id != "doomed"
+    assert attempts == 2
+    assert len(scored_shards(StubMapper.log_path)) == 6
+    assert queue.merge().unresolved() == []
+
+
+def test_nli_workers_apply_the_queue_calibration(stub_queue):
+    db, queue = stub_queue
+    with pytest.raises(ValueError, match="calibration"):
+        run_local(db, "narratives.csv", "articles.csv", workers=2, scorer="nli")
+    with pytest.raises(ValueError, match="calibration"):
+        run_worker(db, "narratives.csv", "articles.csv", scorer="nli")
+
+    queue.set_calibration(0.5, 0.1)
+    assert run_worker(db, "narratives.csv", "articles.csv", scorer="nli") == 6
+    assert queue.merge().values[0, 0] == pytest.approx(0.5 * raw_score(1, 10) + 0.1)
+
+
+def test_reset_clears_calibration(queue):
+    queue.set_calibration(0.5, 0.1)
+    assert queue.calibration() == (0.5, 0.1)
+    queue.create([1], [10], reset=True)
+    assert queue.calibration() is None
@@ -0,0 +1,61 @@
+import os
+
+import pandas as pd
+
+from timeline_index import TimelineIndex, build_timeline_index
+
+
+def _combined(titles):
+    return pd.DataFrame({
+        "narrative_id": [1] * len(titles),
+        "article_id": list(range(len(titles))),
+        "agreement_score": [0.5] * len(titles),
+        "Title": titles,
+        "Media Location": ["US"] * len(titles),
+        "Published Date": ["2023-01-15"] * len(titles),
+    })
+
+
+def test_rebuild_swaps_versions_and_keeps_open_readers(tmp_path):
+    root = str(tmp_path / "timeline")
+    build_timeline_index(_combined(["a", "b"]), root)
+    reader = TimelineIndex(root)
+
+    build_timeline_index(_combined(["c"]), root)
+    assert os.path.islink(root)
+    assert list(TimelineIndex(root).query(1)["Title"]) == ["c"]
+    # A reader opened before the rebuild stays on its complete version
+    assert list(reader.query(1)["Title"]) == ["a", "b"]
+
+    build_timeline_index(_combined(["d"]), root)
+    versions = sorted(p.name for p in tmp_path.iterdir() if p.name.startswith("timeline.v"))
+    assert versions == ["timeline.v2", "timeline.v3"]
+
+
+def test_rebuild_replaces_unversioned_index(tmp_path):
+    root = tmp_path / "timeline"
+    root.mkdir()
+    (root / "manifest.json").write_text('{"version": 1, "locations": [], "partitions": []}')
+    build_timeline_index(_combined(["a"]), str(root))
+    assert os.path.islink(root)
+    assert list(TimelineIndex(str(root)).query(1)["Title"]) == ["a"]
+
+
+def test_rebuild_between_resolving_and_reading_keeps_one_version(tmp_path, monkeypatch):
+    import timeline_index
+
+    root = str(tmp_path / "timeline")
+    build_timeline_index(_combined(["a", "b"]), root)
+    realpath = os.path.realpath
+
+    def resolve_then_rebuild(path):
+        resolved = realpath(path)
+        monkeypatch.setattr(timeline_index.os.path, "realpath", realpath)
+        build_timeline_index(_combined(["c"]), root)
+        return resolved
+
+    monkeypatch.setattr(timeline_index.os.path, "realpath", resolve_then_rebuild)
+    reader = TimelineIndex(root)
+    assert os.path.basename(os.readlink(root)) == "timeline.v2"
+    assert [p["rows"] for p in reader.partitions] == [2]
+    assert list(reader.query(1)["Title"]) == ["a", "b"]
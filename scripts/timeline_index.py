@@ -0,0 +1,202 @@
+"""
+Narrative timeline index partitioned by narrative and publication month.
+
+The combined narrative/article table is written as one small CSV per
+(narrative, month) with media locations normalized once and stored as
+integer codes, plus a manifest listing the location categories and every
+partition with its row count and location codes. Queries for one narrative over
+a time range and a set of locations open only the matching partitions, so
+the cost follows the size of the answer rather than the whole corpus.
+
+    root/manifest.json
+    root/narrative=<id>/<YYYY-MM>.csv    (or undated.csv)
+
+root is a symlink to a versioned sibling directory (root.v<N>). A rebuild
+writes the next version and swaps the link atomically, so readers always
+see a complete index; the previous version is kept for readers still on it.
+"""
+import glob
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from combine import normalize_media_location
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+UNDATED = "undated"
+PARTITION_COLUMNS = ["article_id", "agreement_score", "Title", "location_code", "Published Date"]
+
+
+def _to_month(dates: pd.Series) -> pd.Series:
+    """YYYY-MM of each date, UNDATED where the date is missing or unparseable."""
+    parsed = pd.to_datetime(dates, errors='coerce', utc=True)
+    return parsed.dt.strftime('%Y-%m').fillna(UNDATED)
+
+
+def _version_dir(root: str, version: int) -> str:
+    return f"{root.rstrip(os.sep)}.v{version}"
+
+
+def _current_version(root: str) -> int:
+    """Version root currently points at, 0 if root is missing or a plain directory."""
+    if not os.path.islink(root):
+        return 0
+    target = os.readlink(root)
+    try:
+        return int(target.rsplit(".v", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _swap_in(root: str, version_dir: str) -> None:
+    """Point root at version_dir in one rename."""
+    root = root.rstrip(os.sep)
+    if os.path.isdir(root) and not os.path.islink(root):
+        # Index written before versioning: keep it as the previous version
+        os.replace(root, _version_dir(root, 0))
+    link = root + ".link"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, root)
+
+
+def _remove_old_versions(root: str, keep: Iterable[int]) -> None:
+    keep_dirs = {_version_dir(root, v) for v in keep}
+    for path in glob.glob(glob.escape(root.rstrip(os.sep)) + ".v*"):
+        if path not in keep_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def build_timeline_index(combined: pd.DataFrame, root: str) -> Dict[str, Any]:
+    """
+    Partition a combined narrative/article table (the output of combine_data) under root.
+    The index is built in the next version directory and swapped in when complete.
+    Returns the manifest.
+    """
+    df = combined.copy()
+    df['Media Location'] = df['Media Location'].apply(normalize_media_location)
+    locations = sorted({loc for loc in df['Media Location'] if isinstance(loc, str) and loc})
+    codes = {loc: code for code, loc in enumerate(locations)}
+    df['location_code'] = df['Media Location'].map(codes).fillna(-1).astype('int32')
+    df['month'] = _to_month(df['Published Date'])
+
+    previous = _current_version(root)
+    version = previous + 1
+    staging = _version_dir(root, version)
+    shutil.rmtree(staging, ignore_errors=True)
+    partitions = []
+    for (narrative_id, month), part in df.groupby(['narrative_id', 'month'], sort=True):
+        relative = os.path.join(f"narrative={int(narrative_id)}", f"{month}.csv")
+        os.makedirs(os.path.join(staging, os.path.dirname(relative)), exist_ok=True)
+        part = part.sort_values('Published Date')
+        part[PARTITION_COLUMNS].to_csv(os.path.join(staging, relative), index=False)
+        partitions.append({
+            "narrative_id": int(narrative_id),
+            "month": month,
+            "path": relative,
+            "rows": len(part),
+            "location_codes": sorted(int(c) for c in part['location_code'].unique()),
+        })
+
+    manifest = {"version": 1, "locations": locations, "partitions": partitions}
+    os.makedirs(staging, exist_ok=True)
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    _swap_in(root, staging)
+    _remove_old_versions(root, keep=(previous, version))
+    logger.info(f"Timeline index with {len(partitions)} partitions and {len(locations)} locations written to {root}")
+    return manifest
+
+
+class TimelineIndex:
+    """Read side of a timeline index built by build_timeline_index."""
+
+    def __init__(self, root: str):
+        # Resolve the link once so a rebuild cannot mix manifests and partitions
+        self.root = os.path.realpath(root)
+        with open(os.path.join(self.root, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.locations: List[str] = manifest["locations"]
+        self.partitions: List[Dict[str, Any]] = manifest["partitions"]
+        self._location_codes = {loc: code for code, loc in enumerate(self.locations)}
+
+    @property
+    def narrative_ids(self) -> List[int]:
+        return sorted({p["narrative_id"] for p in self.partitions})
+
+    def select_partitions(self, narrative_id: Optional[int] = None, start: Optional[str] = None,
+                          end: Optional[str] = None,
+                          location_codes: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        """Manifest entries that may hold rows matching the filters."""
+        start_month = pd.Timestamp(start).strftime('%Y-%m') if start else None
+        end_month = pd.Timestamp(end).strftime('%Y-%m') if end else None
+        wanted = set(location_codes) if location_codes is not None else None
+        selected = []
+        for partition in self.partitions:
+            if narrative_id is not None and partition["narrative_id"] != narrative_id:
+                continue
+            month = partition["month"]
+            if month == UNDATED:
+                if start or end:
+                    continue
+            elif (start_month and month < start_month) or (end_month and month > end_month):
+                continue
+            if wanted is not None and wanted.isdisjoint(partition["location_codes"]):
+                continue
+            selected.append(partition)
+        return selected
+
+    def query(self, narrative_id: Optional[int] = None, start: Optional[str] = None, end: Optional[str] = None,
+              locations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Rows of the combined table for a narrative (all if None), published between start and
+        end (inclusive, any pandas-parseable date), in the given media locations.
+        Undated articles are only returned when no date range is given.
+        """
+        codes = None
+        if locations is not None:
+            codes = {self._location_codes[loc] for loc in locations if loc in self._location_codes}
+        selected = self.select_partitions(narrative_id, start, end, codes)
+
+        frames = []
+        for partition in selected:
+            part = pd.read_csv(os.path.join(self.root, partition["path"]))
+            if codes is not None:
+                part = part[part['location_code'].isin(codes)]
+            part.insert(0, 'narrative_id', partition["narrative_id"])
+            frames.append(part)
+        if not frames:
+            return pd.DataFrame(columns=['narrative_id', 'article_id', 'agreement_score', 'Title',
+                                         'Media Location', 'Published Date'])
+        df = pd.concat(frames, ignore_index=True)
+
+        if start or end:
+            # Month partitions bound the range; trim the days at its edges
+            dates = pd.to_datetime(df['Published Date'], errors='coerce', utc=True)
+            keep = dates.notna()
+            if start:
+                keep &= dates >= pd.Timestamp(start, tz='UTC')
+            if end:
+                keep &= dates < pd.Timestamp(end, tz='UTC') + pd.Timedelta(days=1)
+            df = df[keep].copy()
+
+        df['Media Location'] = pd.Categorical.from_codes(df['location_code'], categories=self.locations)
+        return df.drop(columns='location_code')[['narrative_id', 'article_id', 'agreement_score', 'Title',
+                                                 'Media Location', 'Published Date']].reset_index(drop=True)
+
+    def monthly_summary(self, narrative_id: int, start: Optional[str] = None, end: Optional[str] = None,
+                        locations: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Article count and mean agreement per month and media location for one narrative."""
+        df = self.query(narrative_id, start, end, locations)
+        df['month'] = _to_month(df['Published Date'])
+        return (df.groupby(['month', 'Media Location'], observed=True)['agreement_score']
+                .agg(['count', 'mean']).reset_index())
@@ -0,0 +1,127 @@
+"""
+Topic configurations and concurrent multi-topic runs.
+
+A topic names its input CSV, the subject used in the narrative prompt, the
+summary dimensions with their guiding questions, and the details the unit
+narratives should identify; anything left out falls back to the undersea
+cable topic the scripts were written for. Topics are read from a JSON file:
+
+    {"topics": [{"name": "cables", "articles_file": "webset-articles_cut_sea_cables.csv"},
+                {"name": "pipelines", "articles_file": "pipelines.csv",
+                 "subject": "gas pipeline sabotage",
+                 "dimensions": {"Blame Attribution": ["Who is blamed?"], "...": []},
+                 "weight": 2}]}
+
+run_topics executes several topics at once in one process: they share the
+OpenAI client, one FairScheduler (worker pool, rate limiter and retries),
+one embedding store and one result cache.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from prompts import (ARTICLE_SUMMARY, CABLE_DIMENSIONS, CABLE_SUBJECT, CLUSTER_NARRATIVE, NARRATIVE_POINTS,
+                     UNIT_NARRATIVE, article_summary_template, cluster_narrative_template, prompt_stats,
+                     unit_narrative_template)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class TopicConfig:
+    """Topic-specific inputs and prompts of a narrative run."""
+
+    def __init__(self, name: str, articles_file: str, subject: str = CABLE_SUBJECT,
+                 dimensions: Optional[Dict[str, List[str]]] = None, narrative_points: Optional[List[str]] = None,
+                 unit_details: Optional[str] = None, max_articles: Optional[int] = None,
+                 n_clusters: Optional[int] = None, output_file: Optional[str] = None, weight: int = 1):
+        self.name = name
+        self.articles_file = articles_file
+        self.subject = subject
+        self.dimensions = dimensions or CABLE_DIMENSIONS
+        self.narrative_points = narrative_points or NARRATIVE_POINTS
+        self.max_articles = max_articles
+        self.n_clusters = n_clusters
+        self.output_file = output_file or f"narratives_{name}.csv"
+        # Tasks taken from this topic's queue per round of the shared scheduler
+        self.weight = weight
+
+        # Topics that keep the cable prompts share their templates, and so their cached results
+        if dimensions is None:
+            self.summary_template = ARTICLE_SUMMARY
+        else:
+            self.summary_template = article_summary_template(self.dimensions, name=f"article_summary[{name}]")
+        if dimensions is None and narrative_points is None and subject == CABLE_SUBJECT:
+            self.narrative_template = CLUSTER_NARRATIVE
+        else:
+            self.narrative_template = cluster_narrative_template(subject, list(self.dimensions), self.narrative_points,
+                                                                 name=f"cluster_narrative[{name}]")
+        if unit_details is None:
+            self.unit_template = UNIT_NARRATIVE
+        else:
+            self.unit_template = unit_narrative_template(unit_details, name=f"unit_narrative[{name}]")
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TopicConfig":
+        return cls(**data)
+
+
+CABLE_TOPIC = TopicConfig("cable_cutting", "webset-articles_cut_sea_cables.csv", output_file="narratives.csv")
+
+
+def load_topics(path: str) -> List[TopicConfig]:
+    """Read topic configurations from a JSON file with a "topics" list (or a bare list)."""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    entries = data["topics"] if isinstance(data, dict) else data
+    topics = [TopicConfig.from_dict(entry) for entry in entries]
+    names = [topic.name for topic in topics]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate topic names in {path}: {names}")
+    return topics
+
+
+def run_topics(topics: List[TopicConfig], max_workers: int = 16, embedding_store_path: Optional[str] = None,
+               cache_path: Optional[str] = None, dedup_threshold: float = 0.8,
+               cascade: Optional[Any] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Run the narrative generation of every topic concurrently and save each topic's narratives.
+    LLM calls of all topics go through one FairScheduler with max_workers workers.
+    cascade is an optional CascadeConfig used by every topic.
+    Returns the process_articles result of each topic by name.
+    """
+    from embedding_store import EmbeddingStore
+    from gen_narratives2 import NarrativeGenerator
+    from llm_concurrency import FairScheduler, RetryPolicy
+    from result_cache import ResultCache
+
+    embedding_store = EmbeddingStore(embedding_store_path, NarrativeGenerator.EMBEDDING_DIM) if embedding_store_path else None
+    result_cache = ResultCache(cache_path) if cache_path else None
+    results = {}
+    with FairScheduler(max_workers=max_workers, policy=RetryPolicy(max_attempts=4)) as scheduler:
+        for topic in topics:
+            scheduler.add_tenant(topic.name, topic.weight)
+
+        def run(topic: TopicConfig) -> Dict[str, Any]:
+            generator = NarrativeGenerator(topic=topic, scheduler=scheduler, embedding_store=embedding_store,
+                                           result_cache=result_cache, cascade=cascade)
+            result = generator.process_articles(topic.articles_file, max_articles=topic.max_articles,
+                                                n_clusters=topic.n_clusters, dedup_threshold=dedup_threshold)
+            if "error" not in result:
+                generator.save_narratives_to_csv(result['narratives'], topic.output_file)
+            return result
+
+        # Topic threads only coordinate; the LLM calls they issue run on the scheduler's workers
+        with ThreadPoolExecutor(max_workers=len(topics) or 1) as executor:
+            for topic, result in zip(topics, executor.map(run, topics)):
+                results[topic.name] = result
+
+    if result_cache is not None:
+        logger.info(f"Result cache: {result_cache.hits} hits, {result_cache.misses} misses")
+        result_cache.close()
+    if embedding_store is not None:
+        embedding_store.close()
+    prompt_stats.log_summary()
+    return results
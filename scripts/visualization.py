@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -18,6 +19,20 @@ def load_data():
     df['Published Date'] = pd.to_datetime(df['Published Date'])
     return df
 
+TIMELINE_MANIFEST = os.path.join("narrative_timeline", "manifest.json")
+
+@st.cache_resource
+def load_timeline_index(manifest_mtime):
+    # Partitioned by narrative and month when the pipeline was run with --timeline;
+    # keyed on the manifest mtime so a rebuilt index replaces the cached one
+    if manifest_mtime is None:
+        return None
+    from timeline_index import TimelineIndex
+    return TimelineIndex("narrative_timeline")
+
+def timeline_manifest_mtime():
+    return os.path.getmtime(TIMELINE_MANIFEST) if os.path.exists(TIMELINE_MANIFEST) else None
+
 @st.cache_data
 def load_narratives():
     narratives_df = pd.read_csv("narratives.csv")
@@ -142,12 +157,16 @@ min_date, max_date = st.slider(
     value=(df['Published Date'].min().to_pydatetime(), df['Published Date'].max().to_pydatetime())
 )
 
-# Filter the data based on selections
-filtered_df = df[
-    (df['narrative_id'] == selected_narrative) &
-    (df['Published Date'] >= pd.Timestamp(min_date)) &
-    (df['Published Date'] <= pd.Timestamp(max_date))
-]
+# Filter the data based on selections, reading only the matching partitions when an index exists
+timeline_index = load_timeline_index(timeline_manifest_mtime())
+if timeline_index is not None:
+    filtered_df = timeline_index.query(int(selected_narrative), min_date.strftime('%Y-%m-%d'), max_date.strftime('%Y-%m-%d'))
+else:
+    filtered_df = df[
+        (df['narrative_id'] == selected_narrative) &
+        (df['Published Date'] >= pd.Timestamp(min_date)) &
+        (df['Published Date'] <= pd.Timestamp(max_date))
+    ]
 
 # Show the filtered data
 st.dataframe(filtered_df)
@@ -14,10 +14,118 @@ const narrativeArticleItemSchema = z.object({
   publishedDate: z.string().nullable(),
 });
 
+type NarrativeArticleItem = z.infer<typeof narrativeArticleItemSchema>;
+
+// Optional filters; without them every row is returned
+const narrativeArticleFilterSchema = z
+  .object({
+    narrativeId: z.number().optional(),
+    startDate: z.string().optional(),
+    endDate: z.string().optional(),
+    mediaLocations: z.array(z.string()).optional(),
+  })
+  .optional();
+
+type NarrativeArticleFilter = z.infer<typeof narrativeArticleFilterSchema>;
+
+// Manifest of the narrative/month partitioned index written by scripts/timeline_index.py
+interface TimelineManifest {
+  locations: string[];
+  partitions: Array<{
+    narrative_id: number;
+    month: string;
+    path: string;
+    rows: number;
+    location_codes: number[];
+  }>;
+}
+
+function inDateRange(
+  publishedDate: string | null,
+  filter: NarrativeArticleFilter,
+): boolean {
+  if (!filter?.startDate && !filter?.endDate) return true;
+  if (!publishedDate) return false;
+  const day = publishedDate.slice(0, 10);
+  if (filter.startDate && day < filter.startDate) return false;
+  if (filter.endDate && day > filter.endDate) return false;
+  return true;
+}
+
+function readTimelineIndex(
+  indexDir: string,
+  filter: NarrativeArticleFilter,
+): NarrativeArticleItem[] {
+  // indexDir is a symlink swapped on rebuild; resolve it once so the manifest
+  // and the partitions come from the same version
+  const versionDir = fs.realpathSync(indexDir);
+  const manifest = JSON.parse(
+    fs.readFileSync(path.join(versionDir, "manifest.json"), "utf8"),
+  ) as TimelineManifest;
+
+  const wantedCodes = filter?.mediaLocations
+    ? new Set(
+        filter.mediaLocations
+          .map((location) => manifest.locations.indexOf(location))
+          .filter((code) => code >= 0),
+      )
+    : null;
+  const startMonth = filter?.startDate?.slice(0, 7);
+  const endMonth = filter?.endDate?.slice(0, 7);
+
+  const items: NarrativeArticleItem[] = [];
+  for (const partition of manifest.partitions) {
+    if (
+      filter?.narrativeId !== undefined &&
+      partition.narrative_id !== filter.narrativeId
+    )
+      continue;
+    if (partition.month === "undated") {
+      if (startMonth || endMonth) continue;
+    } else if (
+      (startMonth && partition.month < startMonth) ||
+      (endMonth && partition.month > endMonth)
+    )
+      continue;
+    if (
+      wantedCodes &&
+      !partition.location_codes.some((code) => wantedCodes.has(code))
+    )
+      continue;
+
+    const records = parse(
+      fs.readFileSync(path.join(versionDir, partition.path), "utf8"),
+      { columns: true, skip_empty_lines: true },
+    );
+    for (const record of records as any[]) {
+      const locationCode = parseInt(record["location_code"], 10);
+      if (wantedCodes && !wantedCodes.has(locationCode)) continue;
+      const publishedDate = record["Published Date"] || null;
+      if (!inDateRange(publishedDate, filter)) continue;
+      items.push({
+        narrativeId: partition.narrative_id,
+        articleId: parseInt(record["article_id"], 10),
+        agreementScore: parseFloat(record["agreement_score"]),
+        title: record["Title"] || "",
+        mediaLocation: manifest.locations[locationCode] ?? null,
+        publishedDate,
+      });
+    }
+  }
+  return items;
+}
+
 export const getNarrativeArticleData = procedure
+  .input(narrativeArticleFilterSchema)
   .output(z.array(narrativeArticleItemSchema))
-  .query(async () => {
+  .query(async ({ input }) => {
     try {
+      // Prefer the partitioned index, which only reads the requested narrative and months
+      const indexDir = path.join(process.cwd(), "narrative_timeline");
+      if (fs.existsSync(path.join(indexDir, "manifest.json"))) {
+        return readTimelineIndex(indexDir, input);
+      }
+
       // Path to the CSV file
       const csvFilePath = path.join(
         process.cwd(),
@@ -38,16 +146,26 @@ export const getNarrativeArticleData = procedure
       });
 
       // Transform the data to match our schema
-      const narrativeArticleData = records.map((record: any) => ({
-        narrativeId: parseInt(record["narrative_id"], 10),
-        articleId: parseInt(record["article_id"], 10),
-        agreementScore: parseFloat(record["agreement_score"]),
-        title: record["Title"] || "",
-        mediaLocation: record["Media Location"] || null,
-        publishedDate: record["Published Date"] || null,
-      }));
+      const narrativeArticleData: NarrativeArticleItem[] = records.map(
+        (record: any) => ({
+          narrativeId: parseInt(record["narrative_id"], 10),
+          articleId: parseInt(record["article_id"], 10),
+          agreementScore: parseFloat(record["agreement_score"]),
+          title: record["Title"] || "",
+          mediaLocation: record["Media Location"] || null,
+          publishedDate: record["Published Date"] || null,
+        }),
+      );
 
-      return narrativeArticleData;
+      return narrativeArticleData.filter(
+        (item) =>
+          (input?.narrativeId === undefined ||
+            item.narrativeId === input.narrativeId) &&
+          (!input?.mediaLocations ||
+            (item.mediaLocation !== null &&
+              input.mediaLocations.includes(item.mediaLocation))) &&
+          inDateRange(item.publishedDate, input),
+      );
     } catch (error) {
       console.error("Error in getNarrativeArticleData procedure:", error);
       // Return an empty array instead of throwing to prevent UI crashes